@@ -0,0 +1,74 @@
+"""
+Batch analysis: several items per prompt, bounded parallelism, ordered results.
+
+Items are packed AI_BATCH_PACK_SIZE to a prompt and the model returns one JSON
+object per item tagged with its index. Each entry is validated on its own, so
+one malformed entry only costs a single-item retry for that item instead of
+redoing the whole pack. Packs (and retries) run concurrently under a
+semaphore of AI_BATCH_CONCURRENCY.
+"""
+import asyncio
+import os
+import google.generativeai as genai
+from pydantic import ValidationError
+from schemas import parse_json_text
+from structured import JSON_CONFIG, generate_structured
+
+AI_BATCH_PACK_SIZE = int(os.getenv("AI_BATCH_PACK_SIZE", "8"))
+AI_BATCH_CONCURRENCY = int(os.getenv("AI_BATCH_CONCURRENCY", "4"))
+AI_BATCH_MAX_ITEMS = int(os.getenv("AI_BATCH_MAX_ITEMS", "200"))
+
+
+def packed_prompt(single_prompts):
+    """Combine per-item prompts into one that answers all of them"""
+    sections = "\n".join(
+        f"### Item {index}\n{prompt.strip()}\n" for index, prompt in enumerate(single_prompts)
+    )
+    return (
+        "Answer each item below independently.\n\n"
+        f"{sections}\n"
+        'Return a JSON object {"results": [...]} with one object per item, in order. '
+        'Each object has an "index" key with the item number plus the keys requested for that item.'
+    )
+
+
+async def run_batch(model_name, prompts, schema):
+    """
+    Ordered list of {"ok": True, "result": {...}} / {"ok": False, "error": str}
+    for each prompt, using packed calls with single-item fallback.
+    """
+    semaphore = asyncio.Semaphore(AI_BATCH_CONCURRENCY)
+    model = genai.GenerativeModel(model_name, generation_config=JSON_CONFIG)
+    results = [None] * len(prompts)
+
+    async def single(index):
+        async with semaphore:
+            try:
+                results[index] = {"ok": True, "result": (await generate_structured(model_name, prompts[index], schema)).model_dump()}
+            except Exception as e:
+                results[index] = {"ok": False, "error": str(e)}
+
+    async def pack(indices):
+        async with semaphore:
+            try:
+                response = await model.generate_content_async(packed_prompt([prompts[i] for i in indices]))
+                entries = parse_json_text(response.text).get("results", [])
+            except Exception as e:
+                print(f"Packed batch call failed, retrying items singly: {e}")
+                entries = []
+        for position, entry in enumerate(entries if isinstance(entries, list) else []):
+            if not isinstance(entry, dict):
+                continue
+            local_index = entry.pop("index", position)
+            if not isinstance(local_index, int) or not 0 <= local_index < len(indices):
+                continue
+            try:
+                results[indices[local_index]] = {"ok": True, "result": schema.model_validate(entry).model_dump()}
+            except ValidationError:
+                continue
+        await asyncio.gather(*(single(i) for i in indices if results[i] is None))
+
+    chunks = [list(range(start, min(start + AI_BATCH_PACK_SIZE, len(prompts))))
+              for start in range(0, len(prompts), AI_BATCH_PACK_SIZE)]
+    await asyncio.gather(*(pack(chunk) for chunk in chunks))
+    return results
@@ -0,0 +1,81 @@
+"""
+Image preprocessing before Gemini Vision calls.
+
+Uploads are decoded once, downsampled to AI_IMAGE_MAX_EDGE, stripped of EXIF
+and re-encoded to a compact JPEG/WebP. Decoding runs in a process pool so the
+event loop keeps serving other requests while a large HEIC is being decoded.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+AI_IMAGE_MAX_EDGE = int(os.getenv("AI_IMAGE_MAX_EDGE", "1536"))
+AI_IMAGE_FORMAT = os.getenv("AI_IMAGE_FORMAT", "JPEG").upper()
+AI_IMAGE_QUALITY = int(os.getenv("AI_IMAGE_QUALITY", "85"))
+AI_IMAGE_WORKERS = int(os.getenv("AI_IMAGE_WORKERS", "2"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+if AI_IMAGE_FORMAT not in MIME_TYPES:
+    raise ValueError(f"AI_IMAGE_FORMAT must be one of {', '.join(MIME_TYPES)}, got {AI_IMAGE_FORMAT!r}")
+
+_executor = None
+
+
+def preprocess_image(data: bytes, max_edge: int = AI_IMAGE_MAX_EDGE,
+                     image_format: str = AI_IMAGE_FORMAT,
+                     quality: int = AI_IMAGE_QUALITY) -> dict:
+    """Return an inline Gemini blob ({mime_type, data}) for the downsampled image"""
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported output format: {image_format}")
+    image = Image.open(io.BytesIO(data))
+    if image.format == "JPEG":
+        # Decode at a reduced DCT scale instead of full resolution
+        image.draft("RGB", (max_edge, max_edge))
+
+    # Apply EXIF orientation before the metadata is dropped
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=quality, optimize=True)
+    return {"mime_type": MIME_TYPES[image_format], "data": output.getvalue()}
+
+
+def get_executor():
+    global _executor
+    if AI_IMAGE_WORKERS <= 0:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=AI_IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+async def preprocess_async(data: bytes) -> dict:
+    """Preprocess in the process pool without blocking the event loop"""
+    executor = get_executor()
+    if executor is None:
+        return preprocess_image(data)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, preprocess_image, data)
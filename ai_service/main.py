@@ -1,10 +1,16 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Optional
 import google.generativeai as genai
-from PIL import Image
-import io
 import os
+from imaging import preprocess_async
+from streaming import SSE_HEADERS, stream_completion
+from schemas import RequestAnalysis, DisputeSummary
+from structured import StructuredOutputError, generate_structured
+from batch import AI_BATCH_MAX_ITEMS, run_batch
+from scheduler import Shed, scheduler
 
 # Initialize FastAPI
 app = FastAPI(title="AI Service for ServeFlow")
@@ -23,15 +29,84 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
+# JSON mode (response_mime_type) needs a 1.5+ model
+GEMINI_TEXT_MODEL = os.getenv("GEMINI_TEXT_MODEL", "gemini-1.5-flash")
+
 # Models
 class RequestAnalysisInput(BaseModel):
     title: str
     description: str
     category: str
+    priority: Optional[str] = None  # low/medium/high/critical, e.g. the caller's urgency guess
 
 class DisputeInput(BaseModel):
     reason: str
     job_context: dict
+    priority: Optional[str] = None
+
+class RequestBatchInput(BaseModel):
+    items: List[RequestAnalysisInput]
+
+class DisputeBatchInput(BaseModel):
+    items: List[DisputeInput]
+
+def request_prompt(input_data):
+    return f"""
+        Analyze this service request and provide a structured analysis:
+        
+        Title: {input_data.title}
+        Description: {input_data.description}
+        Category: {input_data.category}
+        
+        Return a JSON object with exactly these keys:
+        - summary: 1-2 sentences
+        - urgency: "low", "medium" or "high"
+        - complexity: "simple", "standard" or "complex"
+        - key_points: list of 3-5 short strings
+        - estimated_duration: e.g. "2-4 hours"
+        """
+
+def request_defaults(input_data):
+    return {
+        "summary": f"Service request for {input_data.category}",
+        "urgency": "medium",
+        "complexity": "standard",
+        "key_points": [input_data.title],
+        "estimated_duration": "2-4 hours",
+    }
+
+def dispute_prompt(input_data):
+    return f"""
+        Analyze this service dispute and provide recommendations:
+        
+        Reason: {input_data.reason}
+        Job Context: {input_data.job_context}
+        
+        Return a JSON object with exactly these keys:
+        - summary: 1-2 sentences
+        - severity: "low", "medium" or "high"
+        - recommended_action: one sentence for the admin
+        - key_issues: list of short strings
+        """
+
+def dispute_defaults(input_data):
+    return {
+        "summary": "Dispute requires review",
+        "severity": "medium",
+        "recommended_action": "Manual review required",
+        "key_issues": [input_data.reason[:100]],
+    }
+
+IMAGE_DEFAULTS = {
+    "description": "Image uploaded successfully",
+    "detected_objects": ["general object"],
+    "suggested_actions": ["Review manually"],
+    "confidence": 0.5,
+}
+
+def degraded(defaults, shed):
+    """Fast fallback answer when the scheduler sheds a call"""
+    return {**defaults, "degraded": True, "warning": f"{shed.reason} - degraded response"}
 
 @app.get("/")
 async def root():
@@ -45,46 +120,21 @@ async def analyze_request(input_data: RequestAnalysisInput):
     """
     if not GEMINI_API_KEY:
         return {
-            "summary": f"Service request for {input_data.category}",
-            "urgency": "medium",
-            "complexity": "standard",
-            "key_points": [input_data.title],
-            "estimated_duration": "2-4 hours",
+            **request_defaults(input_data),
             "warning": "Gemini API key not configured - using mock data"
         }
     
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        
-        prompt = f"""
-        Analyze this service request and provide a structured analysis:
-        
-        Title: {input_data.title}
-        Description: {input_data.description}
-        Category: {input_data.category}
-        
-        Provide:
-        1. A brief summary (1-2 sentences)
-        2. Urgency level (low/medium/high)
-        3. Complexity assessment (simple/standard/complex)
-        4. Key points (3-5 bullet points)
-        5. Estimated duration
-        
-        Format as JSON with keys: summary, urgency, complexity, key_points, estimated_duration
-        """
-        
-        response = model.generate_content(prompt)
-        
-        # Parse response (simplified - in production use structured output)
-        return {
-            "summary": f"Analyzed request for {input_data.category}",
-            "urgency": "medium",
-            "complexity": "standard",
-            "key_points": [input_data.title, input_data.description[:100]],
-            "estimated_duration": "2-4 hours",
-            "ai_response": response.text
-        }
+        result = await scheduler.run(
+            "request", input_data.priority or "medium",
+            lambda: generate_structured(GEMINI_TEXT_MODEL, request_prompt(input_data), RequestAnalysis)
+        )
+        return result.model_dump()
         
+    except Shed as e:
+        return degraded(request_defaults(input_data), e)
+    except StructuredOutputError as e:
+        raise HTTPException(status_code=502, detail=f"AI analysis failed: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI analysis failed: {str(e)}")
 
@@ -96,17 +146,17 @@ async def analyze_image(file: UploadFile = File(...)):
     """
     if not GEMINI_API_KEY:
         return {
-            "description": "Image uploaded successfully",
-            "detected_objects": ["general object"],
-            "suggested_actions": ["Review manually"],
-            "confidence": 0.5,
+            **IMAGE_DEFAULTS,
             "warning": "Gemini API key not configured - using mock data"
         }
     
     try:
-        # Read image
+        # Read image, then decode/downsample/strip EXIF off the event loop
         image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
+        try:
+            image = await preprocess_async(image_data)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
         
         # Use Gemini Vision
         model = genai.GenerativeModel('gemini-pro-vision')
@@ -117,7 +167,8 @@ async def analyze_image(file: UploadFile = File(...)):
         and suggest what type of service might be needed.
         """
         
-        response = model.generate_content([prompt, image])
+        # Image analysis is the low-value lane: it yields to text analyses under load
+        response = await scheduler.run("image", "low", lambda: model.generate_content_async([prompt, image]))
         
         return {
             "description": response.text,
@@ -126,6 +177,10 @@ async def analyze_image(file: UploadFile = File(...)):
             "confidence": 0.9
         }
         
+    except Shed as e:
+        return degraded(IMAGE_DEFAULTS, e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image analysis failed: {str(e)}")
 
@@ -137,44 +192,101 @@ async def summarize_dispute(input_data: DisputeInput):
     """
     if not GEMINI_API_KEY:
         return {
-            "summary": "Dispute requires review",
-            "severity": "medium",
-            "recommended_action": "Manual review required",
-            "key_issues": [input_data.reason[:100]],
+            **dispute_defaults(input_data),
             "warning": "Gemini API key not configured - using mock data"
         }
     
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        
-        prompt = f"""
-        Analyze this service dispute and provide recommendations:
-        
-        Reason: {input_data.reason}
-        Job Context: {input_data.job_context}
-        
-        Provide:
-        1. A brief summary
-        2. Severity assessment (low/medium/high)
-        3. Recommended action for admin
-        4. Key issues identified
-        
-        Format as JSON with keys: summary, severity, recommended_action, key_issues
-        """
-        
-        response = model.generate_content(prompt)
-        
-        return {
-            "summary": f"Dispute analysis completed",
-            "severity": "medium",
-            "recommended_action": "Review case details",
-            "key_issues": [input_data.reason],
-            "ai_analysis": response.text
-        }
+        result = await scheduler.run(
+            "dispute", input_data.priority or "medium",
+            lambda: generate_structured(GEMINI_TEXT_MODEL, dispute_prompt(input_data), DisputeSummary)
+        )
+        return result.model_dump()
         
+    except Shed as e:
+        return degraded(dispute_defaults(input_data), e)
+    except StructuredOutputError as e:
+        raise HTTPException(status_code=502, detail=f"Dispute analysis failed: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Dispute analysis failed: {str(e)}")
 
+async def admitted_stream(lane_name, priority, prompt, schema, defaults):
+    """SSE response holding a scheduler slot while the stream runs; shed callers get defaults"""
+    if not GEMINI_API_KEY:
+        frames = stream_completion(GEMINI_TEXT_MODEL, prompt, schema, defaults, False)
+        return StreamingResponse(frames, media_type="text/event-stream", headers=SSE_HEADERS)
+
+    async def frames():
+        # Admitted once the body is being sent: a client that disconnects before
+        # Starlette iterates never takes a slot, and one taken is always released
+        try:
+            lane = await scheduler.acquire(lane_name, priority or "medium")
+        except Shed as e:
+            async for frame in stream_completion(GEMINI_TEXT_MODEL, prompt, schema, degraded(defaults, e), False):
+                yield frame
+            return
+        errors = []
+        try:
+            async for frame in stream_completion(GEMINI_TEXT_MODEL, prompt, schema, defaults, on_error=errors.append):
+                yield frame
+        finally:
+            # Passing the upstream error lets a 429 start the quota cooldown
+            scheduler.release(lane, errors[0] if errors else None)
+
+    return StreamingResponse(frames(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/ai/analyze-request/stream")
+async def analyze_request_stream(input_data: RequestAnalysisInput):
+    """
+    Streaming variant of /ai/analyze-request (Server-Sent Events).
+    Events: start, delta {text}, field {key: value}, then result or error.
+    """
+    return await admitted_stream(
+        "request", input_data.priority, request_prompt(input_data), RequestAnalysis, request_defaults(input_data)
+    )
+
+@app.post("/ai/summarize-dispute/stream")
+async def summarize_dispute_stream(input_data: DisputeInput):
+    """Streaming variant of /ai/summarize-dispute (same events as analyze-request/stream)"""
+    return await admitted_stream(
+        "dispute", input_data.priority, dispute_prompt(input_data), DisputeSummary, dispute_defaults(input_data)
+    )
+
+async def batch_response(items, prompt_fn, defaults_fn, schema):
+    if len(items) > AI_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {AI_BATCH_MAX_ITEMS} items per batch")
+    if not GEMINI_API_KEY:
+        return {
+            "results": [{"ok": True, "result": defaults_fn(item)} for item in items],
+            "warning": "Gemini API key not configured - using mock data"
+        }
+    try:
+        # Bulk work gets its own lane so it never competes with interactive calls
+        results = await scheduler.run(
+            "batch", "low", lambda: run_batch(GEMINI_TEXT_MODEL, [prompt_fn(item) for item in items], schema)
+        )
+    except Shed as e:
+        raise HTTPException(status_code=503, detail=e.reason, headers={"Retry-After": "30"})
+    return {"results": results}
+
+@app.post("/ai/batch/analyze-request")
+async def batch_analyze_requests(input_data: RequestBatchInput):
+    """
+    Analyze many requests, several per LLM call.
+    Returns: {"results": [{"ok", "result" | "error"}]} in input order
+    """
+    return await batch_response(input_data.items, request_prompt, request_defaults, RequestAnalysis)
+
+@app.post("/ai/batch/summarize-dispute")
+async def batch_summarize_disputes(input_data: DisputeBatchInput):
+    """Summarize many disputes, several per LLM call (same response shape as batch/analyze-request)"""
+    return await batch_response(input_data.items, dispute_prompt, dispute_defaults, DisputeSummary)
+
+@app.get("/metrics/queues")
+async def queue_metrics():
+    """Per-lane in-flight, queue depth, wait time and shed counters"""
+    return scheduler.snapshot()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,197 @@
+"""
+Priority-aware admission control for Gemini calls.
+
+Each kind of work has its own lane (request analysis, image analysis,
+disputes, batch) with a concurrency cap and a bounded wait queue. When a slot
+frees up the waiter with the best priority goes next; waiting time slowly
+improves a waiter's rank so low-urgency work cannot starve forever.
+
+Instead of letting callers time out, the scheduler sheds load early:
+- a lane whose queue is full for the caller's priority (low-priority work is
+  refused at a smaller depth than urgent work),
+- a caller that waited longer than AI_QUEUE_TIMEOUT,
+- any caller while upstream quota is exhausted (after a 429 every admission
+  fails fast until the cooldown ends).
+Shed callers get a Shed exception and answer with a degraded response.
+"""
+import asyncio
+import itertools
+import os
+import re
+import time
+
+PRIORITY_RANK = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+# Fraction of a lane's queue a priority may fill before it is shed
+SHED_FRACTION = {"critical": 1.0, "high": 1.0, "medium": 0.75, "low": 0.5}
+
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "10"))
+AI_PRIORITY_AGING_SECONDS = float(os.getenv("AI_PRIORITY_AGING_SECONDS", "5"))  # Waiting this long = one rank up
+AI_QUOTA_COOLDOWN_SECONDS = float(os.getenv("AI_QUOTA_COOLDOWN_SECONDS", "30"))
+
+LANE_DEFAULTS = {
+    # lane: (max concurrent calls, max queued callers)
+    "request": (4, 32),
+    "image": (2, 8),
+    "dispute": (2, 16),
+    "batch": (1, 4),
+}
+
+
+class Shed(Exception):
+    """Raised instead of admitting a call; `reason` is safe to show to clients"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def is_quota_error(exc):
+    code = getattr(exc, "code", None)
+    return code == 429 or type(exc).__name__ == "ResourceExhausted" or "429" in str(exc)
+
+
+def retry_after_seconds(exc):
+    match = re.search(r"retry(?:[_ -]?after| in)\D{0,10}(\d+(?:\.\d+)?)", str(exc), re.IGNORECASE)
+    return float(match.group(1)) if match else AI_QUOTA_COOLDOWN_SECONDS
+
+
+class Waiter:
+    __slots__ = ("rank", "seq", "enqueued", "future")
+
+    def __init__(self, rank, seq):
+        self.rank = rank
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+    def effective_rank(self, now):
+        return self.rank - (now - self.enqueued) / AI_PRIORITY_AGING_SECONDS
+
+
+class Lane:
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiters = []
+        self.counters = {"admitted": 0, "shed": 0, "timeouts": 0, "completed": 0, "failed": 0}
+        self.wait_ms_ewma = 0.0
+
+    def record_wait(self, started):
+        waited_ms = (time.monotonic() - started) * 1000
+        self.wait_ms_ewma = waited_ms if not self.counters["admitted"] else 0.8 * self.wait_ms_ewma + 0.2 * waited_ms
+
+    def next_waiter(self):
+        """Pop the best waiter: lowest aged rank, then FIFO. Queues are short, a scan is fine."""
+        now = time.monotonic()
+        best = min(self.waiters, key=lambda w: (w.effective_rank(now), w.seq))
+        self.waiters.remove(best)
+        return best
+
+
+class Scheduler:
+    def __init__(self, lanes=None):
+        self.lanes = {}
+        for name, (concurrency, max_queue) in (lanes or LANE_DEFAULTS).items():
+            env = name.upper()
+            self.lanes[name] = Lane(
+                name,
+                int(os.getenv(f"AI_LANE_{env}_CONCURRENCY", concurrency)),
+                int(os.getenv(f"AI_LANE_{env}_MAX_QUEUE", max_queue)),
+            )
+        self.seq = itertools.count()
+        self.quota_until = 0.0
+        self.quota_events = 0
+
+    async def acquire(self, lane_name, priority="medium"):
+        """Wait for a slot in the lane or raise Shed. Pair with release()."""
+        lane = self.lanes[lane_name]
+        priority = priority if priority in PRIORITY_RANK else "medium"
+        started = time.monotonic()
+
+        if started < self.quota_until:
+            lane.counters["shed"] += 1
+            raise Shed("AI quota exhausted, retry later")
+
+        if lane.in_flight < lane.concurrency and not lane.waiters:
+            lane.in_flight += 1
+            lane.counters["admitted"] += 1
+            lane.record_wait(started)
+            return lane
+
+        if len(lane.waiters) >= lane.max_queue * SHED_FRACTION[priority]:
+            lane.counters["shed"] += 1
+            raise Shed(f"AI {lane_name} queue is full")
+
+        waiter = Waiter(PRIORITY_RANK[priority], next(self.seq))
+        lane.waiters.append(waiter)
+        try:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), AI_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if not waiter.future.done():
+                    lane.waiters.remove(waiter)
+                    lane.counters["timeouts"] += 1
+                    raise Shed(f"AI {lane_name} queue wait exceeded {AI_QUEUE_TIMEOUT:.0f}s")
+                waiter.future.result()  # Resolved in the same tick: take the slot (or its Shed)
+        except Shed:
+            lane.counters["shed"] += 1
+            raise
+        except asyncio.CancelledError:
+            if not waiter.future.done():
+                lane.waiters.remove(waiter)
+            elif waiter.future.exception() is None:
+                self.release(lane)  # Slot was handed over, pass it on
+            raise
+        lane.counters["admitted"] += 1
+        lane.record_wait(started)
+        return lane
+
+    def release(self, lane, error=None):
+        lane.counters["failed" if error else "completed"] += 1
+        if error is not None and is_quota_error(error):
+            self.quota_events += 1
+            self.quota_until = max(self.quota_until, time.monotonic() + retry_after_seconds(error))
+            # Everyone queued would hit the same wall; fail them now
+            for other in self.lanes.values():
+                while other.waiters:
+                    other.waiters.pop().future.set_exception(Shed("AI quota exhausted, retry later"))
+        if lane.waiters:
+            # Hand the slot directly to the next waiter (in_flight unchanged)
+            lane.next_waiter().future.set_result(True)
+        else:
+            lane.in_flight -= 1
+
+    async def run(self, lane_name, priority, fn):
+        """Admit, await fn(), release. Raises Shed when not admitted."""
+        lane = await self.acquire(lane_name, priority)
+        try:
+            result = await fn()
+        except BaseException as e:  # Includes cancellation: the slot must always come back
+            self.release(lane, e if isinstance(e, Exception) else None)
+            raise
+        self.release(lane)
+        return result
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            "quota_cooldown_seconds": round(max(0.0, self.quota_until - now), 1),
+            "quota_events": self.quota_events,
+            "lanes": {
+                name: {
+                    "in_flight": lane.in_flight,
+                    "concurrency": lane.concurrency,
+                    "queued": len(lane.waiters),
+                    "max_queue": lane.max_queue,
+                    "oldest_wait_ms": round(max((now - w.enqueued for w in lane.waiters), default=0) * 1000),
+                    "avg_wait_ms": round(lane.wait_ms_ewma, 1),
+                    **lane.counters,
+                }
+                for name, lane in self.lanes.items()
+            },
+        }
+
+
+scheduler = Scheduler()
@@ -0,0 +1,106 @@
+"""
+Typed results for LLM analyses.
+
+Gemini is asked for JSON (response_mime_type) and the text is validated with
+pydantic's compiled validator (model_validate_json). Enum fields accept any
+case and a few common synonyms so trivial drift does not cost a retry.
+"""
+import json
+from typing import List, Literal
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+LEVEL_ALIASES = {"moderate": "medium", "normal": "medium", "urgent": "high", "critical": "high", "minor": "low"}
+COMPLEXITY_ALIASES = {"easy": "simple", "basic": "simple", "moderate": "standard", "medium": "standard",
+                      "hard": "complex", "difficult": "complex"}
+
+
+def _normalize(value, aliases):
+    if isinstance(value, str):
+        value = value.strip().lower()
+        return aliases.get(value, value)
+    return value
+
+
+def _short_list(value, limit=5):
+    if isinstance(value, str):
+        value = [line.strip(" -*•") for line in value.splitlines() if line.strip(" -*•")]
+    return value[:limit] if isinstance(value, list) else value
+
+
+class RequestAnalysis(BaseModel):
+    summary: str
+    urgency: Literal["low", "medium", "high"]
+    complexity: Literal["simple", "standard", "complex"]
+    key_points: List[str] = Field(default_factory=list)
+    estimated_duration: str = ""
+
+    @field_validator("urgency", mode="before")
+    @classmethod
+    def normalize_urgency(cls, value):
+        return _normalize(value, LEVEL_ALIASES)
+
+    @field_validator("complexity", mode="before")
+    @classmethod
+    def normalize_complexity(cls, value):
+        return _normalize(value, COMPLEXITY_ALIASES)
+
+    @field_validator("key_points", mode="before")
+    @classmethod
+    def limit_key_points(cls, value):
+        return _short_list(value)
+
+
+class DisputeSummary(BaseModel):
+    summary: str
+    severity: Literal["low", "medium", "high"]
+    recommended_action: str
+    key_issues: List[str] = Field(default_factory=list)
+
+    @field_validator("severity", mode="before")
+    @classmethod
+    def normalize_severity(cls, value):
+        return _normalize(value, LEVEL_ALIASES)
+
+    @field_validator("key_issues", mode="before")
+    @classmethod
+    def limit_key_issues(cls, value):
+        return _short_list(value)
+
+
+
+def parse_json_text(text):
+    """Best-effort parse of a JSON object in model output (fences and prose tolerated)"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return {}
+    try:
+        parsed = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def validate_output(schema, text, defaults=None):
+    """
+    Validate model text against schema: strict JSON first, then the JSON
+    object cut out of surrounding prose/fences, then (if given) with defaults
+    filling missing keys. Raises the first ValidationError if nothing fits.
+    """
+    try:
+        return schema.model_validate_json(text)
+    except ValidationError as e:
+        error = e
+    parsed = parse_json_text(text)
+    candidates = [parsed] if parsed else []
+    if defaults is not None:
+        candidates.append({**defaults, **parsed})
+    for candidate in candidates:
+        try:
+            return schema.model_validate(candidate)
+        except ValidationError:
+            continue
+    raise error
+
+
+def describe_errors(error, limit=5):
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'body'}: {e['msg']}" for e in error.errors()[:limit])
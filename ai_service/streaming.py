@@ -0,0 +1,88 @@
+"""
+Server-Sent Events helpers for streaming Gemini completions.
+
+A stream starts with a `start` event as soon as the request is accepted, then
+forwards each generated chunk as a `delta` event. Top-level JSON fields are
+emitted as `field` events the moment their value is complete, so a client can
+show the summary before the key points have been generated. The stream ends
+with a single `result` (the full object) or `error` event.
+"""
+import json
+import re
+import google.generativeai as genai
+from pydantic import ValidationError
+from schemas import validate_output
+from structured import JSON_CONFIG
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # Disable proxy buffering (nginx, fly.io)
+}
+
+# "key": <string | number | bool | null | flat list>, complete once a delimiter follows
+FIELD_RE = re.compile(
+    r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?|true|false|null|\[(?:[^\[\]"]|"(?:[^"\\]|\\.)*")*\])'
+    r'(?=\s*[,}\]])'
+)
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class PartialFields:
+    """Extract completed "key": value pairs from a growing JSON document"""
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+        self.emitted = set()
+
+    def feed(self, text):
+        fields = {}
+        for match in FIELD_RE.finditer(text):
+            key = match.group(1)
+            if key not in self.keys or key in self.emitted:
+                continue
+            try:
+                fields[key] = json.loads(match.group(2))
+            except ValueError:
+                continue
+            self.emitted.add(key)
+        return fields
+
+
+async def stream_completion(model_name, prompt, schema, defaults, api_key_configured=True, on_error=None):
+    """
+    Async generator of SSE frames for one JSON-mode completion validated
+    against `schema`. `defaults` fill keys the model omitted (already streamed
+    output cannot be retried) and are streamed as-is when no API key is set.
+    Upstream exceptions become an error event and are passed to on_error.
+    """
+    yield sse("start", {})
+    if not api_key_configured:
+        for key, value in defaults.items():
+            yield sse("field", {key: value})
+        yield sse("result", defaults)
+        return
+
+    try:
+        model = genai.GenerativeModel(model_name, generation_config=JSON_CONFIG)
+        response = await model.generate_content_async(prompt, stream=True)
+        text = ""
+        fields = PartialFields(defaults)
+        async for chunk in response:
+            delta = chunk.text
+            if not delta:
+                continue
+            text += delta
+            yield sse("delta", {"text": delta})
+            for key, value in fields.feed(text).items():
+                yield sse("field", {key: value})
+        try:
+            yield sse("result", validate_output(schema, text, defaults).model_dump())
+        except ValidationError as e:
+            yield sse("error", {"detail": f"AI output invalid: {e.error_count()} errors"})
+    except Exception as e:
+        if on_error is not None:
+            on_error(e)
+        yield sse("error", {"detail": f"AI stream failed: {str(e)}"})
@@ -0,0 +1,52 @@
+"""
+JSON-mode Gemini calls validated into typed models.
+
+The model is asked for application/json output and the reply is validated
+with the schema's compiled validator. A reply that still fails after local
+repair (see schemas.validate_output) is retried with the validation errors
+appended to the prompt, within AI_STRUCTURED_MAX_ATTEMPTS calls and
+AI_STRUCTURED_BUDGET_SECONDS overall.
+"""
+import asyncio
+import os
+import time
+import google.generativeai as genai
+from pydantic import ValidationError
+from schemas import describe_errors, validate_output
+
+AI_STRUCTURED_MAX_ATTEMPTS = int(os.getenv("AI_STRUCTURED_MAX_ATTEMPTS", "2"))
+AI_STRUCTURED_BUDGET_SECONDS = float(os.getenv("AI_STRUCTURED_BUDGET_SECONDS", "20"))
+
+JSON_CONFIG = {"response_mime_type": "application/json", "temperature": 0.2}
+
+
+class StructuredOutputError(Exception):
+    pass
+
+
+async def generate_structured(model_name, prompt, schema):
+    """Return a validated `schema` instance or raise StructuredOutputError"""
+    model = genai.GenerativeModel(model_name, generation_config=JSON_CONFIG)
+    deadline = time.monotonic() + AI_STRUCTURED_BUDGET_SECONDS
+    attempt_prompt = prompt
+    last_error = "no attempt made"
+    for _ in range(AI_STRUCTURED_MAX_ATTEMPTS):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            last_error = "time budget exhausted"
+            break
+        try:
+            response = await asyncio.wait_for(model.generate_content_async(attempt_prompt), remaining)
+        except asyncio.TimeoutError:
+            last_error = "time budget exhausted"
+            break
+        text = response.text
+        try:
+            return validate_output(schema, text)
+        except ValidationError as e:
+            last_error = describe_errors(e)
+            attempt_prompt = (
+                f"{prompt}\n\nYour previous reply did not match the required JSON: {last_error}\n"
+                f"Previous reply:\n{text[:2000]}\n\nReturn only the corrected JSON object."
+            )
+    raise StructuredOutputError(f"No valid {schema.__name__}: {last_error}")
@@ -0,0 +1,302 @@
+"""
+Health-aware pool of Gemini API keys.
+
+Every configured key gets its own HTTP client (no global genai.configure),
+a latency EWMA and a cooldown that is set when the key is rate limited or
+keeps failing. Requests pick a key by weighted random choice, so load spreads
+across healthy keys instead of hammering key 1 until it breaks. When enough
+latency samples exist, a second key is started once the first call passes the
+pool's p95 latency (hedging) and whichever answers first wins. Per-key
+health and hedge counters are the ai.keys gauge at /api/metrics/.
+
+The REST base URL is configurable (GEMINI_API_BASE_URL), which lets the pool
+run against the local fake server from `manage.py fake_llm_server`.
+
+Calls are async (AIImageAnalysisView awaits agenerate_json()): each key
+has an httpx.AsyncClient per event loop, and hedges are asyncio tasks, so a
+slow key holds no thread. Clients are closed when the pool is replaced.
+"""
+import asyncio
+import base64
+import json
+import random
+import threading
+import time
+import weakref
+from collections import deque
+import httpx
+from django.conf import settings
+from . import metrics
+
+
+class GeminiError(Exception):
+    """Upstream call failed; the key may still be healthy"""
+
+
+class RateLimited(GeminiError):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class NoHealthyKeys(GeminiError):
+    pass
+
+
+class GeminiClient:
+    """Minimal generateContent client bound to a single API key"""
+
+    def __init__(self, api_key, base_url, model, timeout):
+        self.api_key = api_key
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model}:generateContent"
+        self.timeout = timeout
+        self.async_clients = weakref.WeakKeyDictionary()  # event loop -> httpx.AsyncClient
+
+    @staticmethod
+    def build_payload(parts):
+        contents = []
+        for part in parts:
+            if isinstance(part, str):
+                contents.append({'text': part})
+            else:
+                contents.append({'inline_data': {
+                    'mime_type': part['mime_type'],
+                    'data': base64.b64encode(part['data']).decode('ascii'),
+                }})
+        return {
+            'contents': [{'parts': contents}],
+            'generationConfig': {'responseMimeType': 'application/json'},
+        }
+
+    async def agenerate_json(self, parts):
+        """Send prompt parts (text or {mime_type, data} blobs) and parse the JSON reply"""
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            client = self.async_clients[loop] = httpx.AsyncClient(headers={'x-goog-api-key': self.api_key})
+        try:
+            response = await client.post(self.url, json=self.build_payload(parts), timeout=self.timeout)
+        except httpx.HTTPError as e:
+            raise GeminiError(f"Transport error: {e}") from e
+        return self.parse(response)
+
+    def close(self):
+        """Close the async clients on their own loops (the pool was replaced)"""
+        for loop, client in list(self.async_clients.items()):
+            if not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        self.async_clients.clear()
+
+    @staticmethod
+    def parse(response):
+        """Reply to parsed JSON, or the matching GeminiError"""
+        if response.status_code == 429:
+            retry_after = response.headers.get('Retry-After')
+            raise RateLimited(
+                "Quota exhausted",
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+            )
+        if response.status_code >= 400:
+            raise GeminiError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+        try:
+            text = response.json()['candidates'][0]['content']['parts'][0]['text']
+            return json.loads(text)
+        except (KeyError, IndexError, ValueError) as e:
+            raise GeminiError(f"Malformed response: {e}") from e
+
+
+class KeyState:
+    """Health and latency bookkeeping for one key"""
+
+    def __init__(self, client):
+        self.client = client
+        self.ewma_ms = None
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.rate_limited = 0
+
+    @property
+    def label(self):
+        return f"...{self.client.api_key[-4:]}"
+
+    def available(self, now):
+        return self.cooldown_until <= now
+
+    def weight(self):
+        # Faster keys get more traffic; busy or flaky keys get less
+        latency = self.ewma_ms or settings.AI_KEY_DEFAULT_LATENCY_MS
+        return 1.0 / (latency * (1 + self.in_flight) * (1 + self.consecutive_failures))
+
+
+class KeyPool:
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.states = [
+            KeyState(GeminiClient(key, settings.GEMINI_API_BASE_URL, settings.GEMINI_VISION_MODEL, settings.AI_REQUEST_TIMEOUT))
+            for key in self.keys
+        ]
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=200)
+        self._tasks = set()
+        self.hedges_started = 0
+        self.hedges_won = 0
+
+    def select(self, exclude=()):
+        """Weighted random choice among keys that are not cooling down"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [s for s in self.states if s not in exclude and s.available(now)]
+            if not candidates:
+                return None
+            state = random.choices(candidates, weights=[s.weight() for s in candidates])[0]
+            state.in_flight += 1
+            return state
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None while there is too little data"""
+        if not settings.AI_HEDGE_ENABLED or len(self.states) < 2:
+            return None
+        with self._lock:
+            if len(self._latencies) < settings.AI_HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * settings.AI_HEDGE_PERCENTILE / 100))
+        return ordered[index] / 1000
+
+    async def _acall(self, state, parts):
+        start = time.monotonic()
+        try:
+            result = await state.client.agenerate_json(parts)
+        except Exception as e:
+            self._record_failure(state, e)
+            raise
+        self._record_success(state, (time.monotonic() - start) * 1000)
+        return result
+
+    def _record_success(self, state, latency_ms):
+        alpha = settings.AI_KEY_EWMA_ALPHA
+        with self._lock:
+            state.in_flight -= 1
+            state.successes += 1
+            state.consecutive_failures = 0
+            state.ewma_ms = latency_ms if state.ewma_ms is None else alpha * latency_ms + (1 - alpha) * state.ewma_ms
+            self._latencies.append(latency_ms)
+
+    def _record_failure(self, state, error):
+        now = time.monotonic()
+        with self._lock:
+            state.in_flight -= 1
+            state.failures += 1
+            state.consecutive_failures += 1
+            if isinstance(error, RateLimited):
+                state.rate_limited += 1
+                state.cooldown_until = now + (error.retry_after or settings.AI_KEY_COOLDOWN_SECONDS)
+            elif state.consecutive_failures >= 3:
+                # Exponential backoff for keys that keep failing, capped at the rate-limit cooldown
+                backoff = min(settings.AI_KEY_COOLDOWN_SECONDS, 2 ** (state.consecutive_failures - 3))
+                state.cooldown_until = now + backoff
+
+    async def agenerate_json(self, parts):
+        """
+        Run one generateContent call with failover across keys and optional hedging.
+        Raises the last upstream error when every key failed.
+        """
+        tried = []
+        hedges = []
+        pending = {}
+        last_error = None
+
+        def start(exclude):
+            state = self.select(exclude)
+            if state is None:
+                return False
+            tried.append(state)
+            task = asyncio.ensure_future(self._acall(state, parts))
+            self._tasks.add(task)  # Keeps losing hedges alive after we return
+            task.add_done_callback(self._tasks.discard)
+            pending[task] = state
+            return True
+
+        if not start(tried):
+            raise NoHealthyKeys("All API keys are cooling down")
+
+        hedge_after = self.hedge_delay()
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # Primary is slower than p95: race a second key against it
+                hedge_after = None
+                if start(tried):
+                    hedges.append(tried[-1])
+                    with self._lock:
+                        self.hedges_started += 1
+                continue
+
+            for task in done:
+                state = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    print(f"Key {state.label} failed: {e}")
+                    last_error = e
+                    continue
+                if state in hedges:
+                    with self._lock:
+                        self.hedges_won += 1
+                # Losing hedges keep running as tasks and still update key stats
+                return result
+
+            if not pending and not start(tried):
+                break
+
+        raise last_error or NoHealthyKeys("All API keys failed or were exhausted.")
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'hedges_started': self.hedges_started,
+                'hedges_won': self.hedges_won,
+                'keys': [
+                    {
+                        'key': s.label,
+                        'available': s.available(now),
+                        'cooldown_remaining': round(max(0.0, s.cooldown_until - now), 1),
+                        'ewma_ms': round(s.ewma_ms, 1) if s.ewma_ms is not None else None,
+                        'in_flight': s.in_flight,
+                        'successes': s.successes,
+                        'failures': s.failures,
+                        'rate_limited': s.rate_limited,
+                    }
+                    for s in self.states
+                ],
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_key_pool(keys):
+    """Shared pool for the configured keys, rebuilt when the key set changes"""
+    global _pool
+    keys = tuple(keys)
+    with _pool_lock:
+        if _pool is None or _pool.keys != keys:
+            if _pool is not None:
+                for state in _pool.states:
+                    state.client.close()
+            _pool = KeyPool(keys)
+        return _pool
+
+
+def pool_snapshot():
+    pool = _pool
+    return pool.snapshot() if pool is not None else None
+
+
+metrics.register_gauge('ai.keys', pool_snapshot)
@@ -0,0 +1,83 @@
+"""
+Async building blocks for I/O-bound endpoints under daphne.
+
+AsyncAPIView is an APIView whose handlers are coroutines. Django's ASGI
+handler awaits them on the server's event loop instead of running them on
+its sync thread pool, so a view waiting on Gemini or Stripe holds no thread
+and concurrency per process is no longer capped by the pool size. DRF's
+request setup (authentication, permissions, throttling) is sync and may
+query the database, so it runs in sync_to_async; rendering already does
+(Django renders template responses in a thread). Handlers wrap their own ORM
+calls and request.data parsing in sync_to_async, see data().
+
+spawn() runs a coroutine on the server's event loop (captured by
+notifications.NotificationBusMiddleware) from sync code, for work that
+should finish after the response, e.g. AI enrichment of a new request.
+Without a running server loop it returns False and the caller does the work
+inline, as under WSGI or in management commands.
+"""
+import asyncio
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+from . import metrics
+
+_tasks = set()  # Strong references until background tasks finish
+
+
+class AsyncAPIView(APIView):
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    @staticmethod
+    async def data(request):
+        """request.data, parsed (and any upload streamed) off the event loop"""
+        return await sync_to_async(lambda: request.data)()
+
+
+def spawn(coro_fn, *args):
+    """
+    Schedule coro_fn(*args) on the server loop from any thread; False when
+    there is none (the caller should do the work itself).
+    """
+    from .notifications import bus
+    if not bus.loop_available():
+        return False
+
+    def start():
+        task = bus.loop.create_task(run_logged(coro_fn, *args))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+    bus.loop.call_soon_threadsafe(start)
+    metrics.incr('aio.spawned')
+    return True
+
+
+async def run_logged(coro_fn, *args):
+    try:
+        await coro_fn(*args)
+    except Exception as e:
+        metrics.incr('aio.failed')
+        print(f"Background task {coro_fn.__name__} failed: {e}")
+
+
+metrics.register_gauge('aio.background_tasks', lambda: len(_tasks))
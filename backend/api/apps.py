@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = "api"
+
+    def ready(self):
+        from . import broadcast, chat, matching, pricing
+        pricing.connect_signals()
+        matching.connect_signals()
+        broadcast.connect_signals()
+        chat.connect_signals()
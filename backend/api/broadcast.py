@@ -0,0 +1,170 @@
+"""
+Broadcasting new requests to providers through channel groups.
+
+While a provider is available, their notification sockets join:
+- `providers`: every available provider,
+- `providers_cat_<category>`: one per category they serve,
+- `providers_cat_<category>_cell_<i>_<j>`: the coarse geo cell
+  (BROADCAST_CELL_DEGREES square) of their profile coordinates, per category,
+  or `providers_cat_<category>_nocell` when their profile has no coordinates.
+
+A new request gets pending jobs for the same providers who hear about it:
+those in the 3x3 cells around its location in its category (plus the
+category's providers without coordinates), the whole category when it has no
+location, or every available provider when it has no category. It is sent
+only to the groups of those providers, at most ten group_sends however many
+there are; the channel layer does the per-connection fan-out. Each frame
+carries the {user_id: job_id} map of its group, and NotificationConsumer
+hands every provider their own job_id.
+
+Signals re-send a provider's groups to their sockets whenever their
+availability, categories or coordinates change. Broadcast frames are live
+only: they are not stored per provider, so they are not replayed on
+reconnect; the pending jobs themselves are in the provider's job list.
+"""
+from django.conf import settings
+from django.db.models import Q
+from . import metrics
+from .notifications import broadcast
+from .utils import geo_cell
+
+ALL_PROVIDERS = 'providers'
+
+
+def category_group(category_id):
+    return f"providers_cat_{category_id}"
+
+
+def cell_of(latitude, longitude):
+    """Broadcast cell of a point, None when unknown"""
+    return geo_cell(latitude, longitude, settings.BROADCAST_CELL_DEGREES)
+
+
+def cell_group(category_id, cell):
+    return f"providers_cat_{category_id}_cell_{cell[0]}_{cell[1]}"
+
+
+def nocell_group(category_id):
+    return f"providers_cat_{category_id}_nocell"
+
+
+def provider_groups(user_id):
+    """Broadcast groups a user's notification sockets belong to (none unless an available provider)"""
+    from .models import Provider
+    provider = (Provider.objects.filter(user_id=user_id, availability_status='available')
+                .values('id', 'user__profile__latitude', 'user__profile__longitude').first())
+    if provider is None:
+        return set()
+    cell = cell_of(provider['user__profile__latitude'], provider['user__profile__longitude'])
+    groups = {ALL_PROVIDERS}
+    for category_id in Provider.categories.through.objects.filter(
+            provider_id=provider['id']).values_list('category_id', flat=True):
+        groups.add(category_group(category_id))
+        groups.add(cell_group(category_id, cell) if cell else nocell_group(category_id))
+    return groups
+
+
+def window(cell):
+    """The 3x3 cells around a cell"""
+    i, j = cell
+    return {(i + di, j + dj) for di in (-1, 0, 1) for dj in (-1, 0, 1)}
+
+
+def request_audience(request_instance):
+    """
+    {group: {provider_id: user_id}} of the available providers a new request
+    reaches, by the broadcast group they hear it on
+    """
+    from .models import Provider
+    category_id = request_instance.category_id
+    providers = Provider.objects.filter(availability_status='available')
+    if category_id:
+        providers = providers.filter(categories=category_id)
+    center = cell_of(request_instance.latitude, request_instance.longitude)
+    if category_id and center is not None:
+        # Coarse bounding box in SQL, exact cells below
+        size = settings.BROADCAST_CELL_DEGREES
+        providers = providers.filter(
+            Q(user__profile__latitude__isnull=True) | Q(user__profile__longitude__isnull=True) | Q(
+                user__profile__latitude__gte=(center[0] - 1) * size, user__profile__latitude__lt=(center[0] + 2) * size,
+                user__profile__longitude__gte=(center[1] - 1) * size, user__profile__longitude__lt=(center[1] + 2) * size,
+            )
+        )
+    cells = window(center) if center is not None else set()
+
+    audience = {}
+    for provider_id, user_id, latitude, longitude in providers.values_list(
+            'id', 'user_id', 'user__profile__latitude', 'user__profile__longitude').distinct():
+        if not category_id:
+            group = ALL_PROVIDERS
+        elif center is None:
+            group = category_group(category_id)
+        else:
+            cell = cell_of(latitude, longitude)
+            if cell is None:
+                group = nocell_group(category_id)
+            elif cell in cells:
+                group = cell_group(category_id, cell)
+            else:
+                continue
+        audience.setdefault(group, {})[provider_id] = user_id
+    return audience
+
+
+def broadcast_request(request_instance):
+    """
+    Create pending jobs for the providers the request reaches (one INSERT)
+    and announce it to their broadcast groups. Returns the number of jobs.
+    """
+    from .models import Job
+    audience = request_audience(request_instance)
+    jobs = Job.objects.bulk_create([
+        Job(request=request_instance, provider_id=provider_id, status='pending')
+        for members in audience.values() for provider_id in members
+    ])
+    job_ids = {job.provider_id: job.id for job in jobs}
+    for group, members in audience.items():
+        broadcast([group], {
+            'message': f"New Job Opportunity: {request_instance.title}",
+            'type': 'new_job',
+            'payload': {'request_id': request_instance.id},
+            'jobs': {str(user_id): job_ids.get(provider_id) for provider_id, user_id in members.items()},
+        })
+    metrics.incr('broadcast.requests')
+    metrics.incr('broadcast.group_sends', len(audience))
+    return len(jobs)
+
+
+def _refresh_groups(user_ids):
+    from django.db import transaction
+    from .notifications import send_event
+    for user_id in set(user_ids):
+        transaction.on_commit(lambda user_id=user_id: send_event(f"user_{user_id}", {'type': 'groups_changed'}))
+
+
+def _provider_saved(sender, instance, **kwargs):
+    _refresh_groups([instance.user_id])
+
+
+def _categories_changed(sender, instance, action, pk_set=None, **kwargs):
+    from .models import Provider
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Provider):
+        _refresh_groups([instance.user_id])
+    elif pk_set:
+        _refresh_groups(Provider.objects.filter(id__in=pk_set).values_list('user_id', flat=True))
+
+
+def _profile_saved(sender, instance, **kwargs):
+    from .models import Provider
+    if Provider.objects.filter(user_id=instance.user_id).exists():
+        _refresh_groups([instance.user_id])
+
+
+def connect_signals():
+    from django.db.models.signals import m2m_changed, post_save
+    from .models import Profile, Provider
+    post_save.connect(_provider_saved, sender=Provider, dispatch_uid='broadcast_provider')
+    m2m_changed.connect(_categories_changed, sender=Provider.categories.through, dispatch_uid='broadcast_categories')
+    post_save.connect(_profile_saved, sender=Profile, dispatch_uid='broadcast_profile')
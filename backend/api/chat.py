@@ -0,0 +1,179 @@
+"""
+Write-behind persistence for chat messages.
+
+ChatConsumer broadcasts a message to the room first and then hands it to
+this buffer, which stores pending messages with one bulk_create every
+CHAT_FLUSH_INTERVAL_MS, or as soon as CHAT_FLUSH_MAX_MESSAGES are waiting.
+Busy rooms then cost one INSERT per batch instead of several queries per
+message on the path between a send and its delivery.
+
+Durability guarantees:
+- A message is delivered to the room before it is stored. A message the
+  recipient saw can be missing from history if this process dies before
+  the next flush. That loses at most CHAT_FLUSH_INTERVAL_MS worth of
+  messages (or CHAT_FLUSH_MAX_MESSAGES) that were pending in this process.
+- Messages are stored in the order this process received them. Per room,
+  message ids follow delivery order.
+- When a consumer disconnects it waits for a flush, so a client that closes
+  its socket cleanly has its messages stored by the time the close finishes.
+  A graceful server shutdown disconnects every consumer, so it flushes too.
+- A failed flush is retried CHAT_FLUSH_RETRIES times with backoff, and the
+  batch stays ahead of newer messages. After that the batch is dropped and
+  logged, and counted in the chat.dropped metric.
+- When CHAT_MAX_PENDING messages are waiting (e.g. the database is slow or
+  down), senders wait for a flush before their message is accepted, so
+  memory stays bounded. This backpressure replaces unbounded buffering.
+- created_at is set when the batch is inserted, a few ms after delivery.
+Set CHAT_WRITE_BEHIND=False to store each message before broadcasting it.
+
+Every path that stores messages goes through store_messages() or
+count_messages(), which keep ChatUnread (per-user, per-job unread count and
+latest message) current, so the inbox never has to scan messages.
+
+ChatConsumer authorizes a connection once, at connect. When a job is updated
+(cancelled, reassigned) its open chat sockets are told to re-check with
+job_access_changed(); queryset .update() calls bypass the signal and must
+call it themselves.
+"""
+import asyncio
+import weakref
+from collections import Counter
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+from . import metrics
+
+
+def count_messages(messages):
+    """Bump unread counters and latest-message pointers for newly stored messages"""
+    from .models import ChatUnread
+    latest, unread = {}, Counter()
+    for message in messages:
+        job_id = int(message.job_id)
+        for user_id in {message.sender_id, message.receiver_id} - {None}:
+            latest[(user_id, job_id)] = message  # Later messages in the batch win
+        if message.receiver_id and message.receiver_id != message.sender_id:
+            unread[(message.receiver_id, job_id)] += 1
+
+    for (user_id, job_id), message in latest.items():
+        changes = {'count': F('count') + unread[(user_id, job_id)]}
+        if message.pk:
+            # Never move the pointer back if another process stored newer messages first
+            changes['last_message_id'] = Greatest(Coalesce(F('last_message_id'), Value(0)), Value(message.pk))
+            changes['last_message_at'] = Greatest(Coalesce(F('last_message_at'), Value(message.created_at)),
+                                                  Value(message.created_at))
+        if ChatUnread.objects.filter(user_id=user_id, job_id=job_id).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                ChatUnread.objects.create(user_id=user_id, job_id=job_id, count=unread[(user_id, job_id)],
+                                          last_message_id=message.pk, last_message_at=message.created_at)
+        except IntegrityError:
+            ChatUnread.objects.filter(user_id=user_id, job_id=job_id).update(**changes)
+
+
+def store_messages(messages):
+    """Insert messages and update their counters in one transaction"""
+    from .models import Message
+    try:
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+            count_messages(messages)
+    except Exception:
+        for message in messages:  # Rolled back: let a retry insert them afresh
+            message.pk = None
+            message._state.adding = True
+        raise
+
+
+_buffers = weakref.WeakKeyDictionary()  # One buffer per event loop
+
+
+class MessageBuffer:
+    def __init__(self):
+        self.pending = []
+        self.lock = asyncio.Lock()
+        self.wake = asyncio.Event()
+        self.full = asyncio.Event()
+        self.flusher = None
+
+    async def add(self, **fields):
+        """Queue a message for the next flush (waits only when the buffer is over CHAT_MAX_PENDING)"""
+        from .models import Message
+        if len(self.pending) >= settings.CHAT_MAX_PENDING:
+            metrics.incr('chat.backpressure')
+            await self.flush()
+        self.pending.append(Message(**fields))
+        metrics.incr('chat.buffered')
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.get_running_loop().create_task(self.run())
+        self.wake.set()
+        if len(self.pending) >= settings.CHAT_FLUSH_MAX_MESSAGES:
+            self.full.set()
+
+    async def run(self):
+        """Flush CHAT_FLUSH_INTERVAL_MS after the first pending message, or early when full"""
+        while True:
+            await self.wake.wait()
+            try:
+                await asyncio.wait_for(self.full.wait(), settings.CHAT_FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            self.full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Store everything pending; one flush at a time so batches keep their order"""
+        async with self.lock:
+            while self.pending:
+                batch, self.pending = self.pending, []
+                for attempt in range(settings.CHAT_FLUSH_RETRIES + 1):
+                    try:
+                        await database_sync_to_async(store_messages)(batch)
+                        metrics.incr('chat.persisted', len(batch))
+                        break
+                    except Exception as e:
+                        metrics.incr('chat.flush_failures')
+                        if attempt == settings.CHAT_FLUSH_RETRIES:
+                            metrics.incr('chat.dropped', len(batch))
+                            print(f"Dropping {len(batch)} chat messages after {attempt + 1} failed flushes: {e}")
+                        else:
+                            print(f"Chat flush failed, retrying: {e}")
+                            await asyncio.sleep(0.05 * 2 ** attempt)
+
+
+def get_buffer():
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = _buffers[loop] = MessageBuffer()
+    return buffer
+
+
+def pending_count():
+    return sum(len(buffer.pending) for buffer in list(_buffers.values()))
+
+
+metrics.register_gauge('chat.pending', pending_count)
+
+
+def job_access_changed(job_ids):
+    """After commit, make open chat sockets for these jobs re-check who may stay"""
+    from .notifications import bus
+    groups = [f"chat_{job_id}" for job_id in job_ids]
+    if groups:
+        transaction.on_commit(lambda: bus.send_groups(groups, {'type': 'job_access_changed'}))
+
+
+def _job_saved(sender, instance, created, **kwargs):
+    if not created:
+        job_access_changed([instance.id])
+
+
+def connect_signals():
+    from django.db.models.signals import post_save
+    from .models import Job
+    post_save.connect(_job_saved, sender=Job, dispatch_uid='chat_job_access')
@@ -0,0 +1,317 @@
+"""
+Local request classifier used as the first stage of the analysis cascade.
+
+Request titles/descriptions are turned into hashed word and bigram features
+and scored by two multinomial Naive Bayes heads trained on historical
+requests: one predicts the category, the other the urgency that the LLM
+assigned (ai_summary['urgency']). When the local model is confident and agrees
+with the chosen category, its answer is stored directly; otherwise the request
+goes to ai_service. Hit/miss counters are exported through api.metrics.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from . import metrics
+
+N_FEATURES = 2 ** 18
+URGENCY_LABELS = ('low', 'medium', 'high')
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def features(text):
+    """Hashed unigram + bigram counts (crc32 is stable across processes)"""
+    words = TOKEN_RE.findall(text.lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return Counter(zlib.crc32(gram.encode()) & (N_FEATURES - 1) for gram in grams)
+
+
+class NaiveBayes:
+    """Multinomial Naive Bayes over hashed features with Laplace smoothing"""
+
+    def __init__(self, class_docs=None, feature_counts=None):
+        self.class_docs = class_docs or {}
+        self.feature_counts = feature_counts or {}
+        self._prepare()
+
+    def _prepare(self):
+        self.totals = {label: sum(counts.values()) for label, counts in self.feature_counts.items()}
+        vocabulary = set()
+        for counts in self.feature_counts.values():
+            vocabulary.update(counts)
+        self.vocabulary_size = max(1, len(vocabulary))
+        self.documents = sum(self.class_docs.values())
+
+    def fit(self, samples):
+        for feats, label in samples:
+            self.class_docs[label] = self.class_docs.get(label, 0) + 1
+            counts = self.feature_counts.setdefault(label, {})
+            for bucket, count in feats.items():
+                counts[bucket] = counts.get(bucket, 0) + count
+        self._prepare()
+        return self
+
+    def predict(self, feats):
+        """
+        (label, probability) for the most likely class, or (None, 0.0) until
+        at least two classes were seen (one class would always score 1.0)
+        """
+        if len(self.class_docs) < 2:
+            return None, 0.0
+        scores = {}
+        for label, docs in self.class_docs.items():
+            counts = self.feature_counts.get(label, {})
+            denominator = self.totals.get(label, 0) + self.vocabulary_size
+            score = math.log(docs / self.documents)
+            for bucket, count in feats.items():
+                score += count * math.log((counts.get(bucket, 0) + 1) / denominator)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        # Softmax over log scores gives the posterior of the best class
+        peak = scores[best]
+        normalizer = sum(math.exp(s - peak) for s in scores.values())
+        return best, 1.0 / normalizer
+
+    def to_dict(self):
+        return {
+            'class_docs': self.class_docs,
+            'feature_counts': {label: {str(k): v for k, v in counts.items()} for label, counts in self.feature_counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            class_docs=data['class_docs'],
+            feature_counts={label: {int(k): v for k, v in counts.items()} for label, counts in data['feature_counts'].items()},
+        )
+
+
+class RequestClassifier:
+    def __init__(self, category=None, urgency=None):
+        self.category = category or NaiveBayes()
+        self.urgency = urgency or NaiveBayes()
+
+    @staticmethod
+    def text(title, description):
+        return f"{title or ''}\n{description or ''}"
+
+    def predict(self, title, description):
+        feats = features(self.text(title, description))
+        category, category_confidence = self.category.predict(feats)
+        urgency, urgency_confidence = self.urgency.predict(feats)
+        return {
+            'category': category,
+            'category_confidence': category_confidence,
+            'urgency': urgency,
+            'urgency_confidence': urgency_confidence,
+        }
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'category': self.category.to_dict(), 'urgency': self.urgency.to_dict()}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(NaiveBayes.from_dict(data['category']), NaiveBayes.from_dict(data['urgency']))
+
+
+def train_from_history():
+    """
+    Fit a classifier on historical requests. Urgency labels come only from
+    analyses tagged source='llm': not the local model's own answers, mock
+    data, or legacy summaries without a source (those all say "medium").
+    """
+    from .models import Request
+    category_samples = []
+    urgency_samples = []
+    rows = Request.objects.values_list('title', 'description', 'category__name', 'ai_summary')
+    for title, description, category_name, ai_summary in rows.iterator():
+        feats = features(RequestClassifier.text(title, description))
+        if category_name:
+            category_samples.append((feats, category_name))
+        summary = ai_summary if isinstance(ai_summary, dict) else {}
+        urgency = str(summary.get('urgency', '')).lower()
+        if summary.get('source') == 'llm' and urgency in URGENCY_LABELS:
+            urgency_samples.append((feats, urgency))
+    return RequestClassifier(
+        NaiveBayes().fit(category_samples),
+        NaiveBayes().fit(urgency_samples),
+    )
+
+
+_model_lock = threading.Lock()
+_model = (None, None)
+
+
+def get_model():
+    """Trained classifier from REQUEST_CLASSIFIER_PATH, reloaded when the file changes"""
+    global _model
+    path = settings.REQUEST_CLASSIFIER_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if _model[0] != mtime:
+        with _model_lock:
+            if _model[0] != mtime:
+                try:
+                    _model = (mtime, RequestClassifier.load(path))
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Failed to load request classifier: {e}")
+                    return None
+    return _model[1]
+
+
+def local_analysis(title, description, category_name):
+    """
+    Answer locally when the model is confident, otherwise return None.
+    The result has the shape of ai_service's /ai/analyze-request minus the
+    fields the model cannot judge: complexity is left out and
+    estimated_duration is filled from historical bids by save_analysis().
+    """
+    model = get_model()
+    if model is None or model.urgency.documents < settings.AI_CASCADE_MIN_SAMPLES:
+        return None
+    prediction = model.predict(title, description)
+    if prediction['urgency'] is None or prediction['urgency_confidence'] < settings.AI_CASCADE_THRESHOLD:
+        return None
+    # A confident disagreement about the category means the text is not an obvious case
+    if (category_name and prediction['category']
+            and prediction['category'] != category_name
+            and prediction['category_confidence'] >= settings.AI_CASCADE_THRESHOLD):
+        return None
+    return {
+        "summary": f"Service request for {category_name or prediction['category'] or 'General'}: {title}",
+        "urgency": prediction['urgency'],
+        "key_points": [title],
+        "confidence": round(prediction['urgency_confidence'], 3),
+        "source": "local",
+    }
+
+
+def predicted_urgency(title, description):
+    """The local model's urgency guess even when it is not confident (for queue priority)"""
+    model = get_model()
+    if model is None or not model.urgency.documents:
+        return None
+    return model.predict(title, description)['urgency']
+
+
+def llm_payload(title, description, category_name):
+    return {
+        "title": title,
+        "description": description,
+        "category": category_name or "General",
+        "priority": predicted_urgency(title, description),
+    }
+
+
+def llm_result(response):
+    if response.status_code == 200:
+        data = response.json()
+        return {**data, "source": "mock" if 'warning' in data else "llm"}
+    metrics.incr('cascade.llm_failures')
+    return None
+
+
+def cascade_local(title, description, category_name):
+    """The cascade's fast half: the local classifier's answer when it is confident, else None"""
+    metrics.incr('cascade.requests')
+    result = local_analysis(title, description, category_name)
+    if result is not None:
+        metrics.incr('cascade.local_hits')
+    return result
+
+
+def llm_analysis(payload):
+    """The cascade's slow half: ai_service analysis for an llm_payload()"""
+    from .services import ai_service
+
+    metrics.incr('cascade.llm_calls')
+    try:
+        return llm_result(ai_service().post('/ai/analyze-request', settings.AI_ANALYZE_DEADLINE, json=payload))
+    except Exception as e:
+        print(f"DEBUG: AI analysis failed: {e}")
+        metrics.incr('cascade.llm_failures')
+    return None
+
+
+async def allm_analysis(payload):
+    """llm_analysis() without holding a thread"""
+    from .services import ai_service
+
+    metrics.incr('cascade.llm_calls')
+    try:
+        return llm_result(await ai_service().apost('/ai/analyze-request', settings.AI_ANALYZE_DEADLINE, json=payload))
+    except Exception as e:
+        print(f"DEBUG: AI analysis failed: {e}")
+        metrics.incr('cascade.llm_failures')
+    return None
+
+
+def analyze_request(title, description, category_name):
+    """Cascade: local classifier first, ai_service only for uncertain requests"""
+    return cascade_local(title, description, category_name) or llm_analysis(llm_payload(title, description, category_name))
+
+
+def save_analysis(request_instance, analysis):
+    """Store an analysis on a Request, with durations from historical bids when available"""
+    from .pricing import duration_range
+    duration = duration_range(request_instance.category_id, request_instance.latitude, request_instance.longitude)
+    if duration:
+        analysis['estimated_duration'] = duration
+    request_instance.ai_summary = analysis
+    request_instance.save(update_fields=['ai_summary'])
+
+
+async def enrich_request(request_id, payload):
+    """
+    Background half of request creation under daphne: ask ai_service, store
+    the analysis and tell the customer it is ready.
+    """
+    from asgiref.sync import sync_to_async
+    from .models import Request
+    from .notifications import asend_notification
+
+    analysis = await allm_analysis(payload)
+    if not analysis:
+        return
+    request_instance = await Request.objects.aget(id=request_id)
+    await sync_to_async(save_analysis)(request_instance, analysis)
+    print(f"DEBUG: AI Analysis ({analysis.get('source')}) saved for Request #{request_id}")
+    await asend_notification(
+        request_instance.user_id, f"AI analysis ready for '{request_instance.title}'",
+        'request_update', {'request_id': request_id, 'ai_summary': True}
+    )
+
+
+def analysis_cache_key(user_id, title, description, category_name):
+    digest = hashlib.sha1(f"{title}\0{description}\0{category_name}".encode()).hexdigest()
+    return f"request_analysis:{user_id}:{digest}"
+
+
+def remember_analysis(user_id, title, description, category_name, result):
+    """Keep a streamed preview's result so creating the same request reuses it"""
+    key = analysis_cache_key(user_id, title, description, category_name)
+    cache.set(key, result, settings.AI_STREAM_RESULT_TTL)
+
+
+def recall_analysis(user_id, title, description, category_name):
+    key = analysis_cache_key(user_id, title, description, category_name)
+    result = cache.get(key)
+    if result is not None:
+        cache.delete(key)
+    return result
+
+
+metrics.register_gauge('cascade.local_hit_ratio', lambda: metrics.ratio('cascade.local_hits', 'cascade.requests'))
@@ -0,0 +1,153 @@
+"""
+Websocket connection lifecycle: heartbeats, idle eviction, group bookkeeping
+and per-process connection metrics.
+
+Consumers that mix in ConnectionLifecycleMixin:
+- join and leave channel groups through join_group()/leave_group(), so the
+  consumer knows its memberships and leaves all of them on disconnect or
+  eviction,
+- send {"type": "ping"} every WS_PING_INTERVAL seconds; clients answer with
+  {"type": "pong"}. A connection that has sent nothing (pong or otherwise)
+  for WS_IDLE_TIMEOUT seconds is evicted: its groups are discarded right
+  away and it is closed with code 4408. Daphne's protocol-level pings stop at
+  proxies and keep suspended mobile tabs alive, so this heartbeat goes
+  end to end through the app,
+- re-add their groups every WS_GROUP_EXPIRY / 2 seconds. The Redis layer
+  expires memberships after WS_GROUP_EXPIRY, so members of a daphne process
+  that died without disconnecting anyone leave the groups on their own.
+
+Gauges (per process, see /api/metrics/): open connections by consumer,
+distinct groups, memberships and the largest group, approximate memory held
+per connection by consumer state, and process RSS.
+"""
+import asyncio
+import sys
+import time
+from collections import Counter
+from django.conf import settings
+from . import metrics
+
+_open = {}  # channel_name -> consumer
+
+# Consumer attributes that are shared with other connections or belong to the framework
+_SHARED = {'channel_layer', 'channel_receive', 'base_send', 'scope', 'heartbeat', 'channel_layer_alias'}
+
+
+def approx_size(obj, seen=None):
+    """Deep sys.getsizeof of containers, counting each object once"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, seen) + approx_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, seen) for item in obj)
+    return size
+
+
+def connection_bytes(consumer):
+    state = {k: v for k, v in vars(consumer).items() if k not in _SHARED}
+    scope = {k: v for k, v in consumer.scope.items() if k not in ('user', 'app', 'url_route')}
+    return approx_size(state) + approx_size(scope)
+
+
+class ConnectionLifecycleMixin:
+    """Mix in before AsyncJsonWebsocketConsumer; call start_lifecycle() after accept()"""
+
+    async def join_group(self, group):
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.groups_joined.add(group)
+
+    async def leave_group(self, group):
+        self.groups_joined.discard(group)
+        await self.channel_layer.group_discard(group, self.channel_name)
+
+    @property
+    def groups_joined(self):
+        if '_groups_joined' not in vars(self):
+            self._groups_joined = set()
+        return self._groups_joined
+
+    async def start_lifecycle(self):
+        self.last_seen = self.groups_refreshed = time.monotonic()
+        _open[self.channel_name] = self
+        self.heartbeat = asyncio.get_running_loop().create_task(self.run_heartbeat())
+
+    async def websocket_receive(self, message):
+        self.last_seen = time.monotonic()
+        if message.get('text') in ('{"type":"pong"}', '{"type": "pong"}'):
+            return  # Nothing else to do for a heartbeat reply
+        await super().websocket_receive(message)
+
+    async def run_heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.WS_PING_INTERVAL)
+            now = time.monotonic()
+            if now - self.last_seen > settings.WS_IDLE_TIMEOUT:
+                metrics.incr('ws.evicted')
+                await self.end_lifecycle()
+                await self.close(code=4408)
+                return
+            await self.on_heartbeat()
+            if now - self.groups_refreshed > settings.WS_GROUP_EXPIRY / 2:
+                for group in list(self.groups_joined):
+                    await self.channel_layer.group_add(group, self.channel_name)
+                self.groups_refreshed = now
+            try:
+                await self.send_json({'type': 'ping'})
+            except Exception:
+                pass  # Transport already gone; the idle check evicts it next time
+
+    async def on_heartbeat(self):
+        """Called every WS_PING_INTERVAL while the connection is live"""
+
+    async def end_lifecycle(self):
+        """Leave every group and stop the heartbeat; safe to call more than once"""
+        _open.pop(getattr(self, 'channel_name', None), None)
+        heartbeat = getattr(self, 'heartbeat', None)
+        if heartbeat and heartbeat is not asyncio.current_task():
+            heartbeat.cancel()
+        for group in list(self.groups_joined):
+            await self.leave_group(group)
+
+
+def connections_by_consumer():
+    return dict(Counter(type(consumer).__name__ for consumer in list(_open.values())))
+
+
+def group_stats():
+    sizes = Counter(group for consumer in list(_open.values()) for group in consumer.groups_joined)
+    largest = sizes.most_common(1)
+    return {
+        'groups': len(sizes),
+        'memberships': sum(sizes.values()),
+        'largest': {'group': largest[0][0], 'members': largest[0][1]} if largest else None,
+    }
+
+
+def memory_stats():
+    consumers = list(_open.values())
+    total = sum(connection_bytes(consumer) for consumer in consumers)
+    return {
+        'connections': len(consumers),
+        'state_bytes_total': total,
+        'state_bytes_per_connection': round(total / len(consumers)) if consumers else None,
+    }
+
+
+def process_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    import os
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 1)
+
+
+metrics.register_gauge('ws.connections', connections_by_consumer)
+metrics.register_gauge('ws.groups', group_stats)
+metrics.register_gauge('ws.memory', memory_stats)
+metrics.register_gauge('process.rss_mb', process_rss_mb)
@@ -1,7 +1,17 @@
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.db import database_sync_to_async
+from . import metrics
+from .connections import ConnectionLifecycleMixin
+
+class NotificationConsumer(ConnectionLifecycleMixin, AsyncJsonWebsocketConsumer):
+    """
+    Pushes a user's notifications. Every notification carries its per-user
+    `seq`; a client reconnecting with ?last_seq=N first receives the stored
+    notifications after N (marked replayed), then a `notifications_synced`
+    frame, then live ones. `gap` in that frame means some missed notifications
+    were already trimmed and the client should refetch its data over REST.
+    """
 
-class NotificationConsumer(AsyncJsonWebsocketConsumer):
     async def connect(self):
         user = self.scope['user']
         if user.is_anonymous:
@@ -9,18 +19,65 @@ class NotificationConsumer(AsyncJsonWebsocketConsumer):
         else:
             # Group name based on user ID
             self.group_name = f"user_{user.id}"
-            await self.channel_layer.group_add(
-                self.group_name,
-                self.channel_name
-            )
+            await self.join_group(self.group_name)
+            # Available providers also hear new requests for their categories and area
+            self.broadcast_groups = set()
+            await self.join_broadcast_groups()
             await self.accept()
+            await self.start_lifecycle()
+            # Live events queue up until connect returns, so replay cannot interleave with them
+            await self.replay(self.requested_last_seq())
+
+    def requested_last_seq(self):
+        from urllib.parse import parse_qs
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get('last_seq')
+        try:
+            return int(values[0]) if values else None
+        except ValueError:
+            return None
+
+    async def replay(self, last_seq):
+        missed, latest_seq, gap = await self.load_missed(self.scope['user'].id, last_seq)
+        for content in missed:
+            await self.send_json({**content, 'replayed': True})
+        self.seq = latest_seq
+        await self.send_json({
+            'type': 'notifications_synced',
+            'seq': latest_seq,
+            'replayed': len(missed),
+            'gap': gap,
+        })
+
+    @database_sync_to_async
+    def load_missed(self, user_id, last_seq):
+        """
+        (frames for the newest NOTIFICATION_RETENTION notifications after
+        last_seq, latest seq, whether anything after last_seq is unavailable)
+        """
+        from django.conf import settings
+        from .models import Notification
+        from .notifications import notification_content
+        notifications = Notification.objects.filter(user_id=user_id)
+        latest_seq = notifications.order_by('-seq').values_list('seq', flat=True).first() or 0
+        if last_seq is None:
+            return [], latest_seq, False
+        if last_seq >= latest_seq:
+            return [], latest_seq, last_seq > latest_seq  # Ahead of the server: history was reset
+        missed = list(notifications.filter(seq__gt=last_seq).order_by('-seq')[:settings.NOTIFICATION_RETENTION])[::-1]
+        return [notification_content(n) for n in missed], latest_seq, missed[0].seq > last_seq + 1
+
+    async def join_broadcast_groups(self):
+        from .broadcast import provider_groups
+        groups = await database_sync_to_async(provider_groups)(self.scope['user'].id)
+        for group in groups - self.broadcast_groups:
+            await self.join_group(group)
+        for group in self.broadcast_groups - groups:
+            await self.leave_group(group)
+        self.broadcast_groups = groups
 
     async def disconnect(self, close_code):
-        if hasattr(self, 'group_name'):
-            await self.channel_layer.group_discard(
-                self.group_name,
-                self.channel_name
-            )
+        # Leaves the user group and any broadcast groups
+        await self.end_lifecycle()
 
     async def receive_json(self, content):
         # We generally push TO the user, not receive from them
@@ -28,46 +85,90 @@ class NotificationConsumer(AsyncJsonWebsocketConsumer):
 
     async def notify(self, event):
         # Handler for "notify" messages
-        await self.send_json(event['content'])
+        content = event['content']
+        seq = content.get('seq')
+        if seq is not None:
+            if seq <= getattr(self, 'seq', 0):
+                return  # Already sent by the replay
+            self.seq = seq
+        if 'jobs' in content:
+            # Group broadcast of a new request (see broadcast.py): this provider's own job
+            jobs = content['jobs']
+            content = {key: value for key, value in content.items() if key != 'jobs'}
+            content['payload'] = {**content['payload'], 'job_id': jobs.get(str(self.scope['user'].id))}
+        await self.send_json(content)
+
+    async def groups_changed(self, event):
+        # The provider's availability, categories or location changed
+        await self.join_broadcast_groups()
+
+    async def notify_batch(self, event):
+        # Several notifications coalesced by the bus: one frame
+        events = [e for e in event['events'] if e.get('seq') is None or e['seq'] > getattr(self, 'seq', 0)]
+        self.seq = max([getattr(self, 'seq', 0)] + [e['seq'] for e in events if e.get('seq') is not None])
+        if len(events) == 1:
+            await self.send_json(events[0])
+        elif events:
+            await self.send_json({'type': 'batch', 'events': events})
 
-class ChatConsumer(AsyncJsonWebsocketConsumer):
+class ChatConsumer(ConnectionLifecycleMixin, AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.job_id = self.scope['url_route']['kwargs']['job_id']
         self.room_group_name = f'chat_{self.job_id}'
 
-        # Verify user is allowed in this room (optional but recommended)
-        # For simplicity, we assume frontend sends valid job_id and auth handles the rest
         if self.scope['user'].is_anonymous:
              await self.close()
              return
 
+        # Authorize once: only the job's customer and provider may join. The
+        # participants are kept for the connection, so messages need no
+        # queries; api.chat re-checks when the job is cancelled or reassigned.
+        access = await self.job_access(self.job_id)
+        if access is None:
+            await self.close()
+            return
+        if not self.allowed(access):
+            metrics.incr('chat.forbidden')
+            await self.accept()
+            await self.close(code=4403)
+            return
+        self.participants = access[:2]
+
         # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        await self.join_group(self.room_group_name)
         await self.accept()
+        await self.start_lifecycle()
+        await self.join_presence()
 
     async def disconnect(self, close_code):
         # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        await self.end_lifecycle()
+        await self.leave_presence()
+        # Store this client's pending messages before the close completes (see api.chat)
+        from .chat import get_buffer
+        await get_buffer().flush()
 
     # Receive message from WebSocket
     async def receive_json(self, content):
+        if self.participants is None:
+            return  # Access revoked; the close is on its way
+        if content.get('type') == 'typing':
+            await self.set_typing(bool(content.get('typing')))
+            return
+
         message = content.get('message')
         sender_id = self.scope['user'].id
         
         if not message:
             return
+        await self.typing.update(self.job_id, sender_id, False)  # The message ends it; clients clear on chat_message
 
-        # Save to database (Sync to Async)
-        from channels.db import database_sync_to_async
-        from .models import Message, Job, User
-        
-        await self.save_message(sender_id, self.job_id, message)
+        from django.conf import settings
+        from django.utils import timezone
+        receiver_id = self.counterpart_id()
+
+        if not settings.CHAT_WRITE_BEHIND:
+            await self.save_message(sender_id, receiver_id, message)
 
         # Send message to room group
         await self.channel_layer.group_send(
@@ -76,10 +177,15 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                 'type': 'chat_message',
                 'message': message,
                 'sender_id': sender_id,
-                'timestamp': str(content.get('timestamp', 'Now')) # Or use server time
+                'timestamp': str(content.get('timestamp', timezone.now().isoformat()))
             }
         )
 
+        if settings.CHAT_WRITE_BEHIND:
+            # Stored by the next batched flush, after delivery (see api.chat)
+            from .chat import get_buffer
+            await get_buffer().add(job_id=int(self.job_id), sender_id=sender_id, receiver_id=receiver_id, content=message)
+
     # Receive message from room group
     async def chat_message(self, event):
         await self.send_json({
@@ -89,21 +195,83 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             'timestamp': event.get('timestamp')
         })
 
+    # Presence and typing (see api.presence): cache only, never stored
+    async def join_presence(self):
+        from .presence import TypingThrottle, is_online, is_typing, touch
+        user_id = self.scope['user'].id
+        self.typing = TypingThrottle()
+        if await touch(self.job_id, user_id, self.channel_name):
+            await self.send_presence(online=True)
+        # Tell this client where the other participant stands
+        other_id = self.counterpart_id()
+        await self.send_json({
+            'type': 'presence',
+            'user_id': other_id,
+            'online': await is_online(self.job_id, other_id),
+            'typing': await is_typing(self.job_id, other_id),
+        })
+
+    async def leave_presence(self):
+        from .presence import leave
+        if hasattr(self, 'typing') and await leave(self.job_id, self.scope['user'].id, self.channel_name):
+            await self.send_presence(online=False, typing=False)
+
+    async def on_heartbeat(self):
+        from .presence import touch
+        await touch(self.job_id, self.scope['user'].id, self.channel_name)
+
+    async def set_typing(self, typing):
+        if await self.typing.update(self.job_id, self.scope['user'].id, typing):
+            await self.send_presence(typing=typing)
+
+    async def send_presence(self, **state):
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'presence_event', 'user_id': self.scope['user'].id, **state,
+        })
+
+    async def presence_event(self, event):
+        if event['user_id'] == self.scope['user'].id:
+            return  # Own state: this user's other tabs don't need it
+        await self.send_json({'type': 'presence', **{k: v for k, v in event.items() if k != 'type'}})
+
+    def allowed(self, access):
+        customer_id, provider_user_id, status = access
+        return status != 'cancelled' and self.scope['user'].id in (customer_id, provider_user_id)
+
+    async def job_access_changed(self, event):
+        # The job was updated (e.g. cancelled or reassigned): check access again
+        access = await self.job_access(self.job_id)
+        if access is not None and self.allowed(access):
+            self.participants = access[:2]
+            return
+        metrics.incr('chat.revoked')
+        self.participants = None
+        await self.end_lifecycle()
+        await self.close(code=4403)
+
+    def counterpart_id(self):
+        customer_id, provider_user_id = self.participants
+        return provider_user_id if self.scope['user'].id == customer_id else customer_id
+
+    @database_sync_to_async
+    def job_access(self, job_id):
+        """(customer user id, provider user id, status) for the job, or None if it doesn't exist"""
+        from .models import Job
+        try:
+            return Job.objects.filter(id=int(job_id)).values_list('request__user_id', 'provider__user_id', 'status').first()
+        except ValueError:
+            return None
+
     @database_sync_to_async
-    def save_message(self, user_id, job_id, content):
-        from .models import Message, Job, User
+    def save_message(self, sender_id, receiver_id, content):
+        from .chat import store_messages
+        from .models import Message
         try:
-            user = User.objects.get(id=user_id)
-            job = Job.objects.get(id=job_id)
-            
-            # Determine receiver
-            receiver = job.provider.user if job.request.user == user else job.request.user
-            
-            Message.objects.create(
-                job=job,
-                sender=user,
-                receiver=receiver,
+            store_messages([Message(
+                job_id=int(self.job_id),
+                sender_id=sender_id,
+                receiver_id=receiver_id,
                 content=content
-            )
+            )])
         except Exception as e:
             print(f"Error saving message: {e}")
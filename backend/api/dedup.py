@@ -0,0 +1,137 @@
+"""
+Near-duplicate lookup for analyzed images.
+
+Each stored ImageAnalysis carries a 64-bit perceptual hash. The hashes are
+kept in an in-process BK-tree so a new upload can find every stored image
+within a Hamming radius without scanning the table. The tree is filled
+incrementally from the database (rows with an id above the last one seen),
+so every worker process converges on the same set of hashes. Deleted rows
+are filtered out at query time and the tree is rebuilt without them once
+they make up REBUILD_FRACTION of it.
+"""
+import threading
+from .models import ImageAnalysis
+
+HASH_BITS = 64
+REBUILD_FRACTION = 0.25
+
+
+def to_signed(value):
+    """Map an unsigned 64-bit hash onto the BigIntegerField range"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes using Hamming distance"""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def items(self):
+        """Every (value, item) in the tree"""
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            value, item, children = stack.pop()
+            yield value, item
+            stack.extend(children.values())
+
+    def search(self, value, max_distance):
+        """Return [(distance, item)] within max_distance, nearest first"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found.append((distance, item))
+            # Triangle inequality: only subtrees in [d - r, d + r] can match
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class PerceptualHashIndex:
+    """BK-tree of ImageAnalysis hashes, synced from the database on demand"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._last_id = 0
+        self._removed = set()
+
+    def refresh(self):
+        rows = ImageAnalysis.objects.filter(id__gt=self._last_id).order_by('id').values_list('id', 'phash')
+        with self._lock:
+            for row_id, phash in rows:
+                if row_id > self._last_id:
+                    self._tree.add(to_unsigned(phash), row_id)
+                    self._last_id = row_id
+
+    def add(self, analysis):
+        with self._lock:
+            if analysis.id > self._last_id:
+                self._tree.add(to_unsigned(analysis.phash), analysis.id)
+                self._last_id = analysis.id
+
+    def discard(self, analysis_id):
+        """Forget a row that was deleted (BK-trees have no cheap removal)"""
+        with self._lock:
+            self._removed.add(analysis_id)
+            if len(self._removed) > self._tree.size * REBUILD_FRACTION:
+                self._rebuild()
+
+    def _rebuild(self):
+        """Re-insert the live hashes into a fresh tree; caller holds the lock"""
+        tree = BKTree()
+        for value, row_id in self._tree.items():
+            if row_id not in self._removed:
+                tree.add(value, row_id)
+        self._tree = tree
+        self._removed = set()
+
+    def find(self, phash, max_distance):
+        """Closest stored ImageAnalysis within max_distance bits, or None"""
+        self.refresh()
+        with self._lock:
+            candidates = [
+                (distance, row_id) for distance, row_id in self._tree.search(phash, max_distance)
+                if row_id not in self._removed
+            ]
+        for distance, row_id in candidates:
+            analysis = ImageAnalysis.objects.filter(id=row_id).first()
+            if analysis is not None:
+                return analysis, distance
+            self.discard(row_id)
+        return None
+
+
+image_index = PerceptualHashIndex()
@@ -0,0 +1,170 @@
+"""
+Keyword based category diagnosis for free-text descriptions.
+
+All category keywords are compiled into one Aho-Corasick automaton, so a
+description is scanned once regardless of how many categories or keywords
+exist. Matches must start on a word boundary and may only be followed by a
+short inflection ("leaks", "clogged"), which keeps "wire" from matching inside
+"wireless". Every category accumulates weighted evidence and the top-k are
+returned with confidences instead of the first hit in iteration order.
+"""
+import threading
+from collections import deque
+
+# Keywords per (lower-cased) category name. Categories without an entry use
+# their own name as the only keyword.
+CATEGORY_KEYWORDS = {
+    'plumbing': ['leak', 'pipe', 'toilet', 'sink', 'tap', 'water', 'drain', 'clog', 'shower', 'basin', 'flush'],
+    'electrical': ['wire', 'light', 'short', 'circuit', 'power', 'switch', 'spark', 'breaker', 'plugin', 'voltage', 'shock'],
+    'cleaning': ['dust', 'wash', 'mop', 'house', 'office', 'dirty', 'deep clean', 'vacuum', 'scrub', 'mess'],
+    'painting': ['wall', 'color', 'brush', 'coat', 'stain', 'renovation', 'interior', 'exterior', 'primer'],
+    'carpentry': ['wood', 'furniture', 'door', 'shelf', 'cabinet', 'fix', 'table', 'chair', 'hammer', 'nail'],
+    'hvac': ['ac', 'air', 'condition', 'heat', 'cool', 'filter', 'vent', 'duct', 'thermostat', 'chiller'],
+}
+
+# Evidence weights: naming the category outright beats a generic keyword,
+# and multi-word phrases are more specific than single words
+NAME_WEIGHT = 2.0
+PHRASE_WEIGHT = 1.5
+KEYWORD_WEIGHT = 1.0
+
+# Inflections allowed after a keyword before the word must end
+SUFFIXES = frozenset(['', 's', 'es', 'ed', 'ing', 'er', 'ers', 'y'])
+MAX_SUFFIX = 4
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over (keyword, category_id, weight) patterns"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword, category_id, weight in patterns:
+            self._insert(keyword, (len(keyword), keyword[-1], category_id, weight))
+        self._link()
+        self.delta = self._compile()
+
+    def _insert(self, keyword, entry):
+        state = 0
+        for char in keyword:
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = nxt
+        self.output[state].append(entry)
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(char, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def _compile(self):
+        """Fold failure links into a full transition table (one dict lookup per char)"""
+        delta = [None] * len(self.goto)
+        delta[0] = dict(self.goto[0])
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            # BFS order guarantees the (shallower) failure state is already compiled
+            table = dict(delta[self.fail[state]])
+            table.update(self.goto[state])
+            delta[state] = table
+            queue.extend(self.goto[state].values())
+        return delta
+
+    @staticmethod
+    def _word_end_ok(text, end, last_char):
+        """True if text[end:] continues with at most an allowed inflection"""
+        stop = end
+        limit = min(len(text), end + MAX_SUFFIX + 1)
+        while stop < limit and text[stop].isalnum():
+            stop += 1
+        if stop < len(text) and text[stop].isalnum():
+            return False
+        rest = text[end:stop]
+        if rest in SUFFIXES:
+            return True
+        # Doubled final consonant: "clog" -> "clogged", "mop" -> "mopping"
+        return rest[:1] == last_char and rest[1:] in SUFFIXES
+
+    def scan(self, text):
+        """Return {category_id: score} for all boundary-respecting matches in text"""
+        scores = {}
+        delta, output = self.delta, self.output
+        state = 0
+        for index, char in enumerate(text):
+            state = delta[state].get(char, 0)
+            if not output[state]:
+                continue
+            for length, last_char, category_id, weight in output[state]:
+                start = index - length + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if not self._word_end_ok(text, index + 1, last_char):
+                    continue
+                scores[category_id] = scores.get(category_id, 0.0) + weight
+        return scores
+
+
+def build_automaton(category_rows):
+    """Compile keywords for [(category_id, name)] into an automaton"""
+    patterns = []
+    for category_id, name in category_rows:
+        name_low = name.lower().strip()
+        if not name_low:
+            continue
+        patterns.append((name_low, category_id, NAME_WEIGHT))
+        for keyword in CATEGORY_KEYWORDS.get(name_low, []):
+            weight = PHRASE_WEIGHT if ' ' in keyword else KEYWORD_WEIGHT
+            patterns.append((keyword, category_id, weight))
+    return KeywordAutomaton(patterns)
+
+
+def rank_categories(automaton, category_rows, description, top_k=3):
+    """Top-k [{category_id, category_name, score, confidence}] for a description"""
+    scores = automaton.scan(description.lower())
+    if not scores:
+        return []
+    names = dict(category_rows)
+    total = sum(scores.values())
+    # Share of the evidence, damped when there is little evidence overall
+    evidence = total / (total + 1.0)
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+    return [
+        {
+            'category_id': category_id,
+            'category_name': names[category_id],
+            'score': score,
+            'confidence': round(score / total * evidence, 2),
+        }
+        for category_id, score in ranked
+    ]
+
+
+_cache = (None, None)
+_cache_lock = threading.Lock()
+
+
+def get_automaton(category_rows):
+    """Automaton for the current category set, rebuilt only when it changes"""
+    global _cache
+    version = tuple(category_rows)
+    cached_version, automaton = _cache
+    if cached_version == version:
+        return automaton
+    with _cache_lock:
+        if _cache[0] != version:
+            _cache = (version, build_automaton(category_rows))
+        return _cache[1]
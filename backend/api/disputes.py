@@ -0,0 +1,92 @@
+"""
+AI summaries for disputes.
+
+The summary comes from ai_service and is stored on Dispute.ai_summary as
+returned. Under daphne it is fetched after the response (see aio.spawn), so
+raising a dispute never waits on the model; elsewhere it is fetched inline.
+A summary previewed through the streaming endpoint
+(views_ai.AIDisputeSummaryStreamView) is cached and stored when the same
+dispute is raised, instead of summarizing it again.
+
+Only the job's customer or provider, or an admin, may summarize or raise a
+dispute about it (dispute_job).
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from . import metrics
+
+
+def dispute_job(user, job_id):
+    """The Job a dispute is about, if user may raise one; DRF errors otherwise"""
+    from rest_framework.exceptions import PermissionDenied, ValidationError
+    from .models import Job
+    if not job_id:
+        raise ValidationError("Job ID is required")
+    try:
+        job = Job.objects.select_related('request__category', 'provider__user').get(id=job_id)
+    except (Job.DoesNotExist, ValueError):
+        raise ValidationError("Job not found")
+    participants = (job.request.user_id, job.provider.user_id if job.provider else None)
+    if user.role != 'admin' and user.id not in participants:
+        raise PermissionDenied("Only the job's customer or provider can raise a dispute")
+    return job
+
+
+def summary_payload(job, reason, role):
+    from .utils import dispute_job_context
+    return {"reason": reason, "job_context": dispute_job_context(job, role)}
+
+
+def summary_cache_key(user_id, job_id, reason):
+    digest = hashlib.sha1(reason.strip().encode()).hexdigest()
+    return f"dispute_summary:{user_id}:{job_id}:{digest}"
+
+
+def remember_summary(user_id, job_id, reason, summary):
+    """Keep a streamed preview's summary so raising the same dispute reuses it"""
+    cache.set(summary_cache_key(user_id, job_id, reason), summary, settings.AI_STREAM_RESULT_TTL)
+
+
+def recall_summary(user_id, job_id, reason):
+    key = summary_cache_key(user_id, job_id, reason)
+    summary = cache.get(key)
+    if summary is not None:
+        cache.delete(key)
+    return summary
+
+
+def summary_from(response):
+    if response.status_code == 200:
+        return response.json()
+    print(f"Dispute AI summary failed: ai_service returned {response.status_code}")
+    metrics.incr('disputes.summary_failures')
+    return None
+
+
+def summarize_dispute(dispute, payload):
+    from .services import ai_service
+    try:
+        summary = summary_from(ai_service().post('/ai/summarize-dispute', settings.AI_ANALYZE_DEADLINE, json=payload))
+    except Exception as e:
+        print(f"Dispute AI summary failed: {e}")
+        metrics.incr('disputes.summary_failures')
+        return
+    if summary:
+        dispute.ai_summary = summary
+        dispute.save(update_fields=['ai_summary'])
+
+
+async def asummarize_dispute(dispute_id, payload):
+    """summarize_dispute() as a background task"""
+    from .models import Dispute
+    from .services import ai_service
+    try:
+        response = await ai_service().apost('/ai/summarize-dispute', settings.AI_ANALYZE_DEADLINE, json=payload)
+    except Exception as e:
+        print(f"Dispute AI summary failed: {e}")
+        metrics.incr('disputes.summary_failures')
+        return
+    summary = summary_from(response)
+    if summary:
+        await Dispute.objects.filter(id=dispute_id).aupdate(ai_summary=summary)
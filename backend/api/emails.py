@@ -53,6 +53,21 @@ This is an automated notification from ServeFlow AI.
             print(f"❌ Email error: {e}")
 
 
+async def asend_new_request_notification(request_id):
+    """send_new_request_notification as a background task (SMTP runs in a worker thread)"""
+    from channels.db import database_sync_to_async
+    from .models import Request
+
+    def send():
+        try:
+            send_new_request_notification(Request.objects.select_related('category', 'user').get(id=request_id))
+        except Exception as e:
+            print(f"Email notification failed: {e}")
+
+    # Own thread and connection: a slow SMTP server does not hold up other sync work
+    await database_sync_to_async(send, thread_sensitive=False)()
+
+
 def send_job_status_notification(job, old_status, new_status):
     """
     Email customer when job status changes
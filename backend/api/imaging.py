@@ -0,0 +1,158 @@
+"""
+Image preprocessing for AI vision analysis.
+
+Uploads are decoded once, downsampled to a bounded edge length, stripped of
+EXIF metadata and re-encoded to a compact JPEG/WebP before they are stored or
+sent to Gemini. Decoding (HEIC in particular) is CPU heavy, so the work runs in
+a process pool instead of on the request thread.
+"""
+import io
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from django.conf import settings
+from PIL import Image, ImageOps
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    print("Warning: pillow-heif not installed. HEIC support will be limited.")
+
+OUTPUT_FORMATS = {
+    'JPEG': ('image/jpeg', '.jpg'),
+    'WEBP': ('image/webp', '.webp'),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class PreprocessedImage:
+    """Compact, metadata-free encoding of an uploaded image"""
+
+    def __init__(self, data, image_format, width, height, original_size, phash=None):
+        self.data = data
+        self.format = image_format
+        self.width = width
+        self.height = height
+        self.original_size = original_size
+        self.phash = phash
+
+    @property
+    def mime_type(self):
+        return OUTPUT_FORMATS[self.format][0]
+
+    @property
+    def extension(self):
+        return OUTPUT_FORMATS[self.format][1]
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def as_gemini_part(self):
+        """Inline blob accepted by generate_content alongside the prompt"""
+        return {'mime_type': self.mime_type, 'data': self.data}
+
+
+def dhash(image, hash_size=8):
+    """
+    64-bit difference hash: compares horizontally adjacent pixels of a tiny
+    grayscale thumbnail. Robust to re-encoding, rescaling and mild crops.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def preprocess_image(data, max_edge=1536, image_format='JPEG', quality=85):
+    """
+    Decode image bytes once and return a downsampled PreprocessedImage.
+
+    Runs inside pool workers, so it must not touch Django settings or the ORM.
+    Raises PIL.UnidentifiedImageError / OSError for undecodable input.
+    """
+    image_format = image_format.upper()
+    if image_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {image_format}")
+
+    image = Image.open(io.BytesIO(data))
+    if image.format == 'JPEG':
+        # Let libjpeg decode at a reduced DCT scale instead of full resolution
+        image.draft('RGB', (max_edge, max_edge))
+
+    # Bake the EXIF orientation into the pixels before the metadata is dropped
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    output = io.BytesIO()
+    # No exif= argument: the re-encoded file carries no GPS/camera metadata
+    image.save(output, format=image_format, quality=quality, optimize=True)
+
+    return PreprocessedImage(
+        data=output.getvalue(),
+        image_format=image_format,
+        width=image.width,
+        height=image.height,
+        original_size=len(data),
+        phash=dhash(image),
+    )
+
+
+def output_extension():
+    """File extension of images produced with the configured format"""
+    return OUTPUT_FORMATS[settings.AI_IMAGE_FORMAT.upper()][1]
+
+
+def get_executor():
+    """Lazily start the shared preprocessing pool (None when disabled)"""
+    global _executor
+    if settings.AI_IMAGE_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # spawn avoids forking a process that already runs daphne threads
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.AI_IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _executor
+
+
+def submit_preprocess(data):
+    """Schedule preprocessing with the configured limits and return a Future"""
+    args = (
+        data,
+        settings.AI_IMAGE_MAX_EDGE,
+        settings.AI_IMAGE_FORMAT,
+        settings.AI_IMAGE_QUALITY,
+    )
+    executor = get_executor()
+    if executor is None:
+        future = Future()
+        try:
+            future.set_result(preprocess_image(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return executor.submit(preprocess_image, *args)
+
+
+def preprocess_upload(data):
+    """Preprocess uploaded bytes in the pool and wait for the result"""
+    return submit_preprocess(data).result(timeout=settings.AI_IMAGE_PREPROCESS_TIMEOUT)
@@ -0,0 +1,86 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.models import Request, Dispute
+from api.services import ai_service
+from api.utils import dispute_job_context
+
+
+class Command(BaseCommand):
+    help = "Fill empty Request/Dispute ai_summary fields through ai_service's /ai/batch endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=['requests', 'disputes'], default=None)
+        parser.add_argument('--batch-size', type=int, default=50, help="Items per /ai/batch call")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many items per model")
+        parser.add_argument('--dry-run', action='store_true', help="Count what would be backfilled")
+
+    def handle(self, *args, **options):
+        if options['only'] in (None, 'requests'):
+            queryset = Request.objects.filter(ai_summary={}).select_related('category').order_by('id')
+            self.backfill(queryset, 'analyze-request', self.request_item, 'llm', options)
+        if options['only'] in (None, 'disputes'):
+            queryset = (Dispute.objects.filter(ai_summary={})
+                        .select_related('job__request__category', 'job__provider__user', 'raised_by')
+                        .order_by('id'))
+            self.backfill(queryset, 'summarize-dispute', self.dispute_item, None, options)
+
+    @staticmethod
+    def request_item(obj):
+        return {
+            "title": obj.title,
+            "description": obj.description,
+            "category": obj.category.name if obj.category else "General",
+        }
+
+    @staticmethod
+    def dispute_item(obj):
+        return {"reason": obj.reason, "job_context": dispute_job_context(obj.job, obj.raised_by.role)}
+
+    def backfill(self, queryset, endpoint, to_item, source, options):
+        label = queryset.model.__name__
+        total = queryset.count()
+        if options['limit'] is not None:
+            total = min(total, options['limit'])
+        self.stdout.write(f"{label}: {total} without ai_summary")
+        if options['dry_run'] or not total:
+            return
+
+        done = failed = 0
+        last_id = 0
+        start = time.perf_counter()
+        while done + failed < total:
+            # Keyset pagination: rows that fail stay empty, so offsets would shift
+            size = min(options['batch_size'], total - done - failed)
+            objs = list(queryset.filter(id__gt=last_id)[:size])
+            if not objs:
+                break
+            last_id = objs[-1].id
+            try:
+                response = ai_service().post(
+                    f"/ai/batch/{endpoint}", settings.AI_BATCH_DEADLINE,
+                    json={"items": [to_item(obj) for obj in objs]},
+                )
+                response.raise_for_status()
+                body = response.json()
+                results = body['results']
+            except Exception as e:
+                self.stderr.write(f"{label} batch after #{objs[0].id - 1} failed: {e}")
+                failed += len(objs)
+                continue
+
+            # Mock answers (no Gemini key) must not become classifier training labels
+            tag = {"source": "mock" if 'warning' in body else source} if source else {}
+            updated = []
+            for obj, outcome in zip(objs, results):
+                if outcome.get('ok'):
+                    obj.ai_summary = {**outcome['result'], **tag}
+                    updated.append(obj)
+                else:
+                    failed += 1
+            queryset.model.objects.bulk_update(updated, ['ai_summary'])
+            done += len(updated)
+            self.stdout.write(f"  {done}/{total} filled, {failed} failed")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"{label}: filled {done}, failed {failed} in {elapsed:.1f}s"))
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import path
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from api.payments import create_checkout_session
+from api.views import StripeCheckoutView
+
+PREFIX = 'asyncbench_'
+
+
+class SyncCheckoutView(APIView):
+    """StripeCheckoutView as it was before going async, for comparison"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        session = create_checkout_session(request.data['invoice_id'], request.data.get('success_url'),
+                                          request.data.get('cancel_url'))
+        return Response({'checkout_url': session.url, 'session_id': session.id})
+
+
+urlpatterns = [
+    path('sync/', SyncCheckoutView.as_view()),
+    path('async/', StripeCheckoutView.as_view()),
+]
+
+
+def app_threads():
+    """Threads in this process, not counting the Stripe stand-in's per-request ones"""
+    return sum(1 for t in threading.enumerate() if 'process_request_thread' not in t.name)
+
+
+class Command(BaseCommand):
+    help = ("Compare concurrency per process of the sync and async checkout views under Django's ASGI handler "
+            "(in-process, as daphne runs it) against a local Stripe stand-in with fixed latency. Creates "
+            "asyncbench_* rows and temporarily sets a placeholder Stripe key if none is configured.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency-ms', type=float, default=200, help="Stripe stand-in response time")
+        parser.add_argument('--concurrency', default='10,50,200', help="Comma-separated in-flight request counts")
+        parser.add_argument('--requests', type=int, default=400, help="Requests per run")
+
+    def handle(self, *args, **options):
+        import stripe
+        server = self.start_upstream(options['latency_ms'])
+        api_base = stripe.api_base
+        stripe.api_base = f"http://127.0.0.1:{server.server_port}"
+        fixtures = None
+        try:
+            fixtures = self.create_fixtures()
+            self.stdout.write(f"Stripe stand-in at {stripe.api_base}, {options['latency_ms']:g} ms per call; "
+                              f"'threads' is the peak number of threads serving requests during the run")
+            with override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=['testserver']):
+                for concurrency in (int(c) for c in options['concurrency'].split(',')):
+                    for kind in ('sync', 'async'):
+                        result = asyncio.run(self.run(kind, concurrency, options['requests'], fixtures))
+                        self.stdout.write(
+                            f"{kind:>5} x{concurrency:<4} {result['rps']:7.1f} req/s  p50 {result['p50']:7.0f} ms  "
+                            f"p95 {result['p95']:7.0f} ms  threads {result['threads']:4d}  errors {result['errors']}"
+                        )
+        finally:
+            stripe.api_base = api_base
+            server.shutdown()
+            self.delete_fixtures(fixtures)
+
+    def start_upstream(self, latency_ms):
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(latency_ms / 1000)
+                payload = json.dumps({'id': 'cs_bench', 'object': 'checkout.session',
+                                      'url': 'https://checkout.example/cs_bench'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 1024  # The default backlog of 5 would stall concurrent connects
+            daemon_threads = True
+
+        server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def create_fixtures(self):
+        from rest_framework.authtoken.models import Token
+        from api.models import Invoice, Job, Provider, Request, SystemSettings, User
+        User.objects.filter(username__startswith=PREFIX).delete()  # Left over from an interrupted run
+        customer = User.objects.create(username=f"{PREFIX}customer")
+        provider = Provider.objects.create(user=User.objects.create(username=f"{PREFIX}provider", role='provider'))
+        request = Request.objects.create(user=customer, title=f"{PREFIX}request", description='bench', address='bench')
+        job = Job.objects.create(request=request, provider=provider, status='completed')
+        invoice = Invoice.objects.create(job=job, subtotal=100, total=100)
+        system_settings = SystemSettings.get_settings()
+        original_key = system_settings.stripe_secret_key
+        if not original_key:
+            system_settings.stripe_secret_key = 'sk_test_bench'
+            system_settings.save()
+        return {'token': Token.objects.create(user=customer).key, 'invoice_id': invoice.id,
+                'original_key': original_key}
+
+    def delete_fixtures(self, fixtures):
+        from api.models import SystemSettings, User
+        if fixtures and not fixtures['original_key']:
+            system_settings = SystemSettings.get_settings()
+            system_settings.stripe_secret_key = fixtures['original_key']
+            system_settings.save()
+        User.objects.filter(username__startswith=PREFIX).delete()
+
+    async def run(self, kind, concurrency, count, fixtures):
+        from django.core.asgi import get_asgi_application
+        transport = httpx.ASGITransport(app=get_asgi_application())
+        headers = {'Authorization': f"Token {fixtures['token']}"}
+        body = {'invoice_id': fixtures['invoice_id'], 'success_url': 'https://example.com/ok',
+                'cancel_url': 'https://example.com/cancel'}
+        latencies, errors = [], 0
+        peak_threads = app_threads()
+        queue = asyncio.Queue()
+        for _ in range(count):
+            queue.put_nowait(None)
+
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver', timeout=120) as client:
+            async def worker():
+                nonlocal errors
+                while not queue.empty():
+                    queue.get_nowait()
+                    start = time.perf_counter()
+                    response = await client.post(f"/{kind}/", json=body, headers=headers)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    if response.status_code != 200:
+                        errors += 1
+
+            async def sample_threads():
+                nonlocal peak_threads
+                while True:
+                    peak_threads = max(peak_threads, app_threads())
+                    await asyncio.sleep(0.05)
+
+            sampler = asyncio.create_task(sample_threads())
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+            sampler.cancel()
+
+        latencies.sort()
+        return {
+            'rps': count / elapsed,
+            'p50': latencies[len(latencies) // 2],
+            'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'errors': errors,
+            'threads': peak_threads,
+        }
@@ -0,0 +1,94 @@
+import random
+import re
+import time
+from django.core.management.base import BaseCommand
+from api.diagnosis import CATEGORY_KEYWORDS, build_automaton, rank_categories
+
+CATEGORY_ROWS = [(i + 1, name.title()) for i, name in enumerate(CATEGORY_KEYWORDS)]
+
+FILLER = (
+    "the tenant reported that since last week something has not been working properly "
+    "and they would like someone to come over and take a look as soon as possible "
+).split()
+
+
+def synthetic_description(length, rng):
+    keywords = [k for words in CATEGORY_KEYWORDS.values() for k in words]
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(keywords) if rng.random() < 0.05 else rng.choice(FILLER)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def substring_scan(category_rows, desc):
+    """The previous per-keyword `in` scan, first hit wins"""
+    for category_id, name in category_rows:
+        name_low = name.lower()
+        for word in CATEGORY_KEYWORDS.get(name_low, [name_low]):
+            if word in desc:
+                return category_id
+    return None
+
+
+def boundary_regex_scan(patterns, desc):
+    """Same semantics as the automaton, one regex pass per keyword"""
+    scores = {}
+    for regex, category_id in patterns:
+        hits = len(regex.findall(desc))
+        if hits:
+            scores[category_id] = scores.get(category_id, 0) + hits
+    return scores
+
+
+class Command(BaseCommand):
+    help = "Benchmark keyword diagnosis on long descriptions: substring, per-keyword regex and automaton"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', default='200,2000,20000,200000',
+                            help="Comma separated description lengths in characters")
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        repeat = options['repeat']
+
+        start = time.perf_counter()
+        automaton = build_automaton(CATEGORY_ROWS)
+        self.stdout.write(f"automaton build: {(time.perf_counter() - start) * 1000:.2f} ms "
+                          f"({len(automaton.goto)} states)")
+
+        regexes = [
+            (re.compile(rf"(?<![a-z0-9]){re.escape(keyword)}(?:s|es|ed|ing|er|ers|y)?(?![a-z0-9])"), category_id)
+            for category_id, name in CATEGORY_ROWS
+            for keyword in [name.lower()] + CATEGORY_KEYWORDS.get(name.lower(), [])
+        ]
+
+        for length in [int(x) for x in options['lengths'].split(',')]:
+            desc = synthetic_description(length, rng).lower()
+
+            # Old path also rebuilt the keyword map per call; worst case is no early hit
+            miss = desc.replace('e', '#')
+            start = time.perf_counter()
+            for _ in range(repeat):
+                substring_scan(CATEGORY_ROWS, miss)
+            substring_us = (time.perf_counter() - start) / repeat * 1e6
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                boundary_regex_scan(regexes, desc)
+            regex_us = (time.perf_counter() - start) / repeat * 1e6
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                ranked = rank_categories(automaton, CATEGORY_ROWS, desc, top_k=3)
+            automaton_us = (time.perf_counter() - start) / repeat * 1e6
+
+            top = ", ".join(f"{r['category_name']}={r['confidence']}" for r in ranked)
+            self.stdout.write(
+                f"{length:>7} chars  substring first-hit {substring_us:>9.1f} us  "
+                f"per-keyword regex {regex_us:>9.1f} us  automaton top-3 {automaton_us:>9.1f} us  [{top}]"
+            )
@@ -0,0 +1,89 @@
+import io
+import time
+import statistics
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+from api.imaging import preprocess_image
+
+
+def synthetic_photo(width=4032, height=3024):
+    """Phone-sized JPEG with enough texture to compress like a real photo"""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    image = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    exif = Image.Exif()
+    exif[0x010F] = 'BenchCam'  # Make
+    exif[0x0112] = 6           # Orientation: rotate 90
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=92, exif=exif)
+    return output.getvalue()
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+class Command(BaseCommand):
+    help = "Compare bytes sent and latency for raw vs preprocessed vision uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="Image files (defaults to a synthetic 12MP photo)")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--uplink-mbps', type=float, default=10.0,
+                            help="Uplink used to estimate transfer time to Gemini")
+
+    def handle(self, *args, **options):
+        samples = []
+        for path in options['paths']:
+            with open(path, 'rb') as f:
+                samples.append((path, f.read()))
+        if not samples:
+            samples.append(('synthetic-12mp.jpg', synthetic_photo()))
+
+        repeat = options['repeat']
+        bytes_per_ms = options['uplink_mbps'] * 1_000_000 / 8 / 1000
+
+        self.stdout.write(
+            f"max_edge={settings.AI_IMAGE_MAX_EDGE} format={settings.AI_IMAGE_FORMAT} "
+            f"quality={settings.AI_IMAGE_QUALITY} uplink={options['uplink_mbps']}Mbps"
+        )
+        for name, data in samples:
+            # Before: the file went to Gemini as-is (backend) or as a lossless
+            # full-resolution WebP built from the decoded PIL image (ai_service)
+            def full_decode_webp():
+                image = Image.open(io.BytesIO(data))
+                image.load()
+                output = io.BytesIO()
+                image.save(output, format='webp', lossless=True)
+                return output.getvalue()
+
+            webp, webp_ms = timed(full_decode_webp, repeat)
+            processed, after_ms = timed(
+                lambda: preprocess_image(
+                    data,
+                    settings.AI_IMAGE_MAX_EDGE,
+                    settings.AI_IMAGE_FORMAT,
+                    settings.AI_IMAGE_QUALITY,
+                ),
+                repeat,
+            )
+
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            rows = [
+                ('raw upload', len(data), 0.0),
+                ('full-res lossless webp', len(webp), webp_ms),
+                (f'preprocessed {processed.width}x{processed.height}', processed.size, after_ms),
+            ]
+            for label, size, cpu_ms in rows:
+                transfer_ms = size / bytes_per_ms
+                self.stdout.write(
+                    f"  {label:<32} {size / 1024:>9.1f} KiB  cpu {cpu_ms:>7.1f} ms  "
+                    f"transfer {transfer_ms:>8.1f} ms  total {cpu_ms + transfer_ms:>8.1f} ms"
+                )
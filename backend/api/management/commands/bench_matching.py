@@ -0,0 +1,64 @@
+import random
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.matching import push_providers, score_remote, score_rows
+from api.services import ServiceUnavailable
+
+
+class Command(BaseCommand):
+    help = ("Benchmark local vs matching_service provider ranking on synthetic candidate sets "
+            "(no database access). --remote REPLACES matching_service's stored providers with the "
+            "synthetic ones: point MATCHING_SERVICE_URL at a scratch instance, or re-run "
+            "sync_matching_service afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help="Comma-separated candidate counts")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--remote', action='store_true', help="Also time matching_service (see above)")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        limit = options['limit']
+        lat, lon = 40.7128, -74.0060
+        if options['remote']:
+            self.stdout.write(f"matching_service: {settings.MATCHING_SERVICE_URL}")
+
+        for size in (int(s) for s in options['sizes'].split(',')):
+            rows = [
+                (provider_id, round(rng.uniform(0, 5), 2), rng.choice(('available', 'available', 'busy', 'offline')),
+                 round(lat + rng.gauss(0, 0.3), 6), round(lon + rng.gauss(0, 0.3), 6), int(rng.expovariate(1 / 15)))
+                for provider_id in range(1, size + 1)
+            ]
+            local_ms, local = self.timed(options['repeat'], lambda: score_rows(rows, lat, lon, limit))
+            line = f"{size:>7} providers  local {local_ms:8.1f} ms"
+
+            if options['remote']:
+                records = [
+                    {'provider_id': pid, 'latitude': plat, 'longitude': plon, 'rating': rating,
+                     'completed_jobs': completed, 'availability_status': status, 'categories': ['1']}
+                    for pid, rating, status, plat, plon, completed in rows
+                ]
+                try:
+                    start = time.perf_counter()
+                    push_providers(records, replace=True, deadline=300)
+                    sync_ms = (time.perf_counter() - start) * 1000
+                    remote_ms, (remote, _) = self.timed(options['repeat'], lambda: score_remote(1, lat, lon, limit=limit))
+                except ServiceUnavailable as e:
+                    line += f"  remote unavailable ({e})"
+                else:
+                    agree = [(m.provider_id, m.match_score) for m in local] == [(m.provider_id, m.match_score) for m in remote]
+                    line += (f"  remote {remote_ms:8.1f} ms  (sync {sync_ms:8.0f} ms)  "
+                             f"{'same ranking' if agree else 'RANKINGS DIFFER'}")
+            self.stdout.write(line)
+
+    def timed(self, repeat, fn):
+        """Median wall time in ms over `repeat` runs, and the last result"""
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            timings.append((time.perf_counter() - start) * 1000)
+        return sorted(timings)[len(timings) // 2], result
@@ -0,0 +1,45 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from api.pricing import PriceIndex, format_hours
+from api.utils import geo_cell
+
+
+class Command(BaseCommand):
+    help = "Benchmark historical price/duration lookups on a synthetic sample set (no database access)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=100000)
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--lookups', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        index = PriceIndex()
+        index.next_refresh = float('inf')  # Synthetic data only, never hit the DB
+        points = [(rng.uniform(-40, 60), rng.uniform(-120, 150)) for _ in range(200)]
+
+        samples = []
+        for _ in range(options['samples']):
+            lat, lon = rng.choice(points)
+            cell = geo_cell(lat + rng.gauss(0, 0.05), lon + rng.gauss(0, 0.05))
+            samples.append((rng.randrange(options['categories']), cell,
+                            rng.lognormvariate(5, 0.6), rng.lognormvariate(1.2, 0.7)))
+
+        start = time.perf_counter()
+        index.merge(samples)
+        load_ms = (time.perf_counter() - start) * 1000
+        self.stdout.write(f"loaded {options['samples']} samples into {len(index.prices)} keys in {load_ms:.0f} ms")
+
+        queries = [(rng.randrange(options['categories']), *rng.choice(points)) for _ in range(options['lookups'])]
+        start = time.perf_counter()
+        for category_id, lat, lon in queries:
+            estimate = index.estimate(category_id, lat, lon)
+        per_lookup_us = (time.perf_counter() - start) / len(queries) * 1e6
+
+        budget, duration = estimate['budget'], estimate['duration']
+        self.stdout.write(
+            f"estimate: {per_lookup_us:.1f} us/lookup  last -> ${budget['low']:.0f} - ${budget['high']:.0f} "
+            f"({budget['scope']}, n={budget['samples']}), {format_hours(duration['low'], duration['high'])}"
+        )
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import random
+import time
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+PREFIX = 'wsbench_'
+
+LAYERS = {
+    'memory': lambda options: {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    'redis': lambda options: {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [options['redis_url']], "group_expiry": settings.WS_GROUP_EXPIRY},
+    },
+}
+
+
+def percentiles(values):
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return f"p50 {pick(0.5):7.1f}  p95 {pick(0.95):7.1f}  p99 {pick(0.99):7.1f}  max {values[-1] * 1000:7.1f} ms"
+
+
+class Client:
+    """One websocket through the full ASGI stack, collecting bench frames as they arrive"""
+
+    def __init__(self, path):
+        from serveflow.asgi import application
+        # AllowedHostsOriginValidator rejects sockets without an Origin, so send a browser-like one
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        self.comm = WebsocketCommunicator(application, path, headers=[(b'origin', f"http://{host}".encode())])
+        self.frames = []  # (received at, frame)
+        self.reader = None
+
+    async def connect(self):
+        start = time.perf_counter()
+        connected, _ = await self.comm.connect(timeout=30)
+        elapsed = time.perf_counter() - start
+        if connected:
+            self.reader = asyncio.get_running_loop().create_task(self.read())
+        return connected, elapsed
+
+    async def read(self):
+        while True:
+            # Read the queue directly: receive_output() cancels the app on timeout
+            message = await self.comm.output_queue.get()
+            if message['type'] != 'websocket.send':
+                return
+            frame = json.loads(message['text'])
+            if frame.get('type') == 'ping':
+                await self.comm.send_to(text_data=json.dumps({'type': 'pong'}))
+            elif frame.get('type') == 'batch':
+                now = time.perf_counter()
+                self.frames.extend((now, event) for event in frame['events'])
+            else:
+                self.frames.append((time.perf_counter(), frame))
+
+    async def close(self):
+        if self.reader:
+            self.reader.cancel()
+        try:
+            await self.comm.disconnect(timeout=5)
+        except Exception:
+            pass
+
+
+class Command(BaseCommand):
+    help = ("Load-test the websocket endpoints in-process: open N ws/notifications/ connections and chat rooms "
+            "through serveflow.asgi (TokenAuthMiddleware ?token= auth), drive notification, chat and category "
+            "broadcast traffic at a set rate, and report connect latency, delivery latency percentiles and loss "
+            "per channel layer. Creates wsbench_* users, jobs and tokens in the configured database and deletes "
+            "them afterwards. For --layers redis, run a local Redis (e.g. `docker compose up redis`).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layers', default='memory', help="Comma-separated: memory,redis")
+        parser.add_argument('--redis-url', default=settings.REDIS_URL or 'redis://127.0.0.1:6379/0')
+        parser.add_argument('--connections', type=int, default=200, help="Notification sockets (available providers)")
+        parser.add_argument('--rooms', type=int, default=20, help="Chat rooms, two sockets each")
+        parser.add_argument('--rate', type=float, default=100, help="Notifications and chat messages per second, each")
+        parser.add_argument('--broadcast-rate', type=float, default=1, help="Category broadcasts per second")
+        parser.add_argument('--duration', type=float, default=5, help="Seconds of traffic")
+        parser.add_argument('--drain', type=float, default=2, help="Seconds to wait for late frames before counting loss")
+        parser.add_argument('--connect-concurrency', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        layers = [name.strip() for name in options['layers'].split(',') if name.strip()]
+        unknown = set(layers) - set(LAYERS)
+        if unknown:
+            raise CommandError(f"Unknown layer(s): {', '.join(sorted(unknown))}")
+
+        fixtures = self.create_fixtures(options)
+        try:
+            for name in layers:
+                if name == 'redis':
+                    try:
+                        import channels_redis  # noqa: F401
+                    except ImportError:
+                        self.stdout.write(self.style.WARNING("redis: channels_redis is not installed, skipped"))
+                        continue
+                with override_settings(CHANNEL_LAYERS={'default': LAYERS[name](options)}):
+                    try:
+                        asyncio.run(self.run(name, fixtures, options))
+                    except (OSError, ConnectionError) as e:
+                        self.stdout.write(self.style.WARNING(f"{name}: channel layer unavailable ({e}), skipped"))
+        finally:
+            self.delete_fixtures()
+
+    def create_fixtures(self, options):
+        """Tokens for notification users (available providers in one category) and chat rooms (jobs)"""
+        from rest_framework.authtoken.models import Token
+        from api.models import Category, Job, Provider, Request, User
+        self.delete_fixtures()
+        category = Category.objects.create(name=f"{PREFIX}category")
+        User.objects.bulk_create([
+            User(username=f"{PREFIX}{i}", email=f"{PREFIX}{i}@example.com", role='provider')
+            for i in range(options['connections'] + 2 * options['rooms'])
+        ])
+        users = list(User.objects.filter(username__startswith=PREFIX).order_by('id'))
+        tokens = {t.user_id: t.key for t in Token.objects.bulk_create([Token(user=u, key=Token.generate_key()) for u in users])}
+        providers = Provider.objects.bulk_create([
+            Provider(user=u, availability_status='available') for u in users[:options['connections']]
+        ])
+        Provider.categories.through.objects.bulk_create([
+            Provider.categories.through(provider_id=p.id, category_id=category.id) for p in providers
+        ])
+
+        rooms = []
+        room_users = users[options['connections']:]
+        for i in range(options['rooms']):
+            customer, provider_user = room_users[2 * i], room_users[2 * i + 1]
+            provider = Provider.objects.create(user=provider_user, availability_status='busy')
+            request = Request.objects.create(user=customer, category=category, title=f"{PREFIX}{i}",
+                                             description='bench', address='bench')
+            job = Job.objects.create(request=request, provider=provider, status='accepted')
+            rooms.append((job.id, (customer.id, tokens[customer.id]), (provider_user.id, tokens[provider_user.id])))
+        return {
+            'category_id': category.id,
+            'notify': [(u.id, tokens[u.id]) for u in users[:options['connections']]],
+            'rooms': rooms,
+        }
+
+    def delete_fixtures(self):
+        from api.models import Category, User
+        User.objects.filter(username__startswith=PREFIX).delete()
+        Category.objects.filter(name__startswith=PREFIX).delete()
+
+    async def connect_all(self, paths, concurrency):
+        clients = [Client(path) for path in paths]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def connect(client):
+            async with semaphore:
+                return await client.connect()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(connect(c) for c in clients))
+        wall = time.perf_counter() - start
+        return clients, [elapsed for ok, elapsed in results if ok], sum(1 for ok, _ in results if not ok), wall
+
+    async def run(self, name, fixtures, options):
+        from api.broadcast import category_group
+        from api.connections import process_rss_mb
+        from api.notifications import asend_notification, broadcast, bus
+        bus.capture_loop(asyncio.get_running_loop())
+        rng = random.Random(options['seed'])
+        rss_before = process_rss_mb()
+
+        notify_clients, notify_connects, notify_failed, notify_wall = await self.connect_all(
+            [f"/ws/notifications/?token={token}" for _, token in fixtures['notify']], options['connect_concurrency'])
+        chat_paths = []
+        for job_id, customer, provider in fixtures['rooms']:
+            chat_paths += [f"/ws/chat/{job_id}/?token={customer[1]}", f"/ws/chat/{job_id}/?token={provider[1]}"]
+        chat_clients, chat_connects, chat_failed, chat_wall = await self.connect_all(chat_paths, options['connect_concurrency'])
+        rss_connected = process_rss_mb()
+
+        connects = notify_connects + chat_connects
+        self.stdout.write(f"[{name}] connected {len(connects)} sockets in {notify_wall + chat_wall:.1f}s "
+                          f"({notify_failed + chat_failed} failed)")
+        self.stdout.write(f"  connect           {percentiles(connects)}")
+        if rss_before is not None and connects:
+            self.stdout.write(f"  RSS               {rss_before:.1f} -> {rss_connected:.1f} MB "
+                              f"({(rss_connected - rss_before) * 1024 / len(connects):.1f} KB per connection)")
+
+        notify_users = [user_id for (user_id, _), client in zip(fixtures['notify'], notify_clients) if client.reader]
+        rooms = [(job_id, chat_clients[2 * i], chat_clients[2 * i + 1])
+                 for i, (job_id, _, _) in enumerate(fixtures['rooms'])
+                 if chat_clients[2 * i].reader and chat_clients[2 * i + 1].reader]
+        sent = {'notify': {}, 'chat': {}, 'broadcast': {}}  # bench id -> send time (and expected recipients)
+
+        async def drive(kind, rate, send_one):
+            if rate <= 0:
+                return
+            interval, count = 1 / rate, int(options['duration'] * rate)
+            start = time.perf_counter()
+            for i in range(count):
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await send_one(f"{kind}-{i}")
+
+        async def send_notification(bench_id):
+            user_id = rng.choice(notify_users)
+            sent['notify'][bench_id] = (time.perf_counter(), 1)
+            await asend_notification(user_id, bench_id, 'bench', {'bench_id': bench_id})
+
+        async def send_chat(bench_id):
+            job_id, sender, receiver = rng.choice(rooms)
+            if rng.random() < 0.5:
+                sender, receiver = receiver, sender
+            sent['chat'][bench_id] = (time.perf_counter(), 1)
+            await sender.comm.send_json_to({'message': bench_id})
+
+        async def send_broadcast(bench_id):
+            sent['broadcast'][bench_id] = (time.perf_counter(), len(notify_users))
+            broadcast([category_group(fixtures['category_id'])],
+                      {'message': bench_id, 'type': 'bench', 'payload': {'bench_id': bench_id}})
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            drive('notify', options['rate'] if notify_users else 0, send_notification),
+            drive('chat', options['rate'] if rooms else 0, send_chat),
+            drive('broadcast', options['broadcast_rate'] if notify_users else 0, send_broadcast),
+        )
+        traffic_s = time.perf_counter() - start
+        await asyncio.sleep(options['drain'])
+
+        received = {'notify': [], 'chat': [], 'broadcast': []}
+        delivered = {kind: 0 for kind in received}
+        for client in notify_clients:
+            for at, frame in client.frames:
+                if frame.get('message') in sent['broadcast']:
+                    kind = 'broadcast'
+                elif frame.get('message') in sent['notify']:
+                    kind = 'notify'
+                else:
+                    continue
+                received[kind].append(at - sent[kind][frame['message']][0])
+                delivered[kind] += 1
+        for client in chat_clients:
+            for at, frame in client.frames:
+                if frame.get('type') == 'chat_message' and frame.get('message') in sent['chat']:
+                    received['chat'].append(at - sent['chat'][frame['message']][0])
+                    delivered['chat'] += 1
+
+        self.stdout.write(f"  traffic           {traffic_s:.1f}s at {options['rate']:g}/s notifications and chat, "
+                          f"{options['broadcast_rate']:g}/s broadcasts to {len(notify_users)} sockets")
+        labels = {'notify': 'notifications', 'chat': 'chat (both ends)', 'broadcast': 'broadcast fan-out'}
+        for kind, label in labels.items():
+            # Chat frames reach both participants; every broadcast reaches every notification socket
+            expected = sum(recipients for _, recipients in sent[kind].values()) * (2 if kind == 'chat' else 1)
+            if not expected:
+                self.stdout.write(f"  {label:<17} no traffic")
+                continue
+            lost = max(expected - delivered[kind], 0)
+            self.stdout.write(f"  {label:<17} {percentiles(received[kind])}  "
+                              f"delivered {delivered[kind]}/{expected}  lost {lost} ({lost / expected:.1%})")
+
+        await asyncio.gather(*(client.close() for client in notify_clients + chat_clients))
+        from api.chat import get_buffer
+        await get_buffer().flush()
+        await database_sync_to_async(self.clear_traffic)()
+
+    def clear_traffic(self):
+        from api.models import Message, Notification
+        Notification.objects.filter(user__username__startswith=PREFIX).delete()
+        Message.objects.filter(sender__username__startswith=PREFIX).delete()
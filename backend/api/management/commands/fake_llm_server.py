@@ -0,0 +1,71 @@
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+
+CANNED_ANALYSIS = {
+    "is_relevant": True,
+    "key_observations": ["Water pooling under sink", "Corroded pipe joint", "Damp cabinet floor"],
+    "category_match": "Plumbing",
+    "suggested_title": "Leaking pipe under kitchen sink",
+    "suggested_description": "There is an active leak at a corroded joint under the kitchen sink.",
+    "estimated_budget_range": "$100 - $250",
+    "urgency": "High",
+    "confidence_score": 0.88,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for Gemini's generateContent endpoint. "
+        "Point the backend at it with GEMINI_API_BASE_URL=http://127.0.0.1:<port>"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8009)
+        parser.add_argument('--latency-ms', type=float, default=800)
+        parser.add_argument('--jitter-ms', type=float, default=400,
+                            help="Uniform extra latency, gives hedging a tail to cut")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of HTTP 500 replies")
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of HTTP 429 replies")
+        parser.add_argument('--bad-keys', default='', help="Comma separated keys that are always rate limited")
+
+    def handle(self, *args, **options):
+        bad_keys = {k for k in options['bad_keys'].split(',') if k}
+        stdout = self.stdout
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self.rfile.read(length)
+                key = self.headers.get('x-goog-api-key', '')
+                time.sleep((options['latency_ms'] + random.uniform(0, options['jitter_ms'])) / 1000)
+
+                roll = random.random()
+                if key in bad_keys or roll < options['rate_limit_rate']:
+                    self.reply(429, {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED'}}, {'Retry-After': '30'})
+                elif roll < options['rate_limit_rate'] + options['error_rate']:
+                    self.reply(500, {'error': {'code': 500, 'status': 'INTERNAL'}})
+                else:
+                    self.reply(200, {'candidates': [{'content': {'parts': [{'text': json.dumps(CANNED_ANALYSIS)}]}}]})
+
+            def reply(self, code, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, fmt, *args):
+                stdout.write(f"[fake-llm] {self.headers.get('x-goog-api-key', '')[-4:]} {fmt % args}")
+
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), Handler)
+        self.stdout.write(f"Fake generateContent server on http://127.0.0.1:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.uploads import reap_temp_files
+
+
+class Command(BaseCommand):
+    help = "Delete orphaned temp/analysis_* uploads older than AI_TEMP_FILE_TTL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=settings.AI_TEMP_FILE_TTL,
+                            help="Age in seconds after which unreferenced files expire")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        deleted = reap_temp_files(max_age=options['max_age'], dry_run=options['dry_run'])
+        for path in deleted:
+            self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {path}")
+        self.stdout.write(self.style.SUCCESS(f"{len(deleted)} orphaned temp files"))
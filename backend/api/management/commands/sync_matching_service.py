@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.matching import push_providers, sync_records
+from api.models import Provider
+from api.services import ServiceUnavailable
+
+
+class Command(BaseCommand):
+    help = ("Replace matching_service's stored providers with the current database state. "
+            "Run after deploys and periodically; signals push individual changes in between.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Providers read per query")
+        parser.add_argument('--deadline', type=float, default=120, help="Seconds to wait for matching_service")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        records, last_id = [], 0
+        while True:
+            # Keyset pagination keeps each aggregate query bounded
+            ids = list(Provider.objects.filter(id__gt=last_id).order_by('id')
+                       .values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            last_id = ids[-1]
+            records.extend(sync_records(Provider.objects.filter(id__in=ids)))
+        read_s = time.perf_counter() - start
+
+        # One replace call, so the service never serves a half-synced set
+        try:
+            result = push_providers(records, replace=True, deadline=options['deadline'])
+        except ServiceUnavailable as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Synced {result['count']} providers in {result['categories']} categories "
+            f"(read {read_s:.1f}s, total {time.perf_counter() - start:.1f}s)"
+        ))
@@ -0,0 +1,32 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api.classifier import train_from_history
+
+
+class Command(BaseCommand):
+    help = "Train the local request classifier (category + urgency) from historical requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="Model path (defaults to REQUEST_CLASSIFIER_PATH)")
+
+    def handle(self, *args, **options):
+        path = options['output'] or settings.REQUEST_CLASSIFIER_PATH
+        start = time.perf_counter()
+        model = train_from_history()
+        model.save(path)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stdout.write(
+            f"Trained on {model.category.documents} categorized and {model.urgency.documents} "
+            f"LLM-labelled requests in {elapsed:.0f} ms -> {path}"
+        )
+        if model.urgency.documents < settings.AI_CASCADE_MIN_SAMPLES:
+            self.stdout.write(self.style.WARNING(
+                f"Fewer than AI_CASCADE_MIN_SAMPLES={settings.AI_CASCADE_MIN_SAMPLES} urgency labels; "
+                "every request will still go to ai_service"
+            ))
+        elif len(model.urgency.class_docs) < 2:
+            self.stdout.write(self.style.WARNING(
+                f"Only one urgency label seen ({', '.join(model.urgency.class_docs)}); "
+                "every request will still go to ai_service"
+            ))
@@ -0,0 +1,246 @@
+"""
+Provider matching for a category and location.
+
+All callers (RequestViewSet.ai_match, ProviderViewSet.recommendations) go
+through match_providers(). Scores are utils.match_points, the same 0-100
+table matching_service uses, so both paths rank identically.
+
+MATCHING_BACKEND picks who does the scoring:
+- 'local': load the category's candidates in one aggregate query (profile
+  coordinates and completed-job counts joined in) and score in-process,
+- 'remote': ask matching_service, which ranks its own stored copy of the
+  providers (a memory-mapped snapshot), so nothing is shipped per request.
+  It falls back to the local scorer when the call fails, times out, finds
+  the circuit open or the service has no snapshot yet, so matching keeps
+  working without it,
+- 'auto': same as 'remote'. It used to pick remote only for categories with
+  at least MATCHING_REMOTE_MIN_PROVIDERS candidates, because the rows were
+  sent along; now that the service keeps its own copy there is nothing to
+  weigh, and that setting is no longer read.
+
+matching_service's copy is filled by `manage.py sync_matching_service` and
+kept current by the signals below, which push a provider whenever it, its
+profile, its categories or its completed jobs change. Pushes go through one
+worker thread per process, in order, and read the providers' rows when they
+are sent, so a later change is never overwritten by an earlier push. The
+service rejects pushes until the first full sync (409).
+"""
+import heapq
+import queue
+import threading
+from collections import namedtuple
+from math import atan2, cos, radians, sin, sqrt
+from django.conf import settings
+from django.db.models import Count, Q
+from . import metrics
+from .models import Provider
+from .services import ServiceUnavailable, matching_service
+from .utils import match_points
+
+EARTH_RADIUS_KM = 6371
+
+# One scored provider; distance_km is None when either side has no coordinates
+Match = namedtuple('Match', 'provider_id match_score distance_km')
+
+# Candidate row: (provider_id, rating, availability_status, latitude, longitude, completed_jobs)
+CANDIDATE_FIELDS = ('id', 'rating', 'availability_status', 'user__profile__latitude', 'user__profile__longitude', 'completed_count')
+
+
+def candidate_queryset(providers):
+    return (
+        providers.order_by()
+        .annotate(completed_count=Count('jobs', filter=Q(jobs__status='completed')))
+        .values_list(*CANDIDATE_FIELDS)
+    )
+
+
+def candidate_rows(category_id, availability=None):
+    """Every provider in the category with the columns the scorer needs, in one query"""
+    providers = Provider.objects.filter(categories=category_id)
+    if availability:
+        providers = providers.filter(availability_status=availability)
+    return list(candidate_queryset(providers))
+
+
+def score_rows(rows, latitude, longitude, limit=10):
+    """
+    Top `limit` candidate rows scored locally, best first (ties by provider id).
+    Distances are utils.calculate_distance with the request side hoisted out.
+    """
+    known = bool(latitude and longitude)
+    if known:
+        lat1, lon1 = radians(float(latitude)), radians(float(longitude))
+        cos_lat1 = cos(lat1)
+    scored = []
+    for provider_id, rating, availability_status, prov_lat, prov_lon, completed in rows:
+        distance = None
+        if known and prov_lat and prov_lon:
+            lat2 = radians(float(prov_lat))
+            a = sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos(lat2) * sin((radians(float(prov_lon)) - lon1) / 2) ** 2
+            distance = round(EARTH_RADIUS_KM * 2 * atan2(sqrt(a), sqrt(1 - a)), 2)
+        scored.append(Match(provider_id, match_points(distance, rating, availability_status, completed), distance))
+    return heapq.nsmallest(limit, scored, key=lambda m: (-m.match_score, m.provider_id))
+
+
+def score_remote(category_id, latitude, longitude, availability=None, limit=10):
+    """
+    (top `limit` matches, candidate count) from matching_service's stored
+    providers. Raises ServiceUnavailable on any failure.
+    """
+    response = matching_service().post('/match/nearby', settings.MATCHING_DEADLINE, json={
+        'category': str(category_id),
+        'latitude': float(latitude) if latitude else None,
+        'longitude': float(longitude) if longitude else None,
+        'availability': availability,
+        'limit': limit,
+    })
+    if response.status_code != 200:
+        raise ServiceUnavailable(f"matching_service returned {response.status_code}")
+    body = response.json()
+    return [Match(m['provider_id'], m['match_score'], m.get('distance')) for m in body['matches']], body['total']
+
+
+def match_providers(category_id, latitude=None, longitude=None, availability=None, limit=10):
+    """
+    Rank providers in a category for a location.
+    Returns (top `limit` Match tuples, number of candidates in the category).
+    """
+    metrics.incr('matching.requests')
+    if settings.MATCHING_BACKEND in ('remote', 'auto'):
+        try:
+            result = score_remote(category_id, latitude, longitude, availability, limit)
+            metrics.incr('matching.remote')
+            return result
+        except (ServiceUnavailable, ValueError, KeyError) as e:
+            metrics.incr('matching.remote_failures')
+            print(f"matching_service unavailable, scoring locally: {e}")
+
+    metrics.incr('matching.local')
+    rows = candidate_rows(category_id, availability)
+    return score_rows(rows, latitude, longitude, limit), len(rows)
+
+
+def providers_for(matches):
+    """Provider instances (with user loaded) for matches, keyed by id"""
+    return Provider.objects.select_related('user').in_bulk([m.provider_id for m in matches])
+
+
+def sync_records(providers):
+    """matching_service provider records for a Provider queryset (two queries)"""
+    rows = list(candidate_queryset(providers))
+    categories = {}
+    for provider_id, category_id in Provider.categories.through.objects.filter(
+            provider_id__in=[row[0] for row in rows]).values_list('provider_id', 'category_id'):
+        categories.setdefault(provider_id, []).append(str(category_id))
+    return [
+        {
+            'provider_id': provider_id,
+            'latitude': float(prov_lat) if prov_lat else None,
+            'longitude': float(prov_lon) if prov_lon else None,
+            'rating': float(rating or 0),
+            'completed_jobs': completed,
+            'availability_status': availability_status,
+            'categories': categories.get(provider_id, []),
+        }
+        for provider_id, rating, availability_status, prov_lat, prov_lon, completed in rows
+    ]
+
+
+def push_providers(records, removed=(), replace=False, deadline=None):
+    """Send provider records to matching_service's stored set"""
+    response = matching_service().post('/providers/sync', deadline or settings.MATCHING_DEADLINE, json={
+        'providers': records, 'removed': list(removed), 'replace': replace,
+    })
+    if response.status_code != 200:
+        raise ServiceUnavailable(f"matching_service sync returned {response.status_code}")
+    return response.json()
+
+
+_push_queue = queue.Queue()
+_push_worker = None
+_push_worker_lock = threading.Lock()
+
+
+def _push_pending():
+    """Worker loop: push queued changes one batch at a time, with fresh rows"""
+    from django.db import close_old_connections
+    while True:
+        provider_ids, removed_ids = _push_queue.get()
+        provider_ids, removed_ids = set(provider_ids), set(removed_ids)
+        while True:
+            # Coalesce whatever queued up meanwhile into this push
+            try:
+                more_ids, more_removed = _push_queue.get_nowait()
+            except queue.Empty:
+                break
+            provider_ids.update(more_ids)
+            removed_ids.update(more_removed)
+        provider_ids -= removed_ids
+        try:
+            records = sync_records(Provider.objects.filter(id__in=provider_ids)) if provider_ids else []
+            push_providers(records, removed_ids)
+            metrics.incr('matching.synced_providers', len(records) + len(removed_ids))
+        except Exception as e:
+            # The next sync_matching_service run catches these providers up
+            metrics.incr('matching.sync_failures')
+            print(f"matching_service sync failed: {e}")
+        finally:
+            close_old_connections()
+
+
+def _push_in_background(provider_ids, removed_ids):
+    global _push_worker
+    if _push_worker is None:
+        with _push_worker_lock:
+            if _push_worker is None:
+                _push_worker = threading.Thread(target=_push_pending, name='matching-push', daemon=True)
+                _push_worker.start()
+    _push_queue.put((provider_ids, removed_ids))
+
+
+def _schedule_push(provider_ids=(), removed_ids=()):
+    if settings.MATCHING_BACKEND == 'local':
+        return
+    from django.db import transaction
+    transaction.on_commit(lambda: _push_in_background(list(provider_ids), list(removed_ids)))
+
+
+def _provider_saved(sender, instance, **kwargs):
+    _schedule_push(provider_ids=[instance.id])
+
+
+def _provider_deleted(sender, instance, **kwargs):
+    _schedule_push(removed_ids=[instance.id])
+
+
+def _categories_changed(sender, instance, action, pk_set=None, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # Changed from either side: provider.categories or category.providers
+    provider_ids = [instance.id] if isinstance(instance, Provider) else (pk_set or ())
+    if provider_ids:
+        _schedule_push(provider_ids=provider_ids)
+
+
+def _profile_saved(sender, instance, **kwargs):
+    provider_ids = list(Provider.objects.filter(user_id=instance.user_id).values_list('id', flat=True))
+    if provider_ids:
+        _schedule_push(provider_ids=provider_ids)
+
+
+def _job_saved(sender, instance, **kwargs):
+    if instance.status == 'completed':
+        _schedule_push(provider_ids=[instance.provider_id])
+
+
+def connect_signals():
+    from django.db.models.signals import m2m_changed, post_delete, post_save
+    from .models import Job, Profile
+    post_save.connect(_provider_saved, sender=Provider, dispatch_uid='matching_provider')
+    post_delete.connect(_provider_deleted, sender=Provider, dispatch_uid='matching_provider_delete')
+    m2m_changed.connect(_categories_changed, sender=Provider.categories.through, dispatch_uid='matching_categories')
+    post_save.connect(_profile_saved, sender=Profile, dispatch_uid='matching_profile')
+    post_save.connect(_job_saved, sender=Job, dispatch_uid='matching_job')
+
+
+metrics.register_gauge('matching.push_queue', _push_queue.qsize)
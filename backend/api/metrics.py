@@ -0,0 +1,45 @@
+"""
+In-process counters and gauges for operational metrics.
+
+Counters are plain integers guarded by a lock; gauges are callables that are
+evaluated when a snapshot is taken. Values are per worker process.
+"""
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def get(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def register_gauge(name, fn):
+    """Register a zero-argument callable evaluated at snapshot time"""
+    with _lock:
+        _gauges[name] = fn
+
+
+def ratio(numerator, denominator):
+    total = get(denominator)
+    return round(get(numerator) / total, 4) if total else None
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    values = {}
+    for name, fn in gauges.items():
+        try:
+            values[name] = fn()
+        except Exception as e:
+            values[name] = {'error': str(e)}
+    return {'counters': counters, 'gauges': values}
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_invoice_stripe_checkout_session_id_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageAnalysis",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "phash",
+                    models.BigIntegerField(
+                        db_index=True,
+                        help_text="64-bit dHash stored as a signed integer",
+                    ),
+                ),
+                (
+                    "file_path",
+                    models.CharField(
+                        help_text="Path of the analyzed image in default storage",
+                        max_length=255,
+                    ),
+                ),
+                ("analysis", models.JSONField(default=dict)),
+                ("hits", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("last_used_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "image_analyses",
+            },
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_unread(apps, schema_editor):
+    """Counters and latest message for every (participant, job) pair with messages"""
+    Message = apps.get_model("api", "Message")
+    ChatUnread = apps.get_model("api", "ChatUnread")
+    unread = {
+        (user_id, job_id): count
+        for user_id, job_id, count in Message.objects.filter(is_read=False, receiver__isnull=False)
+        .values_list("receiver_id", "job_id").annotate(count=Count("id")).values_list("receiver_id", "job_id", "count")
+    }
+    latest = {}
+    for job_id, message_id, created_at in (Message.objects.order_by("job_id", "created_at", "id")
+                                           .values_list("job_id", "id", "created_at").iterator()):
+        latest[job_id] = (message_id, created_at)
+    pairs = set(Message.objects.values_list("sender_id", "job_id").distinct())
+    pairs |= set(Message.objects.filter(receiver__isnull=False).values_list("receiver_id", "job_id").distinct())
+    ChatUnread.objects.bulk_create(
+        [
+            ChatUnread(user_id=user_id, job_id=job_id, count=unread.get((user_id, job_id), 0),
+                       last_message_id=latest[job_id][0], last_message_at=latest[job_id][1])
+            for user_id, job_id in pairs
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_imageanalysis"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatUnread",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("last_message_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "db_table": "chat_unreads",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["job", "created_at"], name="messages_job_created_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatunread",
+            name="job",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chat_unreads",
+                to="api.job",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatunread",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="api.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatunread",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chat_unreads",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="chatunread",
+            unique_together={("user", "job")},
+        ),
+        migrations.RunPython(backfill_unread, migrations.RunPython.noop),
+    ]
@@ -284,6 +284,61 @@ class Message(models.Model):
     class Meta:
         db_table = 'messages'
         ordering = ['created_at']
+        indexes = [
+            # Chat history pages backwards through one job's messages
+            models.Index(fields=['job', 'created_at'], name='messages_job_created_idx'),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender.username} in Job #{self.job.id}"
+
+class ChatUnread(models.Model):
+    """Per-(user, job) unread count and latest message, kept up to date as messages are stored"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_unreads')
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='chat_unreads')
+    count = models.PositiveIntegerField(default=0)
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'chat_unreads'
+        unique_together = ['user', 'job']
+
+    def __str__(self):
+        return f"{self.user.username}: {self.count} unread in Job #{self.job_id}"
+
+class Notification(models.Model):
+    """
+    A user's real-time notification, numbered per user (seq 1, 2, 3...) so a
+    reconnecting client can ask for everything after the last seq it saw.
+    Only the newest NOTIFICATION_RETENTION per user are kept.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    seq = models.PositiveBigIntegerField()
+    type = models.CharField(max_length=50, default='info')
+    message = models.TextField()
+    payload = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'notifications'
+        unique_together = ['user', 'seq']
+        ordering = ['seq']
+
+    def __str__(self):
+        return f"Notification #{self.seq} for {self.user.username}: {self.type}"
+
+class ImageAnalysis(models.Model):
+    """Stored vision analysis keyed by perceptual hash, reused for near-duplicate uploads"""
+    phash = models.BigIntegerField(db_index=True, help_text="64-bit dHash stored as a signed integer")
+    file_path = models.CharField(max_length=255, help_text="Path of the analyzed image in default storage")
+    analysis = models.JSONField(default=dict)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'image_analyses'
+
+    def __str__(self):
+        return f"ImageAnalysis #{self.id} ({self.file_path})"
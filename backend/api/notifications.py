@@ -1,24 +1,203 @@
+import asyncio
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import transaction
+from . import metrics
 
-def send_notification(user_id, message, type='info', payload=None):
+def record_notification(user_id, message, type='info', payload=None):
     """
-    Send a real-time notification to a specific user.
+    Store a notification as the next entry in the user's sequence.
+
+    The user's row is locked while the next seq is taken, so each user's
+    sequence has no duplicates and commits in order: a client that has seen
+    seq N never misses a notification that was still being written with a
+    lower seq. Every NOTIFICATION_TRIM_EVERY inserts, entries older than the
+    newest NOTIFICATION_RETENTION are deleted, so each user's history works
+    like a ring buffer.
     """
-    channel_layer = get_channel_layer()
-    group_name = f"user_{user_id}"
-
-    event = {
-        'type': 'notify',  # This matches the method name in the consumer
-        'content': {
-            'message': message,
-            'type': type,
-            'payload': payload or {}
-        }
+    from .models import Notification, User
+    with transaction.atomic():
+        list(User.objects.select_for_update().filter(id=user_id).values_list('id', flat=True))
+        last_seq = Notification.objects.filter(user_id=user_id).order_by('-seq').values_list('seq', flat=True).first()
+        notification = Notification.objects.create(
+            user_id=user_id, seq=(last_seq or 0) + 1, type=type, message=message, payload=payload or {}
+        )
+        if notification.seq % settings.NOTIFICATION_TRIM_EVERY == 0:
+            Notification.objects.filter(
+                user_id=user_id, seq__lte=notification.seq - settings.NOTIFICATION_RETENTION
+            ).delete()
+    return notification
+
+def notification_content(notification):
+    """Frame sent over the notifications socket, live or replayed"""
+    return {
+        'message': notification.message,
+        'type': notification.type,
+        'payload': notification.payload,
+        'seq': notification.seq,
+        'created_at': notification.created_at.isoformat(),
     }
 
-    print(f"DEBUG: Sending WS notification to {group_name}: {message}")
-    async_to_sync(channel_layer.group_send)(group_name, event)
+def stored_content(user_id, message, type, payload):
+    try:
+        return notification_content(record_notification(user_id, message, type, payload))
+    except Exception as e:
+        # Still deliver live; it just can't be replayed
+        print(f"Error storing notification for user {user_id}: {e}")
+        return {'message': message, 'type': type, 'payload': payload or {}}
+
+def supersede_key(content):
+    """Events with the same key replace each other: only the latest status of a job/request matters"""
+    payload = content.get('payload') or {}
+    if 'status' not in payload:
+        return None
+    for field in ('job_id', 'request_id'):
+        if field in payload:
+            return (content.get('type'), field, payload[field])
+    return None
+
+class NotificationBus:
+    """
+    Coalesces each user's notifications into one websocket frame per
+    NOTIFICATION_COALESCE_MS window (or NOTIFICATION_MAX_BATCH events), and
+    drops status updates that a newer one in the same window supersedes.
+
+    The bus runs on the ASGI server's event loop, captured by
+    NotificationBusMiddleware. Sync callers (views running in worker
+    threads) hand events over with call_soon_threadsafe, and async callers
+    use apublish directly, so no send needs an async_to_sync event-loop
+    bridge. Without a captured loop (management commands, shells, tests)
+    each publish is sent immediately through async_to_sync, as before.
+    Superseded events are still stored, so replay after a reconnect shows
+    the full history.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.pending = {}  # user_id -> [content, ...]
+        self.timers = {}
+        self.tasks = set()
+
+    def capture_loop(self, loop):
+        self.loop = loop
+
+    def loop_available(self):
+        return self.loop is not None and self.loop.is_running() and not self.loop.is_closed()
+
+    def publish(self, user_id, content):
+        """Queue a notification from any thread"""
+        if not self.loop_available():
+            async_to_sync(self.send)(user_id, [content])
+            return
+        try:
+            on_bus_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_bus_loop = False
+        if on_bus_loop:
+            self.enqueue(user_id, content)
+        else:
+            self.loop.call_soon_threadsafe(self.enqueue, user_id, content)
+
+    async def apublish(self, user_id, content):
+        """Queue a notification from a coroutine"""
+        if self.loop_available() and asyncio.get_running_loop() is self.loop:
+            self.enqueue(user_id, content)
+        elif self.loop_available():
+            self.loop.call_soon_threadsafe(self.enqueue, user_id, content)
+        else:
+            await self.send(user_id, [content])
+
+    def enqueue(self, user_id, content):
+        """Runs on the bus loop"""
+        events = self.pending.setdefault(user_id, [])
+        key = supersede_key(content)
+        if key is not None:
+            kept = [event for event in events if supersede_key(event) != key]
+            metrics.incr('notifications.superseded', len(events) - len(kept))
+            events[:] = kept
+        events.append(content)
+        metrics.incr('notifications.published')
+        if len(events) >= settings.NOTIFICATION_MAX_BATCH:
+            timer = self.timers.pop(user_id, None)
+            if timer:
+                timer.cancel()
+            self.start_flush(user_id)
+        elif user_id not in self.timers:
+            self.timers[user_id] = self.loop.call_later(
+                settings.NOTIFICATION_COALESCE_MS / 1000, self.start_flush, user_id
+            )
+
+    def start_flush(self, user_id):
+        self.timers.pop(user_id, None)
+        events = self.pending.pop(user_id, None)
+        if events:
+            task = self.loop.create_task(self.send(user_id, events))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, user_id, events):
+        event = {'type': 'notify', 'content': events[0]} if len(events) == 1 else \
+            {'type': 'notify_batch', 'events': events}
+        metrics.incr('notifications.frames')
+        try:
+            await get_channel_layer().group_send(f"user_{user_id}", event)
+        except Exception as e:
+            print(f"Error sending notifications to user {user_id}: {e}")
+
+    def send_groups(self, groups, event):
+        """Send one event to channel groups from any thread, without coalescing"""
+        if not self.loop_available():
+            async_to_sync(send_groups)(groups, event)
+            return
+        self.loop.call_soon_threadsafe(self.start_send_groups, groups, event)
+
+    def start_send_groups(self, groups, event):
+        task = self.loop.create_task(send_groups(groups, event))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+async def send_groups(groups, event):
+    layer = get_channel_layer()
+    for group in groups:
+        try:
+            await layer.group_send(group, event)
+        except Exception as e:
+            print(f"Error sending to group {group}: {e}")
+
+bus = NotificationBus()
+
+class NotificationBusMiddleware:
+    """ASGI middleware that gives the bus the server's event loop"""
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        if bus.loop is None:
+            bus.capture_loop(asyncio.get_running_loop())
+        return await self.inner(scope, receive, send)
+
+def send_notification(user_id, message, type='info', payload=None):
+    """
+    Store and send a real-time notification to a specific user.
+    Stored notifications are replayed to clients that reconnect (see NotificationConsumer);
+    delivery is coalesced per user by the bus.
+    """
+    bus.publish(user_id, stored_content(user_id, message, type, payload))
+
+def send_event(group, event):
+    """Send a control event (not a stored notification) to a channel group"""
+    bus.send_groups([group], event)
+
+def broadcast(groups, content):
+    """Send one live notification frame to every socket in `groups`"""
+    bus.send_groups(groups, {'type': 'notify', 'content': content})
+
+async def asend_notification(user_id, message, type='info', payload=None):
+    """send_notification for async callers"""
+    from channels.db import database_sync_to_async
+    content = await database_sync_to_async(stored_content)(user_id, message, type, payload)
+    await bus.apublish(user_id, content)
 
 def notify_request_update(request_obj, message):
     # Notify the request owner
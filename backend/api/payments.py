@@ -9,11 +9,7 @@ def get_stripe_client():
     stripe.api_key = settings.stripe_secret_key
     return stripe
 
-def create_checkout_session(invoice_id, success_url, cancel_url):
-    stripe_client = get_stripe_client()
-    invoice = Invoice.objects.get(id=invoice_id)
-    settings = SystemSettings.get_settings()
-    
+def checkout_params(invoice, settings, success_url, cancel_url):
     currency = settings.currency_symbol.lower().replace('$', 'usd') # Fallback if not set correctly
     if currency not in ['usd', 'eur', 'pkr', 'gbp']:
         currency = 'usd'
@@ -30,7 +26,7 @@ def create_checkout_session(invoice_id, success_url, cancel_url):
         'quantity': 1,
     }]
     
-    session = stripe_client.checkout.Session.create(
+    return dict(
         payment_method_types=['card'],
         line_items=line_items,
         mode='payment',
@@ -41,12 +37,37 @@ def create_checkout_session(invoice_id, success_url, cancel_url):
             'job_id': invoice.job.id
         }
     )
+
+def create_checkout_session(invoice_id, success_url, cancel_url):
+    stripe_client = get_stripe_client()
+    invoice = Invoice.objects.select_related('job__request').get(id=invoice_id)
+    settings = SystemSettings.get_settings()
+    
+    session = stripe_client.checkout.Session.create(**checkout_params(invoice, settings, success_url, cancel_url))
     
     invoice.stripe_checkout_session_id = session.id
     invoice.save()
     
     return session
 
+async def acreate_checkout_session(invoice_id, success_url, cancel_url):
+    """create_checkout_session for async views: the Stripe call holds no thread (stripe's async httpx client)"""
+    from asgiref.sync import sync_to_async
+
+    def load():
+        return (get_stripe_client(), Invoice.objects.select_related('job__request').get(id=invoice_id),
+                SystemSettings.get_settings())
+
+    stripe_client, invoice, settings = await sync_to_async(load)()
+    session = await stripe_client.checkout.Session.create_async(
+        **checkout_params(invoice, settings, success_url, cancel_url)
+    )
+
+    invoice.stripe_checkout_session_id = session.id
+    await sync_to_async(invoice.save)(update_fields=['stripe_checkout_session_id'])
+
+    return session
+
 def process_webhook_event(payload, sig_header):
     settings = SystemSettings.get_settings()
     stripe_client = get_stripe_client()
@@ -0,0 +1,89 @@
+"""
+Ephemeral presence and typing state for chat rooms.
+
+Nothing here touches the database. State lives in the Django cache (Redis
+when REDIS_URL is set, so every daphne node sees it; per-process LocMem
+otherwise), always with a TTL, so a crashed node's entries simply expire:
+- presence:<job>:<user> maps each of the user's open chat connections for the
+  job to an expiry time. ChatConsumer refreshes it on every heartbeat, so it
+  lives PRESENCE_TTL seconds past the last sign of life. A user is online
+  while any entry is unexpired (several tabs are several entries).
+- typing:<job>:<user> is set for TYPING_TTL seconds while the user types, so
+  a counterpart who joins mid-sentence sees it too.
+
+Changes are sent to the job's chat group as `presence` frames
+({user_id, online} or {user_id, typing}), next to chat_message frames but
+never stored. Typing starts are throttled per connection to one every
+TYPING_THROTTLE seconds; a client that keeps sending them gets the rest
+dropped (presence.throttled metric). Stops always go through.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from . import metrics
+
+
+def presence_key(job_id, user_id):
+    return f"presence:{job_id}:{user_id}"
+
+
+def typing_key(job_id, user_id):
+    return f"typing:{job_id}:{user_id}"
+
+
+async def touch(job_id, user_id, connection):
+    """Mark one connection as alive; True if the user just came online"""
+    key = presence_key(job_id, user_id)
+    now = time.time()
+    entries = {c: expires for c, expires in (await cache.aget(key) or {}).items() if expires > now}
+    came_online = not entries
+    entries[connection] = now + settings.PRESENCE_TTL
+    await cache.aset(key, entries, settings.PRESENCE_TTL)
+    return came_online
+
+
+async def leave(job_id, user_id, connection):
+    """Drop one connection; True if that was the user's last one"""
+    key = presence_key(job_id, user_id)
+    now = time.time()
+    entries = {c: expires for c, expires in (await cache.aget(key) or {}).items()
+               if expires > now and c != connection}
+    if entries:
+        await cache.aset(key, entries, settings.PRESENCE_TTL)
+    else:
+        await cache.adelete(key)
+    await cache.adelete(typing_key(job_id, user_id))
+    return not entries
+
+
+async def is_online(job_id, user_id):
+    now = time.time()
+    return any(expires > now for expires in (await cache.aget(presence_key(job_id, user_id)) or {}).values())
+
+
+async def is_typing(job_id, user_id):
+    return bool(await cache.aget(typing_key(job_id, user_id)))
+
+
+class TypingThrottle:
+    """Per-connection gate for typing events"""
+
+    def __init__(self):
+        self.typing = False
+        self.last_start = 0.0
+
+    async def update(self, job_id, user_id, typing):
+        """True when the change should be broadcast"""
+        now = time.monotonic()
+        if typing:
+            if self.typing and now - self.last_start < settings.TYPING_THROTTLE:
+                metrics.incr('presence.throttled')
+                return False
+            self.typing, self.last_start = True, now
+            await cache.aset(typing_key(job_id, user_id), True, settings.TYPING_TTL)
+            return True
+        if not self.typing:
+            return False
+        self.typing = False
+        await cache.adelete(typing_key(job_id, user_id))
+        return True
@@ -0,0 +1,291 @@
+"""
+Historical price and duration estimates per (category, geo cell).
+
+Samples come from real money: Invoice.total for finished jobs and
+Bid.amount / Bid.estimated_duration for quotes. They are kept as sorted lists
+per key, so a quantile is an index lookup and an estimate is answered
+in-process without an LLM round trip. Each estimate falls back from the
+request's geo cell to its category and then to all categories when a level
+has fewer than PRICE_INDEX_MIN_SAMPLES samples.
+
+The index loads incrementally: only rows above the last seen id are fetched.
+Creating an Invoice or Bid schedules a refresh in this process; other workers
+pick new rows up after PRICE_INDEX_REFRESH_SECONDS. A row that changes after
+it was loaded (an accepted or withdrawn bid, a corrected invoice total) is
+re-read on commit and its old sample swapped for the new one in its buckets,
+so saves never trigger a full reload. Deleting a row makes this process
+rebuild from scratch on its next refresh, and every process rebuilds every
+PRICE_INDEX_REBUILD_SECONDS, so other workers drop stale samples too.
+"""
+import bisect
+import re
+import threading
+import time
+from django.conf import settings
+from .utils import geo_cell
+
+QUANTILES = (0.25, 0.5, 0.75)
+
+# Columns a sample is built from, after the id
+INVOICE_COLUMNS = ('total', 'job__request__category_id', 'job__request__latitude', 'job__request__longitude')
+BID_COLUMNS = ('amount', 'estimated_duration', 'status', 'request__category_id',
+               'request__latitude', 'request__longitude')
+
+HOURS_PER_UNIT = {
+    'min': 1 / 60, 'minute': 1 / 60, 'minutes': 1 / 60, 'mins': 1 / 60,
+    'h': 1, 'hr': 1, 'hrs': 1, 'hour': 1, 'hours': 1,
+    'day': 8, 'days': 8,  # working days
+    'week': 40, 'weeks': 40,
+}
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(?:-|to)?\s*(\d+(?:\.\d+)?)?\s*([a-z]+)')
+
+
+def parse_duration_hours(text):
+    """'2 hours' -> 2.0, '3-5 days' -> 32.0 (midpoint); None if unparseable"""
+    match = DURATION_RE.search((text or '').lower())
+    if not match:
+        return None
+    low, high, unit = match.groups()
+    factor = HOURS_PER_UNIT.get(unit)
+    if factor is None:
+        return None
+    value = (float(low) + float(high)) / 2 if high else float(low)
+    return value * factor if value > 0 else None
+
+
+def format_hours(low, high):
+    """Render an hour range the way providers write durations"""
+    if high < 8:
+        low_hours, high_hours = max(1, round(low)), max(1, round(high))
+        return f"{low_hours}-{high_hours} hours" if low_hours != high_hours else f"{low_hours} hours"
+    low_days, high_days = max(1, round(low / 8)), max(1, round(high / 8))
+    return f"{low_days}-{high_days} days" if low_days != high_days else f"{low_days} days"
+
+
+def invoice_sample(total, category_id, latitude, longitude):
+    return category_id, geo_cell(latitude, longitude), total, None
+
+
+def bid_sample(amount, duration, status, category_id, latitude, longitude):
+    """None for withdrawn bids, which are not prices anyone agreed to"""
+    if status == 'withdrawn':
+        return None
+    return category_id, geo_cell(latitude, longitude), amount, parse_duration_hours(duration)
+
+
+def quantile(values, q):
+    """Linear interpolation quantile of an already sorted list"""
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class PriceIndex:
+    """Sorted price and duration samples per (category_id, cell)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prices = {}
+        self.hours = {}
+        self.invoice_watermark = 0
+        self.bid_watermark = 0
+        self.samples = {}  # ('invoice' | 'bid', id) -> the row's sample, to swap it out when the row changes
+        self.next_refresh = 0.0
+        self.next_rebuild = 0.0
+
+    @staticmethod
+    def keys(category_id, cell):
+        keys = [(None, None)]
+        if category_id is not None:
+            keys.append((category_id, None))
+            if cell is not None:
+                keys.append((category_id, cell))
+        return keys
+
+    def merge(self, samples, prices=None, hours=None, removed=()):
+        """
+        Merge (category_id, cell, price, hours) samples into the given tables
+        (the live ones by default) and take `removed` samples out. Touched
+        lists are replaced by new sorted lists, so concurrent readers never
+        see a partially updated one.
+        """
+        prices = self.prices if prices is None else prices
+        hours = self.hours if hours is None else hours
+        added, dropped = ({}, {}), ({}, {})  # (price lists, hour lists) per key
+        for batch, target in ((samples, added), (removed, dropped)):
+            for category_id, cell, price, sample_hours in batch:
+                for key in self.keys(category_id, cell):
+                    if price is not None and price > 0:
+                        target[0].setdefault(key, []).append(float(price))
+                    if sample_hours is not None:
+                        target[1].setdefault(key, []).append(float(sample_hours))
+        for table, additions, removals in ((prices, added[0], dropped[0]), (hours, added[1], dropped[1])):
+            for key in additions.keys() | removals.keys():
+                values = list(table.get(key, []))
+                for value in removals.get(key, ()):
+                    position = bisect.bisect_left(values, value)
+                    if position < len(values) and values[position] == value:
+                        del values[position]
+                new_values = additions.get(key, [])
+                if len(new_values) > 16:
+                    values = sorted(values + new_values)  # Bulk load
+                else:
+                    for value in new_values:
+                        bisect.insort(values, value)
+                table[key] = values
+
+    def invalidate(self):
+        self.next_refresh = 0.0
+
+    def invalidate_all(self):
+        """Rows were deleted: rebuild on the next refresh"""
+        self.next_rebuild = self.next_refresh = 0.0
+
+    def refresh(self, force=False):
+        """Load invoices and bids created since the last refresh, or all of them when a rebuild is due"""
+        if not force and time.monotonic() < self.next_refresh:
+            return
+        from .models import Invoice, Bid
+        with self.lock:
+            if not force and time.monotonic() < self.next_refresh:
+                return
+            now = time.monotonic()
+            if now >= self.next_rebuild:
+                # Fresh tables, swapped in when complete; readers keep the old ones until then
+                prices, hours, samples, invoice_watermark, bid_watermark = {}, {}, {}, 0, 0
+                self.next_rebuild = now + settings.PRICE_INDEX_REBUILD_SECONDS
+            else:
+                prices, hours, samples = self.prices, self.hours, self.samples
+                invoice_watermark, bid_watermark = self.invoice_watermark, self.bid_watermark
+
+            loaded = {}
+            invoices = list(
+                Invoice.objects.filter(id__gt=invoice_watermark)
+                .order_by('id')
+                .values_list('id', *INVOICE_COLUMNS)
+            )
+            for row_id, *columns in invoices:
+                loaded[('invoice', row_id)] = invoice_sample(*columns)
+            if invoices:
+                invoice_watermark = invoices[-1][0]
+
+            bids = list(
+                Bid.objects.filter(id__gt=bid_watermark)
+                .order_by('id')
+                .values_list('id', *BID_COLUMNS)
+            )
+            for row_id, *columns in bids:
+                sample = bid_sample(*columns)
+                if sample is not None:
+                    loaded[('bid', row_id)] = sample
+            if bids:
+                bid_watermark = bids[-1][0]
+
+            self.merge(loaded.values(), prices, hours)
+            samples.update(loaded)
+            self.prices, self.hours, self.samples = prices, hours, samples
+            self.invoice_watermark, self.bid_watermark = invoice_watermark, bid_watermark
+            self.next_refresh = time.monotonic() + settings.PRICE_INDEX_REFRESH_SECONDS
+
+    def apply(self, kind, row_id):
+        """Swap an already loaded row's sample for its current one ('invoice' or 'bid')"""
+        from .models import Invoice, Bid
+        if kind == 'invoice':
+            row = Invoice.objects.filter(id=row_id).values_list(*INVOICE_COLUMNS).first()
+            sample = invoice_sample(*row) if row else None
+        else:
+            row = Bid.objects.filter(id=row_id).values_list(*BID_COLUMNS).first()
+            sample = bid_sample(*row) if row else None
+        with self.lock:
+            if row_id > (self.invoice_watermark if kind == 'invoice' else self.bid_watermark):
+                return  # Not loaded yet; the next refresh reads the saved row
+            old = self.samples.pop((kind, row_id), None)
+            if sample is not None:
+                self.samples[(kind, row_id)] = sample
+            self.merge([sample] if sample else [], removed=[old] if old else [])
+
+    def lookup(self, table, category_id, cell):
+        """Most specific sample list with enough samples, and its scope name"""
+        minimum = settings.PRICE_INDEX_MIN_SAMPLES
+        for key, scope in reversed(list(zip(self.keys(category_id, cell), ('global', 'category', 'cell')))):
+            values = table.get(key)
+            if values and len(values) >= minimum:
+                return values, scope
+        return None, None
+
+    def summarize(self, table, category_id, cell):
+        values, scope = self.lookup(table, category_id, cell)
+        if values is None:
+            return None
+        low, median, high = (quantile(values, q) for q in QUANTILES)
+        return {'low': low, 'median': median, 'high': high, 'samples': len(values), 'scope': scope}
+
+    def estimate(self, category_id, latitude=None, longitude=None):
+        """
+        {'budget': {...} | None, 'duration': {...} | None} with interquartile
+        ranges. Reads take no lock (see merge).
+        """
+        self.refresh()
+        cell = geo_cell(latitude, longitude)
+        return {
+            'budget': self.summarize(self.prices, category_id, cell),
+            'duration': self.summarize(self.hours, category_id, cell),
+        }
+
+
+price_index = PriceIndex()
+
+
+def budget_range(category_id, latitude=None, longitude=None):
+    """'$120 - $260' from historical prices, or None without enough data"""
+    try:
+        budget = price_index.estimate(category_id, latitude, longitude)['budget']
+    except Exception as e:
+        print(f"Price estimate failed: {e}")
+        return None
+    if budget is None:
+        return None
+    return f"${budget['low']:,.0f} - ${budget['high']:,.0f}"
+
+
+def duration_range(category_id, latitude=None, longitude=None):
+    """'2-4 hours' from historical bids, or None without enough data"""
+    try:
+        duration = price_index.estimate(category_id, latitude, longitude)['duration']
+    except Exception as e:
+        print(f"Duration estimate failed: {e}")
+        return None
+    if duration is None:
+        return None
+    return format_hours(duration['low'], duration['high'])
+
+
+# Fields a sample is built from; saves touching only other fields leave the index as is
+SAMPLE_FIELDS = {
+    'Invoice': {'total', 'job'},
+    'Bid': {'amount', 'estimated_duration', 'status', 'request'},
+}
+
+
+def _schedule_refresh(sender, instance, created, update_fields=None, **kwargs):
+    from django.db import transaction
+    if created:
+        transaction.on_commit(price_index.invalidate)
+    elif update_fields is None or SAMPLE_FIELDS[sender.__name__] & set(update_fields):
+        kind, row_id = sender.__name__.lower(), instance.id
+        transaction.on_commit(lambda: price_index.apply(kind, row_id))
+
+
+def _schedule_rebuild(sender, instance, **kwargs):
+    from django.db import transaction
+    transaction.on_commit(price_index.invalidate_all)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+    from .models import Invoice, Bid
+    post_save.connect(_schedule_refresh, sender=Invoice, dispatch_uid='pricing_invoice')
+    post_save.connect(_schedule_refresh, sender=Bid, dispatch_uid='pricing_bid')
+    post_delete.connect(_schedule_rebuild, sender=Invoice, dispatch_uid='pricing_invoice_delete')
+    post_delete.connect(_schedule_rebuild, sender=Bid, dispatch_uid='pricing_bid_delete')
@@ -0,0 +1,216 @@
+"""
+Shared HTTP clients for the internal services (ai_service, matching_service).
+
+Each service gets one requests.Session with a pooled keep-alive adapter, so
+calls reuse TCP connections instead of reconnecting per request. Every call
+has a short connect timeout and a per-call read deadline. A circuit breaker
+per service opens after SERVICE_CIRCUIT_FAILURES consecutive failures; while
+open, calls fail immediately with ServiceUnavailable instead of each burning
+its full timeout, and after SERVICE_CIRCUIT_RESET_SECONDS a single probe call
+decides whether to close it again.
+
+Async views and background tasks use arequest()/apost(): the same breaker
+and metrics over an httpx.AsyncClient, one per event loop, so waiting on a
+service holds no thread. astream() is the same for streamed (SSE) bodies.
+"""
+import asyncio
+import contextlib
+import threading
+import time
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from . import metrics
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN  # Let exactly one probe through
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_abandoned(self):
+        """
+        A call ended without an answer (cancelled, or an unexpected error).
+        That says nothing about the service, but a probe must not stay half
+        open forever: reopen, and the next probe goes out after reset_seconds.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class ServiceClient:
+    def __init__(self, name, base_url):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.SERVICE_POOL_SIZE, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breaker = CircuitBreaker(settings.SERVICE_CIRCUIT_FAILURES, settings.SERVICE_CIRCUIT_RESET_SECONDS)
+        self.async_clients = weakref.WeakKeyDictionary()  # event loop -> httpx.AsyncClient
+
+    def request(self, method, path, deadline, **kwargs):
+        """
+        Send a request with a read deadline in seconds. Raises
+        ServiceUnavailable when the circuit is open, the connection fails or
+        the deadline passes. 5xx responses count as failures but are returned.
+        """
+        if not self.breaker.allow():
+            metrics.incr(f'services.{self.name}.short_circuited')
+            raise ServiceUnavailable(f"{self.name} circuit open")
+        metrics.incr(f'services.{self.name}.calls')
+        try:
+            response = self.session.request(
+                method, f"{self.base_url}{path}",
+                timeout=(settings.SERVICE_CONNECT_TIMEOUT, deadline), **kwargs
+            )
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            metrics.incr(f'services.{self.name}.failures')
+            raise ServiceUnavailable(f"{self.name} unreachable: {e}") from e
+        except BaseException:
+            self.breaker.record_abandoned()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            metrics.incr(f'services.{self.name}.failures')
+        else:
+            self.breaker.record_success()
+        return response
+
+    def post(self, path, deadline, **kwargs):
+        return self.request('POST', path, deadline, **kwargs)
+
+    def get(self, path, deadline, **kwargs):
+        return self.request('GET', path, deadline, **kwargs)
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            client = self.async_clients[loop] = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_keepalive_connections=settings.SERVICE_POOL_SIZE),
+            )
+        return client
+
+    async def arequest(self, method, path, deadline, **kwargs):
+        """request() for coroutines; returns an httpx.Response"""
+        if not self.breaker.allow():
+            metrics.incr(f'services.{self.name}.short_circuited')
+            raise ServiceUnavailable(f"{self.name} circuit open")
+        metrics.incr(f'services.{self.name}.calls')
+        try:
+            response = await self.async_client().request(
+                method, path, timeout=httpx.Timeout(deadline, connect=settings.SERVICE_CONNECT_TIMEOUT), **kwargs
+            )
+        except httpx.HTTPError as e:
+            self.breaker.record_failure()
+            metrics.incr(f'services.{self.name}.failures')
+            raise ServiceUnavailable(f"{self.name} unreachable: {e}") from e
+        except BaseException:
+            self.breaker.record_abandoned()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            metrics.incr(f'services.{self.name}.failures')
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def apost(self, path, deadline, **kwargs):
+        return await self.arequest('POST', path, deadline, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def astream(self, method, path, deadline, **kwargs):
+        """
+        arequest() with a streamed body: yields the httpx.Response before the
+        body is read (use aiter_text()). deadline is the longest gap between
+        chunks. The breaker judges the status line only.
+        """
+        if not self.breaker.allow():
+            metrics.incr(f'services.{self.name}.short_circuited')
+            raise ServiceUnavailable(f"{self.name} circuit open")
+        metrics.incr(f'services.{self.name}.calls')
+        client = self.async_client()
+        request = client.build_request(
+            method, path, timeout=httpx.Timeout(deadline, connect=settings.SERVICE_CONNECT_TIMEOUT), **kwargs
+        )
+        try:
+            response = await client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            self.breaker.record_failure()
+            metrics.incr(f'services.{self.name}.failures')
+            raise ServiceUnavailable(f"{self.name} unreachable: {e}") from e
+        except BaseException:
+            self.breaker.record_abandoned()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            metrics.incr(f'services.{self.name}.failures')
+        else:
+            self.breaker.record_success()
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(name, base_url):
+    """Process-wide client per service, rebuilt if its base URL changes"""
+    client = _clients.get(name)
+    if client is None or client.base_url != base_url.rstrip('/'):
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None or client.base_url != base_url.rstrip('/'):
+                client = ServiceClient(name, base_url)
+                _clients[name] = client
+                metrics.register_gauge(f'services.{name}.circuit', lambda c=client: c.breaker.state)
+    return client
+
+
+def ai_service():
+    return get_client('ai_service', settings.AI_SERVICE_URL)
+
+
+def matching_service():
+    return get_client('matching_service', settings.MATCHING_SERVICE_URL)
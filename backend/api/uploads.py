@@ -0,0 +1,170 @@
+"""
+Streaming upload handling and temp-file lifecycle for AI image analysis.
+
+AnalysisUploadHandler validates uploads while the multipart body streams in:
+the magic bytes are checked on the first chunk, the size limit is enforced per
+chunk, and a SHA-256 of the content is computed as it arrives. The bytes are
+kept in a single buffer that preprocessing reads from directly.
+
+Analyzed images are stored content-addressed (temp/analysis_<sha256>.<ext>),
+so an identical upload is written once. The reaper expires temp files that no
+Request references once they are older than AI_TEMP_FILE_TTL.
+"""
+import hashlib
+import io
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+TEMP_DIR = 'temp'
+
+# Leading bytes of the formats accepted for analysis
+MAGIC_PREFIXES = (
+    b'\xff\xd8\xff',            # JPEG
+    b'\x89PNG\r\n\x1a\n',       # PNG
+)
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'mif1', b'msf1'}
+
+
+def sniff_image(header):
+    """True if the first bytes look like JPEG, PNG, WebP or HEIC/HEIF"""
+    if header.startswith(MAGIC_PREFIXES):
+        return True
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return True
+    return header[4:8] == b'ftyp' and header[8:12] in HEIF_BRANDS
+
+
+class AnalysisUploadHandler(FileUploadHandler):
+    """Validate, hash and buffer an image upload in one streaming pass"""
+
+    chunk_size = 64 * 2 ** 10
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error = None
+        self.sha256 = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.buffer = io.BytesIO()
+        self.received = 0
+        self.header = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.AI_IMAGE_MAX_UPLOAD_BYTES:
+            self.error = 'too_large'
+            raise SkipFile()
+
+        if len(self.header) < 16:
+            self.header += raw_data[:16 - len(self.header)]
+            if len(self.header) >= 16 and not sniff_image(self.header):
+                self.error = 'bad_magic'
+                raise SkipFile()
+
+        self.hasher.update(raw_data)
+        self.buffer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not sniff_image(self.header):
+            self.error = 'bad_magic'
+            return None
+        self.sha256 = self.hasher.hexdigest()
+        self.buffer.seek(0)
+        upload = InMemoryUploadedFile(
+            file=self.buffer,
+            field_name=self.field_name,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        upload.sha256 = self.sha256
+        return upload
+
+
+def content_path(sha256, extension):
+    return f"{TEMP_DIR}/analysis_{sha256}{extension}"
+
+
+def referenced_by_request(file_name):
+    from .models import Request
+    return Request.objects.filter(images__icontains=file_name).exists()
+
+
+def reap_temp_files(max_age=None, dry_run=False):
+    """
+    Delete temp analysis files older than max_age seconds that no Request
+    references, together with their dedup entries. Returns the deleted paths.
+    """
+    from .models import ImageAnalysis
+    from .dedup import image_index
+
+    max_age = settings.AI_TEMP_FILE_TTL if max_age is None else max_age
+    cutoff = datetime.now(dt_timezone.utc) - timedelta(seconds=max_age)
+    try:
+        _, files = default_storage.listdir(TEMP_DIR)
+    except FileNotFoundError:
+        return []
+
+    deleted = []
+    for name in files:
+        path = f"{TEMP_DIR}/{name}"
+        try:
+            modified = default_storage.get_modified_time(path)
+        except (OSError, NotImplementedError):
+            continue
+        if modified > cutoff:
+            continue
+
+        analyses = list(ImageAnalysis.objects.filter(file_path=path))
+        if any(a.last_used_at > cutoff for a in analyses):
+            continue  # Still being served to near-duplicate uploads
+        if referenced_by_request(name):
+            continue
+
+        deleted.append(path)
+        if dry_run:
+            continue
+        for analysis in analyses:
+            image_index.discard(analysis.id)
+            analysis.delete()
+        default_storage.delete(path)
+    return deleted
+
+
+_reaper_started = False
+_reaper_lock = threading.Lock()
+
+
+def _reaper_loop():
+    from django.db import close_old_connections
+    while True:
+        time.sleep(settings.AI_TEMP_REAP_INTERVAL)
+        try:
+            deleted = reap_temp_files()
+            if deleted:
+                print(f"Temp reaper removed {len(deleted)} orphaned analysis files")
+        except Exception as e:
+            print(f"Temp reaper failed: {e}")
+        finally:
+            close_old_connections()
+
+
+def ensure_temp_reaper():
+    """Start the per-process background reaper once (no-op when disabled)"""
+    global _reaper_started
+    if _reaper_started or settings.AI_TEMP_REAP_INTERVAL <= 0:
+        return
+    with _reaper_lock:
+        if not _reaper_started:
+            threading.Thread(target=_reaper_loop, name='temp-reaper', daemon=True).start()
+            _reaper_started = True
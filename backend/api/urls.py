@@ -7,7 +7,8 @@ from .views import (
     MessageViewSet, CustomAuthToken, StripeCheckoutView, StripeWebhookView
 )
 from .views_settings import SystemSettingsViewSet
-from .views_ai import AIImageAnalysisView
+from .views_ai import AIImageAnalysisView, AIDisputeSummaryStreamView, AIRequestAnalysisStreamView
+from .views_metrics import MetricsView
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -26,10 +27,13 @@ router.register(r'messages', MessageViewSet, basename='message')
 
 urlpatterns = [
     path('requests/ai-analyze/', AIImageAnalysisView.as_view(), name='request-ai-analyze'),
+    path('requests/ai-analyze-stream/', AIRequestAnalysisStreamView.as_view(), name='request-ai-analyze-stream'),
+    path('disputes/summarize-stream/', AIDisputeSummaryStreamView.as_view(), name='dispute-summarize-stream'),
     path('', include(router.urls)),
     path('profile/', UserViewSet.as_view({'get': 'me', 'put': 'me', 'patch': 'me'}), name='profile-detail'),
     path('auth/login/', CustomAuthToken.as_view(), name='api-token-auth'),
     path('auth/change-password/', UserViewSet.as_view({'post': 'change_password'}), name='auth-change-password'),
     path('payments/stripe-checkout/', StripeCheckoutView.as_view(), name='stripe-checkout'),
     path('payments/stripe-webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
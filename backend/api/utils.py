@@ -1,5 +1,5 @@
 import re
-from math import radians, sin, cos, sqrt, atan2
+from math import radians, sin, cos, sqrt, atan2, floor
 from django.db.models import Q
 
 def calculate_distance(lat1, lon1, lat2, lon2):
@@ -22,21 +22,83 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     
     return round(distance, 2)
 
+def geo_cell(lat, lon, size=None):
+    """
+    Grid cell (row, col) containing a point, PRICE_GEO_CELL_DEGREES on a side.
+    Returns None when the point is unknown.
+    """
+    if lat is None or lon is None:
+        return None
+    if size is None:
+        from django.conf import settings
+        size = settings.PRICE_GEO_CELL_DEGREES
+    return (floor(float(lat) / size), floor(float(lon) / size))
+
+def dispute_job_context(job, raised_by_role=None):
+    """Job facts sent to ai_service alongside a dispute reason"""
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "category": job.request.category.name if job.request.category else "General",
+        "request_title": job.request.title,
+        "provider": job.provider.user.username if job.provider else None,
+        "raised_by": raised_by_role,
+    }
+
+def match_points(distance_km, rating, availability_status, completed_jobs):
+    """
+    Score (0-100) of a provider already known to be in the request's category.
+    matching_service implements the same table; keep the two in sync.
+
+    - Location Proximity: 0-40 points (closer = better, None = unknown)
+    - Provider Rating: 0-35 points (higher rating = better)
+    - Availability: 0-15 points (available = bonus)
+    - Experience: 0-10 points (more completed jobs = bonus)
+    """
+    score = 0
+
+    if distance_km is not None:
+        if distance_km <= 2:
+            score += 40  # Very close
+        elif distance_km <= 5:
+            score += 35  # Close
+        elif distance_km <= 10:
+            score += 25  # Nearby
+        elif distance_km <= 20:
+            score += 15  # Moderate distance
+        elif distance_km <= 50:
+            score += 5   # Far but reachable
+        # More than 50km = 0 points
+
+    if rating:
+        score += (float(rating) / 5.0) * 35
+
+    if availability_status == 'available':
+        score += 15
+    elif availability_status == 'busy':
+        score += 5
+
+    completed_jobs = completed_jobs or 0
+    if completed_jobs >= 50:
+        score += 10
+    elif completed_jobs >= 20:
+        score += 7
+    elif completed_jobs >= 10:
+        score += 5
+    elif completed_jobs >= 5:
+        score += 3
+
+    return round(score, 2)
+
 def calculate_match_score(request_obj, provider):
     """
     Calculate match score between request and provider.
     
     CRITICAL: Category MUST match - wrong category = 0 score
     
-    Scoring breakdown (max 100):
-    - Category Match: REQUIRED (0 if mismatch, continue if match)
-    - Location Proximity: 0-40 points (closer = better)
-    - Provider Rating: 0-35 points (higher rating = better)
-    - Availability: 0-15 points (available = bonus)
-    - Experience: 0-10 points (more jobs = bonus)
+    Scoring breakdown (max 100) is match_points(). This is the per-provider
+    form; api.matching scores whole candidate sets with one query.
     """
-    score = 0
-    
     # Normalize request_obj (can be a Request model instance or a dictionary)
     if isinstance(request_obj, dict):
         req_category_id = request_obj.get('category_id') or request_obj.get('category')
@@ -54,10 +116,7 @@ def calculate_match_score(request_obj, provider):
     # Providers have 'categories' (ManyToManyField)
     if not provider.categories.filter(id=req_category_id).exists():
         return 0
-    
-    # Category matches, continue scoring...
-    
-    # 2. LOCATION PROXIMITY (0-40 points)
+
     # Coordinates are in the User's Profile
     prov_lat = None
     prov_lon = None
@@ -65,55 +124,12 @@ def calculate_match_score(request_obj, provider):
         prov_lat = provider.user.profile.latitude
         prov_lon = provider.user.profile.longitude
 
-    if req_lat and req_lon and prov_lat and prov_lon:
-        distance = calculate_distance(req_lat, req_lon, prov_lat, prov_lon)
-        
-        if distance is not None:
-            if distance <= 2:
-                score += 40  # Very close
-            elif distance <= 5:
-                score += 35  # Close
-            elif distance <= 10:
-                score += 25  # Nearby
-            elif distance <= 20:
-                score += 15  # Moderate distance
-            elif distance <= 50:
-                score += 5   # Far but reachable
-            # More than 50km = 0 points
-    
-    # 3. PROVIDER RATING (0-35 points)
-    if provider.rating:
-        rating_score = (float(provider.rating) / 5.0) * 35
-        score += rating_score
-    
-    # 4. AVAILABILITY (0-15 points)
-    if hasattr(provider, 'availability_status'):
-        if provider.availability_status == 'available':
-            score += 15
-        elif provider.availability_status == 'busy':
-            score += 5
-    elif hasattr(provider, 'available') and provider.available:
-        score += 15
-    
-    # 5. EXPERIENCE BONUS (0-10 points)
-    # Providers with more completed jobs get bonus
-    try:
-        from .models import Job
-        completed_jobs = Job.objects.filter(
-            provider=provider,
-            status='completed'
-        ).count()
-        
-        if completed_jobs >= 50:
-            score += 10
-        elif completed_jobs >= 20:
-            score += 7
-        elif completed_jobs >= 10:
-            score += 5
-        elif completed_jobs >= 5:
-            score += 3
-    except:
-        pass
-    
-    return round(score, 2)
+    from .models import Job
+    completed_jobs = Job.objects.filter(provider=provider, status='completed').count()
 
+    return match_points(
+        calculate_distance(req_lat, req_lon, prov_lat, prov_lon),
+        provider.rating,
+        provider.availability_status,
+        completed_jobs,
+    )
@@ -9,12 +9,15 @@ from .serializers import (
     CategorySerializer, ProviderSerializer, RequestSerializer,
     JobSerializer, InvoiceSerializer, ReviewSerializer, DisputeSerializer, BidSerializer
 )
-from .utils import calculate_match_score
-from .notifications import notify_request_update, notify_job_update, send_notification
+from .matching import match_providers, providers_for
+from .diagnosis import get_automaton, rank_categories
+from .notifications import notify_request_update, notify_job_update
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from django.db.models import Q
-from .payments import create_checkout_session, process_webhook_event
+from django.db import transaction
+from django.db.models import F, Q
+from .payments import acreate_checkout_session, process_webhook_event
+from .aio import AsyncAPIView
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from rest_framework.views import APIView
@@ -159,36 +162,22 @@ class CategoryViewSet(viewsets.ModelViewSet):
         if not desc:
             return Response({'error': 'Description required'}, status=400)
             
-        categories = Category.objects.filter(is_active=True)
-        best_match = None
-        
-        # Advanced keyword mapping
-        category_map = {
-            'plumbing': ['leak', 'pipe', 'toilet', 'sink', 'tap', 'water', 'drain', 'clog', 'shower', 'basin', 'flush'],
-            'electrical': ['wire', 'light', 'short', 'circuit', 'power', 'switch', 'spark', 'breaker', 'plugin', 'voltage', 'shock'],
-            'cleaning': ['dust', 'wash', 'mop', 'house', 'office', 'dirty', 'deep clean', 'vacuum', 'scrub', 'mess'],
-            'painting': ['wall', 'color', 'brush', 'coat', 'stain', 'renovation', 'interior', 'exterior', 'primer'],
-            'carpentry': ['wood', 'furniture', 'door', 'shelf', 'cabinet', 'fix', 'table', 'chair', 'hammer', 'nail'],
-            'hvac': ['ac', 'air', 'condition', 'heat', 'cool', 'filter', 'vent', 'duct', 'thermostat', 'chiller']
-        }
-        
-        # Simple keyword matching
-        for cat in categories:
-            cat_name_low = cat.name.lower()
-            keywords = category_map.get(cat_name_low, [cat_name_low])
-            
-            for word in keywords:
-                if word in desc:
-                    best_match = cat
-                    break
-            if best_match: break
+        # One linear pass over the description with the precompiled keyword automaton
+        category_rows = list(Category.objects.filter(is_active=True).order_by('id').values_list('id', 'name'))
+        try:
+            top_k = max(1, min(int(request.data.get('top_k', 3)), 10))
+        except (TypeError, ValueError):
+            top_k = 3
+        candidates = rank_categories(get_automaton(category_rows), category_rows, desc, top_k=top_k)
             
-        if best_match:
+        if candidates:
+            best_match = candidates[0]
             return Response({
-                'category_id': best_match.id,
-                'category_name': best_match.name,
-                'confidence': 0.85,
-                'summary': f"Based on your description, this appears to be a {best_match.name} issue."
+                'category_id': best_match['category_id'],
+                'category_name': best_match['category_name'],
+                'confidence': best_match['confidence'],
+                'candidates': candidates,
+                'summary': f"Based on your description, this appears to be a {best_match['category_name']} issue."
             })
             
         return Response({
@@ -224,20 +213,23 @@ class ProviderViewSet(viewsets.ModelViewSet):
         Expects: { title, description, category, address }
         """
         data = request.data
-        
-        # Filter active providers
-        providers = Provider.objects.filter(availability_status='available')
-        
+        category_id = data.get('category_id') or data.get('category')
+        if not category_id:
+            return Response([])
+
+        # Rank active providers in the category (local or matching_service, see api.matching)
+        matches, _ = match_providers(
+            category_id, data.get('latitude'), data.get('longitude'), availability='available'
+        )
+        providers = providers_for(matches)
+
         scored_providers = []
-        for provider in providers:
-            score = calculate_match_score(data, provider)
-            if score > 0:
-                serialized = self.get_serializer(provider).data
-                serialized['match_score'] = score
+        for match in matches:
+            if match.match_score > 0 and match.provider_id in providers:
+                serialized = self.get_serializer(providers[match.provider_id]).data
+                serialized['match_score'] = match.match_score
                 scored_providers.append(serialized)
-        
-        scored_providers.sort(key=lambda x: x['match_score'], reverse=True)
-        return Response(scored_providers[:10])
+        return Response(scored_providers)
 
 class RequestViewSet(viewsets.ModelViewSet):
     queryset = Request.objects.all()
@@ -269,29 +261,34 @@ class RequestViewSet(viewsets.ModelViewSet):
         request_instance = serializer.save(user=self.request.user)
         print(f"DEBUG: Request instance created with ID {request_instance.id}")
         
-        # AI Analysis Call
-        import requests as http_requests
-        try:
-            ai_service_url = "http://localhost:8001/ai/analyze-request"
-            payload = {
-                "title": request_instance.title,
-                "description": request_instance.description,
-                "category": request_instance.category.name if request_instance.category else "General"
-            }
-            ai_response = http_requests.post(ai_service_url, json=payload, timeout=5)
-            if ai_response.status_code == 200:
-                request_instance.ai_summary = ai_response.json()
-                request_instance.save()
-                print(f"DEBUG: AI Analysis saved for Request #{request_instance.id}")
-        except Exception as e:
-            print(f"DEBUG: AI analysis failed: {e}")
-        
-        # Send email notifications
-        from .emails import send_new_request_notification
-        try:
-            send_new_request_notification(request_instance)
-        except Exception as e:
-            print(f"Email notification failed: {e}")
+        # AI Analysis (reuse a streamed preview, else local classifier first,
+        # ai_service only when it is unsure; under daphne that call runs after
+        # the response, see classifier.enrich_request)
+        from .aio import spawn
+        from .classifier import cascade_local, enrich_request, llm_analysis, llm_payload, recall_analysis, save_analysis
+        analysis_args = (
+            request_instance.title,
+            request_instance.description,
+            request_instance.category.name if request_instance.category else None,
+        )
+        analysis = recall_analysis(self.request.user.id, *analysis_args) or cascade_local(*analysis_args)
+        if analysis is None:
+            payload = llm_payload(*analysis_args)
+            if spawn(enrich_request, request_instance.id, payload):
+                print(f"DEBUG: AI Analysis for Request #{request_instance.id} continues in the background")
+            else:
+                analysis = llm_analysis(payload)
+        if analysis:
+            save_analysis(request_instance, analysis)
+            print(f"DEBUG: AI Analysis ({analysis.get('source')}) saved for Request #{request_instance.id}")
+        
+        # Send email notifications (in the background under daphne)
+        from .emails import asend_new_request_notification, send_new_request_notification
+        if not spawn(asend_new_request_notification, request_instance.id):
+            try:
+                send_new_request_notification(request_instance)
+            except Exception as e:
+                print(f"Email notification failed: {e}")
         
         # Check for selected provider and create a Job
         provider_id = self.request.data.get('selected_provider')
@@ -315,34 +312,14 @@ class RequestViewSet(viewsets.ModelViewSet):
                 import traceback
                 traceback.print_exc()
         else:
-            # Broadcast to ALL available providers
-            print("DEBUG: No selected_provider, broadcasting to all available providers...")
-            available_providers = Provider.objects.filter(availability_status='available')
-            print(f"DEBUG: Found {available_providers.count()} available providers")
-            
-            jobs_created = 0
-            for provider in available_providers:
-                try:
-                    job = Job.objects.create(
-                        request=request_instance,
-                        provider=provider,
-                        status='pending'
-                    )
-                    jobs_created += 1
-                    
-                    # Notify Provider
-                    send_notification(
-                        user_id=provider.user.id,
-                        message=f"New Job Opportunity: {request_instance.title}",
-                        type='new_job',
-                        payload={'job_id': job.id, 'request_id': request_instance.id}
-                    )
-                    
-                    print(f"DEBUG: Created Job #{job.id} for Provider '{provider.user.username}'")
-                except Exception as e:
-                    print(f"DEBUG: Error creating job for provider {provider.id}: {e}")
-                    
-            print(f"DEBUG: Total jobs created: {jobs_created}")
+            # Broadcast to the category's available providers, announced per geo cell (see broadcast.py)
+            print("DEBUG: No selected_provider, broadcasting to available providers...")
+            from .broadcast import broadcast_request
+            try:
+                jobs_created = broadcast_request(request_instance)
+                print(f"DEBUG: Total jobs created: {jobs_created}")
+            except Exception as e:
+                print(f"DEBUG: Error broadcasting request {request_instance.id}: {e}")
     
     @action(detail=False, methods=['get'])
     def open_requests(self, request):
@@ -367,12 +344,12 @@ class RequestViewSet(viewsets.ModelViewSet):
                 'request_id': service_request.id
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get ONLY providers in the SAME category
-        providers = Provider.objects.filter(
-            categories=service_request.category
+        # Rank ONLY providers in the SAME category (local or matching_service, see api.matching)
+        top_matches, total = match_providers(
+            service_request.category_id, service_request.latitude, service_request.longitude
         )
         
-        if not providers.exists():
+        if not total:
             from rest_framework import status
             return Response({
                 'error': f'No {service_request.category.name} providers found',
@@ -380,52 +357,28 @@ class RequestViewSet(viewsets.ModelViewSet):
                 'suggestion': 'Please try again later or contact support'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Score each provider
-        from .utils import calculate_match_score, calculate_distance
-        
+        providers = providers_for(top_matches)
         scored_providers = []
-        for provider in providers:
-            match_score = calculate_match_score(service_request, provider)
-            
-            # Calculate distance if coordinates available (from User Profile)
-            prov_lat = None
-            prov_lon = None
-            if hasattr(provider.user, 'profile'):
-                prov_lat = provider.user.profile.latitude
-                prov_lon = provider.user.profile.longitude
-
-            distance = None
-            if (service_request.latitude and service_request.longitude and 
-                prov_lat and prov_lon):
-                distance = calculate_distance(
-                    service_request.latitude,
-                    service_request.longitude,
-                    prov_lat,
-                    prov_lon
-                )
-            
+        for match in top_matches:
+            provider = providers.get(match.provider_id)
+            if provider is None:
+                continue
             scored_providers.append({
                 'provider_id': provider.id,
                 'provider_name': provider.user.get_full_name() or provider.user.username,
                 'rating': float(provider.rating or 0),
-                'match_score': match_score,
-                'distance_km': distance,
+                'match_score': match.match_score,
+                'distance_km': match.distance_km,
                 'availability': getattr(provider, 'availability_status', 'unknown'),
                 'category': service_request.category.name # Use the request's category name as primary
             })
         
-        # Sort by match score (highest first)
-        scored_providers.sort(key=lambda x: x['match_score'], reverse=True)
-        
-        # Return top 10 matches
-        top_matches = scored_providers[:10]
-        
         return Response({
             'request_id': service_request.id,
             'request_category': service_request.category.name,
-            'total_providers_in_category': len(scored_providers),
-            'matched_providers': top_matches,
-            'message': f'Found {len(top_matches)} {service_request.category.name} providers'
+            'total_providers_in_category': total,
+            'matched_providers': scored_providers,
+            'message': f'Found {len(scored_providers)} {service_request.category.name} providers'
         })
     
     @action(detail=False, methods=['get'])
@@ -504,6 +457,26 @@ class DisputeViewSet(viewsets.ModelViewSet):
     serializer_class = DisputeSerializer
     permission_classes = [IsAuthenticated]
 
+    def perform_create(self, serializer):
+        from .disputes import dispute_job
+        user = self.request.user
+        job = dispute_job(user, self.request.data.get('job_id'))
+        dispute = serializer.save(job=job, raised_by=user)
+
+        # AI summary (typed result from ai_service, stored as-is): a streamed
+        # preview when there was one, else fetched in the background under
+        # daphne, see disputes.asummarize_dispute
+        from .aio import spawn
+        from .disputes import asummarize_dispute, recall_summary, summarize_dispute, summary_payload
+        summary = recall_summary(user.id, job.id, dispute.reason)
+        if summary is not None:
+            dispute.ai_summary = summary
+            dispute.save(update_fields=['ai_summary'])
+            return
+        payload = summary_payload(job, dispute.reason, user.role)
+        if not spawn(asummarize_dispute, dispute.id, payload):
+            summarize_dispute(dispute, payload)
+
 class BidViewSet(viewsets.ModelViewSet):
     queryset = Bid.objects.all()
     serializer_class = BidSerializer
@@ -645,8 +618,12 @@ class JobViewSet(viewsets.ModelViewSet):
         job.request.status = 'assigned'
         job.request.save()
         
-        # Cancel all OTHER pending jobs for this request
-        Job.objects.filter(request=job.request, status='pending').exclude(id=job.id).update(status='cancelled')
+        # Cancel all OTHER pending jobs for this request (and close their chats)
+        from .chat import job_access_changed
+        others = Job.objects.filter(request=job.request, status='pending').exclude(id=job.id)
+        cancelled_ids = list(others.values_list('id', flat=True))
+        others.filter(id__in=cancelled_ids).update(status='cancelled')
+        job_access_changed(cancelled_ids)
         
         # Notify Customer
         notify_request_update(job.request, f"Provider {job.provider.user.username} has accepted your request!")
@@ -783,7 +760,70 @@ class MessageViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         # Auto-set sender
-        serializer.save(sender=self.request.user)
+        from .chat import count_messages
+        with transaction.atomic():
+            count_messages([serializer.save(sender=self.request.user)])
+
+    @action(detail=False, methods=['get'])
+    def history(self, request):
+        """
+        One page of a job's chat: ?job_id=&before=<message id>&limit=
+        Without `before` this is the latest page; pass `next_before` to get
+        the page before it. Served from the (job, created_at) index.
+        """
+        job_id = request.query_params.get('job_id', '')
+        if not job_id.isdigit():
+            return Response({'error': 'Job ID required'}, status=400)
+        participants = Job.objects.filter(id=job_id).values_list('request__user_id', 'provider__user_id').first()
+        if participants is None:
+            return Response({'error': 'Job not found'}, status=404)
+        if request.user.id not in participants and not request.user.is_staff:
+            return Response({'error': 'Not a participant in this chat'}, status=403)
+
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 50)), 200))
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=400)
+
+        messages = Message.objects.filter(job_id=job_id)
+        before = request.query_params.get('before')
+        if before:
+            cursor = Message.objects.filter(id=before, job_id=job_id).values_list('created_at', flat=True).first() \
+                if before.isdigit() else None
+            if cursor is None:
+                return Response({'error': 'Unknown cursor'}, status=400)
+            messages = messages.filter(Q(created_at__lt=cursor) | Q(created_at=cursor, id__lt=before))
+
+        page = list(messages.select_related('sender__profile').order_by('-created_at', '-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit][::-1]  # Oldest first within the page
+        return Response({
+            'results': self.get_serializer(page, many=True).data,
+            'has_more': has_more,
+            'next_before': page[0].id if has_more else None,
+        })
+
+    @action(detail=False, methods=['get'])
+    def inbox(self, request):
+        """The user's chats, latest activity first, with unread counts (one row per job)"""
+        from .models import ChatUnread
+        chats = (ChatUnread.objects.filter(user=request.user)
+                 .select_related('last_message')
+                 .order_by(F('last_message_at').desc(nulls_last=True)))
+        results = [
+            {
+                'job_id': chat.job_id,
+                'unread': chat.count,
+                'last_message': {
+                    'id': chat.last_message.id,
+                    'content': chat.last_message.content,
+                    'sender_id': chat.last_message.sender_id,
+                    'created_at': chat.last_message.created_at,
+                } if chat.last_message else None,
+            }
+            for chat in chats
+        ]
+        return Response({'total_unread': sum(chat['unread'] for chat in results), 'chats': results})
 
     @action(detail=False, methods=['post'])
     def mark_read(self, request):
@@ -792,27 +832,37 @@ class MessageViewSet(viewsets.ModelViewSet):
              return Response({'error': 'Job ID required'}, status=400)
              
         # Mark all messages in this job received by current user as read
-        updated = Message.objects.filter(
-            job_id=job_id,
-            receiver=request.user,
-            is_read=False
-        ).update(is_read=True)
+        from .models import ChatUnread
+        with transaction.atomic():
+            unread = ChatUnread.objects.select_for_update().filter(user=request.user, job_id=job_id).first()
+            updated = 0
+            if unread is None or unread.count:
+                updated = Message.objects.filter(
+                    job_id=job_id,
+                    receiver=request.user,
+                    is_read=False
+                ).update(is_read=True)
+            if unread is not None and unread.count:
+                unread.count = 0
+                unread.save(update_fields=['count'])
         
         return Response({'status': 'success', 'updated': updated})
 
-class StripeCheckoutView(APIView):
+class StripeCheckoutView(AsyncAPIView):
+    """Async: waiting on Stripe holds no thread (see api.aio)"""
     permission_classes = [IsAuthenticated]
     
-    def post(self, request):
-        invoice_id = request.data.get('invoice_id')
-        success_url = request.data.get('success_url')
-        cancel_url = request.data.get('cancel_url')
+    async def post(self, request):
+        data = await self.data(request)
+        invoice_id = data.get('invoice_id')
+        success_url = data.get('success_url')
+        cancel_url = data.get('cancel_url')
         
         if not invoice_id:
             return Response({'error': 'Invoice ID is required'}, status=400)
             
         try:
-            session = create_checkout_session(invoice_id, success_url, cancel_url)
+            session = await acreate_checkout_session(invoice_id, success_url, cancel_url)
             return Response({'checkout_url': session.url, 'session_id': session.id})
         except Exception as e:
             return Response({'error': str(e)}, status=500)
@@ -1,56 +1,120 @@
-from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework import status, permissions
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from django.conf import settings
-from .models import Category, SystemSettings
+from django.http import StreamingHttpResponse
+from django.db.models import F
+from django.utils import timezone
+from .models import Category, SystemSettings, ImageAnalysis
 import os
-import time
 import random
-import uuid
 import json
-import google.generativeai as genai
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
-try:
-    from pillow_heif import register_heif_opener
-    register_heif_opener()
-except ImportError:
-    print("Warning: pillow-heif not installed. HEIC support will be limited.")
+from .imaging import preprocess_upload, output_extension
+from .uploads import AnalysisUploadHandler, content_path, ensure_temp_reaper
+from .dedup import image_index, to_signed
+from .ai_keys import get_key_pool
+from .pricing import budget_range, duration_range
+from .classifier import llm_payload, local_analysis, remember_analysis
+from . import metrics
+from .services import ai_service
+from .aio import AsyncAPIView
+from asgiref.sync import sync_to_async
 
-class AIImageAnalysisView(APIView):
+class AIImageAnalysisView(AsyncAPIView):
     """
     Advanced AI endpoint for analyzing uploaded images for service requests.
     INTEGRATED WITH GOOGLE GEMINI (MULTI-KEY ROTATION).
+    Async: the Gemini call is awaited on the event loop; upload handling,
+    image work and ORM calls run in sync_to_async (see api.aio).
     """
     parser_classes = (MultiPartParser, FormParser)
 
-    def post(self, request, *args, **kwargs):
-        if 'image' not in request.data:
-            return Response({'error': 'No image data provided'}, status=status.HTTP_400_BAD_REQUEST)
+    def initialize_request(self, request, *args, **kwargs):
+        # Must be installed before anything touches request.POST/FILES
+        self.upload_handler = AnalysisUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
 
-        image_file = request.data['image']
-        
-        # --- SECURITY PROTOCOL: STEP 1 (File Analysis) ---
-        if image_file.size > 10 * 1024 * 1024: # 10MB limit
+    async def post(self, request, *args, **kwargs):
+        # Upload parsing, decoding, storage and queries: one hop to a worker thread
+        prepared = await sync_to_async(self.prepare)(request)
+        if isinstance(prepared, Response):
+            return prepared
+        category_rows, prompt, valid_keys, processed, file_path, full_url = prepared
+
+        if not valid_keys:
+             # Fallback to simulation if no keys are configured
+             return await sync_to_async(self.simulated_response)(category_rows, full_url)
+
+        try:
+            # Weighted, health-aware key selection with failover and p95 hedging
+            pool = get_key_pool(valid_keys)
+            ai_result = await pool.agenerate_json([prompt, processed.as_gemini_part()])
+            print("AI Analysis Successful")
+            return await sync_to_async(self.analysis_response)(ai_result, category_rows, processed, file_path, full_url)
+
+        except Exception as e:
+            print(f"Critical AI Error: {e}")
+            # Fallback to simulation on critical failure so app doesn't break
+            return await sync_to_async(self.simulated_response)(category_rows, full_url)
+
+    def prepare(self, request):
+        """
+        Validate, dedupe and store the upload, and build the prompt.
+        Returns a Response to send as is, or
+        (category_rows, prompt, valid_keys, processed, file_path, full_url).
+        """
+        ensure_temp_reaper()
+        data = request.data  # Streams the body through AnalysisUploadHandler
+
+        # --- SECURITY PROTOCOL: STEP 1 (File Analysis, enforced while streaming) ---
+        if self.upload_handler.error == 'too_large':
             return Response({'error': 'Security Alert: File size exceeds safe processing limits.'}, status=status.HTTP_400_BAD_REQUEST)
+        if self.upload_handler.error == 'bad_magic':
+            return Response({'error': 'Security Alert: Unsupported or potentially malicious file format.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if 'image' not in data:
+            return Response({'error': 'No image data provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        image_file = data['image']
         
         allowed_types = ['image/jpeg', 'image/png', 'image/heic', 'image/webp']
         if image_file.content_type not in allowed_types:
             return Response({'error': 'Security Alert: Unsupported or potentially malicious file format.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Save the file temporarily
-        file_ext = os.path.splitext(image_file.name)[1]
-        file_name = f"analysis_{uuid.uuid4()}{file_ext}"
-        file_path = default_storage.save(f"temp/{file_name}", ContentFile(image_file.read()))
-        full_path = os.path.join(settings.MEDIA_ROOT, file_path)
+        # Content-addressed location: identical uploads map to the same file
+        file_path = content_path(image_file.sha256, output_extension())
+        exact = ImageAnalysis.objects.filter(file_path=file_path).first()
+        if exact is not None and default_storage.exists(file_path):
+            ImageAnalysis.objects.filter(id=exact.id).update(hits=F('hits') + 1, last_used_at=timezone.now())
+            return Response(self.duplicate_response(request, exact), status=status.HTTP_200_OK)
+
+        # --- PREPROCESSING: STEP 2 (Decode once from the upload buffer, downsample, strip EXIF) ---
+        try:
+            processed = preprocess_upload(image_file.file.getvalue())
+        except Exception as e:
+            print(f"Image preprocessing failed: {e}")
+            return Response({'error': 'Security Alert: File could not be decoded as an image.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # --- DEDUPLICATION: reuse the analysis of a near-identical earlier upload ---
+        if settings.AI_IMAGE_DEDUP_DISTANCE >= 0:
+            duplicate = self.find_duplicate(processed.phash)
+            if duplicate is not None:
+                return Response(self.duplicate_response(request, duplicate), status=status.HTTP_200_OK)
+
+        # Write the compact re-encoded copy once; the reaper expires it if never used
+        if not default_storage.exists(file_path):
+            file_path = default_storage.save(file_path, ContentFile(processed.data))
         full_url = request.build_absolute_uri(settings.MEDIA_URL + file_path)
 
         # --- AI PROCESSING: STEP 3 (Vision Analysis) ---
         
         # 1. Fetch Categories for prompt context
-        categories = list(Category.objects.filter(is_active=True).values_list('name', flat=True))
-        categories_str = ", ".join(categories)
+        category_rows = list(Category.objects.filter(is_active=True).values_list('id', 'name'))
+        categories_str = ", ".join(name for _, name in category_rows)
 
         # 2. Prepare Prompt
         prompt = f"""
@@ -64,7 +128,6 @@ class AIImageAnalysisView(APIView):
         - category_match: The exact name of the closest matching category from the list above. If none match, use "General".
         - suggested_title: A professional, concise title for a service request.
         - suggested_description: A detailed, professional description of the issue for a service provider.
-        - estimated_budget_range: A realistic price range (e.g. "$100 - $250") based on US market rates.
         - urgency: "Low", "Medium", "High", or "Critical".
         - confidence_score: A number between 0.0 and 1.0.
         
@@ -72,7 +135,7 @@ class AIImageAnalysisView(APIView):
         Otherwise "is_relevant": true.
         """
 
-        # 3. Get API Keys & Rotate
+        # 3. Get API Keys (pooled per key, see ai_keys.KeyPool)
         system_settings = SystemSettings.get_settings()
         api_keys = [
             system_settings.gemini_api_key_1,
@@ -81,103 +144,263 @@ class AIImageAnalysisView(APIView):
             system_settings.gemini_api_key_4
         ]
         # Filter empty keys
-        valid_keys = [k for k in api_keys if k and k.strip()]
+        valid_keys = [k.strip() for k in api_keys if k and k.strip()]
+        return category_rows, prompt, valid_keys, processed, file_path, full_url
+
+    def analysis_response(self, ai_result, category_rows, processed, file_path, full_url):
+        """Response for a successful Gemini reply (stores it for dedup)"""
+        # Process Result
+        if not ai_result.get('is_relevant', True):
+             return Response({
+                'error': 'Image Irrelevant: The uploaded image does not appear to be a maintenance issue.',
+                'code': 'IRRELEVANT_CONTENT'
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         
-        if not valid_keys:
-             # Fallback to simulation if no keys are configured
-             return self.simulated_response(image_file, categories, full_url)
+        # Find category ID
+        category_id = self.match_category(category_rows, ai_result.get('category_match', 'General'))
+        
+        final_response = {
+            "success": True,
+            "security_check": "PASSED",
+            "content_safety": "CLEAN", # Gemini filters these usually, assuming clean if we got here
+            "analysis": {
+                "detected_objects": ai_result.get('key_observations', []),
+                "confidence": ai_result.get('confidence_score', 0.9),
+                "summary": f"AI identified: {ai_result.get('suggested_title', ai_result.get('title', 'Unknown Issue'))}",
+                "suggested_title": ai_result.get('suggested_title') or ai_result.get('title') or "New Service Request",
+                "suggested_description": ai_result.get('suggested_description') or ai_result.get('description') or "Please provide more details.",
+                "category_id": category_id,
+                # Priced from our own invoices and bids, not by the model
+                "estimated_budget_range": budget_range(category_id) or ai_result.get('estimated_budget_range', '$50 - $150'),
+                "urgency": ai_result.get('urgency', 'Medium'),
+                "image_url": full_url
+            }
+        }
 
-        ai_result = None
-        last_error = None
+        if settings.AI_IMAGE_DEDUP_DISTANCE >= 0:
+            stored = {k: v for k, v in final_response['analysis'].items() if k != 'image_url'}
+            image_index.add(ImageAnalysis.objects.create(
+                phash=to_signed(processed.phash),
+                file_path=file_path,
+                analysis=stored
+            ))
+        
+        return Response(final_response, status=status.HTTP_200_OK)
 
+    def find_duplicate(self, phash):
+        """Stored analysis of a perceptually similar image whose file still exists"""
         try:
-            pil_image = PIL.Image.open(full_path)
-            
-            for key in valid_keys:
-                try:
-                    print(f"Attempting analysis with Key ending in ...{key[-4:]}")
-                    genai.configure(api_key=key)
-                    model = genai.GenerativeModel('gemini-1.5-flash')
-                    
-                    response = model.generate_content(
-                        [prompt, pil_image],
-                        generation_config={"response_mime_type": "application/json"}
-                    )
-                    
-                    ai_result = json.loads(response.text)
-                    print("AI Analysis Successful")
-                    break # Success! Match found.
-                except Exception as e:
-                    print(f"Key failed: {e}")
-                    last_error = e
-                    continue # Try next key
-
-            if not ai_result:
-                raise last_error or Exception("All API keys failed or were exhausted.")
-
-            # Process Result
-            if not ai_result.get('is_relevant', True):
-                 return Response({
-                    'error': 'Image Irrelevant: The uploaded image does not appear to be a maintenance issue.',
-                    'code': 'IRRELEVANT_CONTENT'
-                }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-            
-            # Find category ID
-            cat_name = ai_result.get('category_match', 'General')
-            category_obj = Category.objects.filter(name__iexact=cat_name).first()
-            if not category_obj:
-                 category_obj = Category.objects.filter(name__icontains=cat_name).first()
-            
-            final_response = {
-                "success": True,
-                "security_check": "PASSED",
-                "content_safety": "CLEAN", # Gemini filters these usually, assuming clean if we got here
-                "analysis": {
-                    "detected_objects": ai_result.get('key_observations', []),
-                    "confidence": ai_result.get('confidence_score', 0.9),
-                    "summary": f"AI identified: {ai_result.get('suggested_title', ai_result.get('title', 'Unknown Issue'))}",
-                    "suggested_title": ai_result.get('suggested_title') or ai_result.get('title') or "New Service Request",
-                    "suggested_description": ai_result.get('suggested_description') or ai_result.get('description') or "Please provide more details.",
-                    "category_id": category_obj.id if category_obj else None,
-                    "estimated_budget_range": ai_result.get('estimated_budget_range') or ai_result.get('budget', '$50 - $150'),
-                    "urgency": ai_result.get('urgency', 'Medium'),
-                    "image_url": full_url
-                }
+            match = image_index.find(phash, settings.AI_IMAGE_DEDUP_DISTANCE)
+        except Exception as e:
+            print(f"Dedup lookup failed: {e}")
+            return None
+        if match is None:
+            return None
+        analysis, distance = match
+        if not default_storage.exists(analysis.file_path):
+            image_index.discard(analysis.id)
+            analysis.delete()
+            return None
+        print(f"Reusing ImageAnalysis #{analysis.id} (hamming distance {distance})")
+        ImageAnalysis.objects.filter(id=analysis.id).update(hits=F('hits') + 1, last_used_at=timezone.now())
+        return analysis
+
+    def duplicate_response(self, request, analysis):
+        stored = analysis.analysis
+        # Reprice: the stored range may predate newer invoices and bids
+        budget = budget_range(stored.get('category_id')) if stored.get('category_id') else None
+        return {
+            "success": True,
+            "security_check": "PASSED",
+            "content_safety": "CLEAN",
+            "deduplicated": True,
+            "analysis": {
+                **stored,
+                **({"estimated_budget_range": budget} if budget else {}),
+                "image_url": request.build_absolute_uri(settings.MEDIA_URL + analysis.file_path)
             }
-            
-            return Response(final_response, status=status.HTTP_200_OK)
+        }
 
-        except Exception as e:
-            print(f"Critical AI Error: {e}")
-            # Fallback to simulation on critical failure so app doesn't break
-            return self.simulated_response(image_file, list(Category.objects.filter(is_active=True).values_list('name', flat=True)), full_url)
-        finally:
-            # Cleanup temp file? Maybe keep it for the actual request creation if used.
-            # For now, we leave it. A cron job should clean temp/ folder.
-            pass
-
-    def simulated_response(self, image_file, category_names, full_url):
-        """Fallback simulation if AI fails or no keys"""
+    @staticmethod
+    def match_category(category_rows, cat_name):
+        """Exact (case-insensitive) then substring match against the fetched categories"""
+        cat_low = (cat_name or '').lower()
+        for category_id, name in category_rows:
+            if name.lower() == cat_low:
+                return category_id
+        for category_id, name in category_rows:
+            if cat_low and cat_low in name.lower():
+                return category_id
+        return None
+
+    def simulated_response(self, category_rows, full_url):
+        """
+        Fallback simulation if AI fails or no keys.
+        Returns immediately: the configured latency is handed to the client as
+        simulated_latency_ms instead of sleeping on a worker thread.
+        """
         print("Falling back to simulation mode...")
-        time.sleep(1.5)
-        cat = "General"
-        if category_names:
-            cat = category_names[0]
+        category_id, cat = category_rows[0] if category_rows else (None, "General")
             
         return Response({
             "success": True,
             "security_check": "PASSED - SIMULATION",
             "content_safety": "CLEAN",
             "is_simulated": True,
+            "simulated_latency_ms": settings.AI_SIMULATED_LATENCY_MS,
             "analysis": {
                 "detected_objects": ["Detected via Simulation"],
                 "confidence": 0.7,
                 "summary": f"Initial assessment for {cat} request (Development Mode)",
                 "suggested_title": f"Service Request: {cat} Maintenance",
                 "suggested_description": f"I need assistance with a {cat.lower()} related issue. The problem was identified through visual analysis, but please provide specific details here to help the service provider understand the scope of work.",
-                "category_id": Category.objects.filter(name=cat).first().id if Category.objects.filter(name=cat).exists() else None,
-                "estimated_budget_range": "$100 - $300",
+                "category_id": category_id,
+                "estimated_budget_range": budget_range(category_id) or "$100 - $300",
                 "urgency": "Medium",
                 "image_url": full_url
             }
         }, status=status.HTTP_200_OK)
+
+
+def sse_frame(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients send Accept: text/event-stream; errors are still JSON bodies"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+def event_stream(events):
+    """SSE response over an async generator, so each frame is sent as it is yielded"""
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def upstream_events(path, payload):
+    """
+    (event, data, frame) for each SSE frame of an ai_service stream, as it
+    arrives. The upstream start frame is skipped: ours went out first.
+    """
+    async with ai_service().astream('POST', path, settings.AI_STREAM_TIMEOUT, json=payload) as upstream:
+        upstream.raise_for_status()
+        buffer = ''
+        async for text in upstream.aiter_text():
+            buffer += text
+            while '\n\n' in buffer:
+                frame, buffer = buffer.split('\n\n', 1)
+                event, data = 'message', ''
+                for line in frame.split('\n'):
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith('data:'):
+                        data += line[5:].strip()
+                if event != 'start':
+                    yield event, data, frame + '\n\n'
+
+
+class AIRequestAnalysisStreamView(AsyncAPIView):
+    """
+    Request analysis streamed as Server-Sent Events for the request-creation UI.
+    Confident local classifications are answered with a single result event,
+    everything else is proxied from ai_service's /ai/analyze-request/stream.
+    The final result is cached so creating the same request does not analyze
+    it a second time. Async, so frames reach the client as they are generated
+    instead of being buffered by Django's ASGI handler.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+    async def post(self, request, *args, **kwargs):
+        data = await self.data(request)
+        title = str(data.get('title', '')).strip()
+        description = str(data.get('description', '')).strip()
+        if not title and not description:
+            return Response({'error': 'Title or description is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        category_id = data.get('category_id') or data.get('category')
+        category_name = None
+        if category_id:
+            category_name = await Category.objects.filter(id=category_id).values_list('name', flat=True).afirst()
+
+        return event_stream(
+            self.events(request.user.id, title, description, category_id if category_name else None, category_name)
+        )
+
+    def finalize(self, user_id, title, description, category_id, category_name, result):
+        duration = duration_range(category_id) if category_id else None
+        if duration:
+            result['estimated_duration'] = duration
+        remember_analysis(user_id, title, description, category_name, result)
+        return result
+
+    async def events(self, user_id, title, description, category_id, category_name):
+        # Flush headers immediately; time-to-first-byte no longer waits on the model
+        yield sse_frame('start', {})
+        finalize = sync_to_async(self.finalize)
+
+        metrics.incr('cascade.requests')
+        local = await sync_to_async(local_analysis)(title, description, category_name)
+        if local is not None:
+            metrics.incr('cascade.local_hits')
+            yield sse_frame('result', await finalize(user_id, title, description, category_id, category_name, local))
+            return
+
+        metrics.incr('cascade.llm_calls')
+        payload = await sync_to_async(llm_payload)(title, description, category_name)
+        try:
+            async for event, data, frame in upstream_events('/ai/analyze-request/stream', payload):
+                if event == 'result':
+                    result = {**json.loads(data), "source": "llm"}
+                    yield sse_frame('result', await finalize(user_id, title, description, category_id, category_name, result))
+                    continue
+                if event == 'error':
+                    metrics.incr('cascade.llm_failures')
+                yield frame
+        except Exception as e:
+            print(f"AI analysis stream failed: {e}")
+            metrics.incr('cascade.llm_failures')
+            yield sse_frame('error', {'detail': 'AI analysis unavailable'})
+
+
+class AIDisputeSummaryStreamView(AsyncAPIView):
+    """
+    Dispute summary previewed as Server-Sent Events before the dispute is
+    raised, proxied from ai_service's /ai/summarize-dispute/stream (same
+    events as the request analysis stream). Only the job's customer or
+    provider may ask. The result is cached, so raising the same dispute
+    stores it instead of summarizing again (see api.disputes).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [JSONRenderer, EventStreamRenderer]
+
+    async def post(self, request, *args, **kwargs):
+        from .disputes import dispute_job, summary_payload
+        data = await self.data(request)
+        reason = str(data.get('reason', '')).strip()
+        if not reason:
+            return Response({'error': 'Reason is required'}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        job = await sync_to_async(dispute_job)(user, data.get('job_id'))
+        return event_stream(self.events(user.id, job.id, reason, summary_payload(job, reason, user.role)))
+
+    async def events(self, user_id, job_id, reason, payload):
+        from .disputes import remember_summary
+        yield sse_frame('start', {})
+        try:
+            async for event, data, frame in upstream_events('/ai/summarize-dispute/stream', payload):
+                if event == 'result':
+                    await sync_to_async(remember_summary)(user_id, job_id, reason, json.loads(data))
+                elif event == 'error':
+                    metrics.incr('disputes.summary_failures')
+                yield frame
+        except Exception as e:
+            print(f"Dispute summary stream failed: {e}")
+            metrics.incr('disputes.summary_failures')
+            yield sse_frame('error', {'detail': 'AI summary unavailable'})
@@ -0,0 +1,12 @@
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import metrics
+
+
+class MetricsView(APIView):
+    """Per-process operational counters and gauges (admin only)"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
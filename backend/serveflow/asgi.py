@@ -13,11 +13,12 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
 from api.middleware_channels import TokenAuthMiddleware
+from api.notifications import NotificationBusMiddleware
 import api.routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "serveflow.settings")
 
-application = ProtocolTypeRouter({
+application = NotificationBusMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": AllowedHostsOriginValidator(
         TokenAuthMiddleware(
@@ -26,4 +27,4 @@ application = ProtocolTypeRouter({
             )
         )
     ),
-})
+}))
@@ -53,7 +53,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "serveflow.middleware.AsyncWhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -101,12 +101,21 @@ ASGI_APPLICATION = "serveflow.asgi.application"
 # Channels configuration
 REDIS_URL = os.environ.get('REDIS_URL')
 
+# Websocket connections (see api/connections.py)
+WS_PING_INTERVAL = float(os.environ.get('WS_PING_INTERVAL', 25))
+WS_IDLE_TIMEOUT = float(os.environ.get('WS_IDLE_TIMEOUT', 75))  # Evict after ~3 unanswered pings
+WS_GROUP_EXPIRY = int(os.environ.get('WS_GROUP_EXPIRY', 3600))  # Redis drops memberships not refreshed in this long
+PRESENCE_TTL = float(os.environ.get('PRESENCE_TTL', 60))  # Refreshed every WS_PING_INTERVAL while connected
+TYPING_TTL = float(os.environ.get('TYPING_TTL', 6))
+TYPING_THROTTLE = float(os.environ.get('TYPING_THROTTLE', 2))  # At most one typing start per connection per this many seconds
+
 if REDIS_URL:
     CHANNEL_LAYERS = {
         "default": {
             "BACKEND": "channels_redis.core.RedisChannelLayer",
             "CONFIG": {
                 "hosts": [REDIS_URL],
+                "group_expiry": WS_GROUP_EXPIRY,
             },
         },
     }
@@ -117,6 +126,15 @@ else:
         },
     }
 
+# Shared cache for ephemeral state (chat presence); per-process LocMem without Redis
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+    }
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -171,6 +189,75 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# AI image preprocessing (uploads are downsampled before vision analysis)
+AI_IMAGE_MAX_EDGE = int(os.environ.get('AI_IMAGE_MAX_EDGE', 1536))
+AI_IMAGE_FORMAT = os.environ.get('AI_IMAGE_FORMAT', 'JPEG')  # JPEG or WEBP
+AI_IMAGE_QUALITY = int(os.environ.get('AI_IMAGE_QUALITY', 85))
+AI_IMAGE_WORKERS = int(os.environ.get('AI_IMAGE_WORKERS', 2))  # 0 = preprocess inline
+AI_IMAGE_PREPROCESS_TIMEOUT = float(os.environ.get('AI_IMAGE_PREPROCESS_TIMEOUT', 20))
+AI_IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get('AI_IMAGE_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+# Unreferenced temp/analysis_* files expire after this many seconds
+AI_TEMP_FILE_TTL = int(os.environ.get('AI_TEMP_FILE_TTL', 24 * 60 * 60))
+AI_TEMP_REAP_INTERVAL = int(os.environ.get('AI_TEMP_REAP_INTERVAL', 60 * 60))  # 0 = cron only (reap_temp_media)
+# Max Hamming distance between dHashes treated as the same photo (-1 disables dedup)
+AI_IMAGE_DEDUP_DISTANCE = int(os.environ.get('AI_IMAGE_DEDUP_DISTANCE', 6))
+
+# Gemini key pool (per-key clients, cooldowns, latency EWMA, hedging)
+GEMINI_API_BASE_URL = os.environ.get('GEMINI_API_BASE_URL', 'https://generativelanguage.googleapis.com')
+GEMINI_VISION_MODEL = os.environ.get('GEMINI_VISION_MODEL', 'gemini-1.5-flash')
+AI_REQUEST_TIMEOUT = float(os.environ.get('AI_REQUEST_TIMEOUT', 30))
+AI_KEY_COOLDOWN_SECONDS = float(os.environ.get('AI_KEY_COOLDOWN_SECONDS', 60))
+AI_KEY_DEFAULT_LATENCY_MS = float(os.environ.get('AI_KEY_DEFAULT_LATENCY_MS', 3000))
+AI_KEY_EWMA_ALPHA = float(os.environ.get('AI_KEY_EWMA_ALPHA', 0.2))
+AI_HEDGE_ENABLED = os.environ.get('AI_HEDGE_ENABLED', 'True').lower() == 'true'
+AI_HEDGE_PERCENTILE = float(os.environ.get('AI_HEDGE_PERCENTILE', 95))
+AI_HEDGE_MIN_SAMPLES = int(os.environ.get('AI_HEDGE_MIN_SAMPLES', 20))
+# Latency the client should emulate for simulated (no-AI) analyses; the server never sleeps
+AI_SIMULATED_LATENCY_MS = int(os.environ.get('AI_SIMULATED_LATENCY_MS', 1500))
+
+# Internal services (pooled keep-alive clients with circuit breakers, see api.services)
+AI_SERVICE_URL = os.environ.get('AI_SERVICE_URL', 'http://localhost:8001')
+MATCHING_SERVICE_URL = os.environ.get('MATCHING_SERVICE_URL', 'http://localhost:8002')
+SERVICE_CONNECT_TIMEOUT = float(os.environ.get('SERVICE_CONNECT_TIMEOUT', 0.5))
+SERVICE_POOL_SIZE = int(os.environ.get('SERVICE_POOL_SIZE', 20))  # Keep-alive connections per service
+SERVICE_CIRCUIT_FAILURES = int(os.environ.get('SERVICE_CIRCUIT_FAILURES', 5))
+SERVICE_CIRCUIT_RESET_SECONDS = float(os.environ.get('SERVICE_CIRCUIT_RESET_SECONDS', 30))
+AI_ANALYZE_DEADLINE = float(os.environ.get('AI_ANALYZE_DEADLINE', 5))
+AI_BATCH_DEADLINE = float(os.environ.get('AI_BATCH_DEADLINE', 300))
+
+# Notification replay (per-user sequence, see api.notifications.record_notification)
+NOTIFICATION_RETENTION = int(os.environ.get('NOTIFICATION_RETENTION', 200))  # Newest kept per user
+NOTIFICATION_TRIM_EVERY = int(os.environ.get('NOTIFICATION_TRIM_EVERY', 20))
+NOTIFICATION_COALESCE_MS = float(os.environ.get('NOTIFICATION_COALESCE_MS', 50))  # One frame per user per window
+NOTIFICATION_MAX_BATCH = int(os.environ.get('NOTIFICATION_MAX_BATCH', 50))
+BROADCAST_CELL_DEGREES = float(os.environ.get('BROADCAST_CELL_DEGREES', 0.5))  # New requests reach the 3x3 cells around them
+
+# Chat persistence (write-behind batching and its durability guarantees, see api.chat)
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', 'True').lower() == 'true'
+CHAT_FLUSH_INTERVAL_MS = float(os.environ.get('CHAT_FLUSH_INTERVAL_MS', 20))
+CHAT_FLUSH_MAX_MESSAGES = int(os.environ.get('CHAT_FLUSH_MAX_MESSAGES', 100))
+CHAT_FLUSH_RETRIES = int(os.environ.get('CHAT_FLUSH_RETRIES', 3))
+CHAT_MAX_PENDING = int(os.environ.get('CHAT_MAX_PENDING', 10000))
+
+# Provider matching (see api.matching): 'local', or 'remote' to rank with
+# matching_service's stored providers (fill it with manage.py sync_matching_service).
+# 'auto' is an alias of 'remote'; MATCHING_REMOTE_MIN_PROVIDERS is no longer read.
+MATCHING_BACKEND = os.environ.get('MATCHING_BACKEND', 'local')
+MATCHING_DEADLINE = float(os.environ.get('MATCHING_DEADLINE', 2))
+
+# Request analysis cascade (local classifier first, ai_service when unsure)
+REQUEST_CLASSIFIER_PATH = os.environ.get('REQUEST_CLASSIFIER_PATH', str(BASE_DIR / 'request_classifier.json'))
+AI_CASCADE_THRESHOLD = float(os.environ.get('AI_CASCADE_THRESHOLD', 0.9))
+AI_CASCADE_MIN_SAMPLES = int(os.environ.get('AI_CASCADE_MIN_SAMPLES', 50))  # LLM-labelled requests before answering locally
+AI_STREAM_TIMEOUT = float(os.environ.get('AI_STREAM_TIMEOUT', 60))  # Max gap between streamed chunks
+AI_STREAM_RESULT_TTL = int(os.environ.get('AI_STREAM_RESULT_TTL', 600))  # Streamed previews reused on create
+
+# Historical price/duration index (api.pricing)
+PRICE_GEO_CELL_DEGREES = float(os.environ.get('PRICE_GEO_CELL_DEGREES', 0.25))  # ~25 km cells
+PRICE_INDEX_MIN_SAMPLES = int(os.environ.get('PRICE_INDEX_MIN_SAMPLES', 5))  # Per level before falling back
+PRICE_INDEX_REFRESH_SECONDS = float(os.environ.get('PRICE_INDEX_REFRESH_SECONDS', 60))
+PRICE_INDEX_REBUILD_SECONDS = float(os.environ.get('PRICE_INDEX_REBUILD_SECONDS', 3600))  # Drops samples changed elsewhere
+
 # Email Configuration (SMTP)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend' if not DEBUG else 'django.core.mail.backends.console.EmailBackend'
 EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
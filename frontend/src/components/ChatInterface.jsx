@@ -10,6 +10,10 @@ const ChatInterface = ({ jobId, otherUser, isOpen, onClose }) => {
     const [newMessage, setNewMessage] = useState('');
     const [loading, setLoading] = useState(true);
     const [socket, setSocket] = useState(null);
+    const [otherOnline, setOtherOnline] = useState(false);
+    const [otherTyping, setOtherTyping] = useState(false);
+    const typingTimeoutRef = useRef(null);
+    const typingSentRef = useRef(0);
     const bottomRef = useRef(null);
     const wsRef = useRef(null);
 
@@ -20,8 +24,10 @@ const ChatInterface = ({ jobId, otherUser, isOpen, onClose }) => {
         // Fetch history
         const fetchHistory = async () => {
             try {
-                const res = await api.get(`messages/?job_id=${jobId}`);
-                setMessages(res.data);
+                // Latest page of the conversation; older pages via next_before
+                const res = await api.get(`messages/history/?job_id=${jobId}`);
+                setMessages(res.data.results);
+                api.post('messages/mark_read/', { job_id: jobId }).catch(() => {});
                 setLoading(false);
                 setTimeout(scrollToBottom, 100);
             } catch (err) {
@@ -44,7 +50,23 @@ const ChatInterface = ({ jobId, otherUser, isOpen, onClose }) => {
 
         ws.onmessage = (event) => {
             const data = JSON.parse(event.data);
+            if (data.type === 'ping') {
+                ws.send(JSON.stringify({ type: 'pong' }));
+                return;
+            }
+            if (data.type === 'presence') {
+                if (data.user_id === user.id) return;
+                if ('online' in data) setOtherOnline(data.online);
+                if ('typing' in data) {
+                    setOtherTyping(data.typing);
+                    // Starts are repeated while typing; drop the indicator if they stop coming
+                    clearTimeout(typingTimeoutRef.current);
+                    if (data.typing) typingTimeoutRef.current = setTimeout(() => setOtherTyping(false), 6000);
+                }
+                return;
+            }
             if (data.type === 'chat_message') {
+                if (data.sender_id !== user.id) setOtherTyping(false);
                 setMessages(prev => [...prev, {
                     content: data.message,
                     sender: { id: data.sender_id }, // minimal sender info
@@ -61,6 +83,7 @@ const ChatInterface = ({ jobId, otherUser, isOpen, onClose }) => {
         };
 
         return () => {
+            clearTimeout(typingTimeoutRef.current);
             if (wsRef.current) {
                 wsRef.current.close();
             }
@@ -77,6 +100,7 @@ const ChatInterface = ({ jobId, otherUser, isOpen, onClose }) => {
 
         const msg = newMessage;
         setNewMessage(''); // optimistic clear
+        typingSentRef.current = 0;
 
         // Send via WebSocket
         socket.send(JSON.stringify({
@@ -84,6 +108,20 @@ const ChatInterface = ({ jobId, otherUser, isOpen, onClose }) => {
         }));
     };
 
+    const handleTyping = (value) => {
+        setNewMessage(value);
+        if (!socket) return;
+        const now = Date.now();
+        if (!value) {
+            if (typingSentRef.current) socket.send(JSON.stringify({ type: 'typing', typing: false }));
+            typingSentRef.current = 0;
+        } else if (now - typingSentRef.current > 2000) {
+            // The server throttles too; this just avoids sending a frame per keystroke
+            socket.send(JSON.stringify({ type: 'typing', typing: true }));
+            typingSentRef.current = now;
+        }
+    };
+
     if (!isOpen) return null;
 
     return (
@@ -97,7 +135,10 @@ const ChatInterface = ({ jobId, otherUser, isOpen, onClose }) => {
                         </div>
                         <div>
                             <h3 className="font-bold text-white">{otherUser?.username || 'Chat'}</h3>
-                            <p className="text-xs text-blue-400">Job #{jobId}</p>
+                            <p className="text-xs text-blue-400">
+                                Job #{jobId}
+                                {otherTyping ? ' · typing…' : otherOnline ? ' · online' : ''}
+                            </p>
                         </div>
                     </div>
                     <button onClick={onClose} className="p-2 hover:bg-white/10 rounded-full transition-colors text-slate-400 hover:text-white">
@@ -137,7 +178,7 @@ const ChatInterface = ({ jobId, otherUser, isOpen, onClose }) => {
                         <input
                             type="text"
                             value={newMessage}
-                            onChange={(e) => setNewMessage(e.target.value)}
+                            onChange={(e) => handleTyping(e.target.value)}
                             placeholder="Type a message..."
                             className="flex-1 bg-slate-950 border border-slate-700 rounded-xl px-4 py-2 text-white focus:outline-none focus:border-blue-500 focus:ring-1 focus:ring-blue-500 transition-all placeholder:text-slate-600"
                         />
@@ -13,6 +13,8 @@ export const WebSocketProvider = ({ children }) => {
 
     // Ref to prevent multiple connections
     const wsRef = useRef(null);
+    // Last notification seq seen; reconnects ask the server to replay anything after it
+    const lastSeqRef = useRef(null);
 
     useEffect(() => {
         // Connect only if we have a token and user
@@ -31,7 +33,8 @@ export const WebSocketProvider = ({ children }) => {
     const connect = () => {
         if (wsRef.current) return; // Already connecting/connected
 
-        const wsUrl = (import.meta.env.VITE_WS_URL || `ws://${window.location.hostname}:8000/ws/notifications/`) + `?token=${token}`;
+        const resume = lastSeqRef.current !== null ? `&last_seq=${lastSeqRef.current}` : '';
+        const wsUrl = (import.meta.env.VITE_WS_URL || `ws://${window.location.hostname}:8000/ws/notifications/`) + `?token=${token}${resume}`;
         console.log("Connecting to WebSocket:", wsUrl);
 
         const ws = new WebSocket(wsUrl);
@@ -46,8 +49,29 @@ export const WebSocketProvider = ({ children }) => {
         ws.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
+                if (data.type === 'ping') {
+                    // Server heartbeat; unanswered pings get the connection evicted
+                    ws.send(JSON.stringify({ type: 'pong' }));
+                    return;
+                }
                 console.log("WebSocket message:", data);
+                if (typeof data.seq === 'number') {
+                    lastSeqRef.current = data.seq;
+                }
+                if (data.type === 'notifications_synced') {
+                    // Replay finished; on a gap some missed events were trimmed, so screens should refetch
+                    if (data.gap) setLastMessage(data);
+                    return;
+                }
                 setLastMessage(data);
+                if (data.type === 'batch') {
+                    // Several notifications coalesced by the server into one frame
+                    data.events.forEach((item, i) => {
+                        if (typeof item.seq === 'number') lastSeqRef.current = item.seq;
+                        handleNotification(item, i === 0);
+                    });
+                    return;
+                }
                 handleNotification(data);
             } catch (e) {
                 console.error("WebSocket message error:", e);
@@ -79,13 +103,15 @@ export const WebSocketProvider = ({ children }) => {
         }
     };
 
-    const handleNotification = (data) => {
+    const handleNotification = (data, withSound = true) => {
         // Handle different notification types
         // Expected payload: { message: "...", type: "...", payload: {...} }
         const { message, type } = data;
 
-        // Play sound for all real-time events
-        import('../utils/sound').then(mod => mod.playNotificationSound());
+        // Play sound for live events (not for ones replayed after a reconnect)
+        if (withSound && !data.replayed) {
+            import('../utils/sound').then(mod => mod.playNotificationSound());
+        }
 
         switch (type) {
             case 'request_update':
@@ -6,7 +6,7 @@ import {
     ScanLine, Lock, Eye, Check
 } from 'lucide-react';
 import { useToast } from '../context/ToastContext';
-import api from '../api';
+import api, { streamEvents } from '../api';
 
 const CreateRequest = () => {
     const navigate = useNavigate();
@@ -27,6 +27,8 @@ const CreateRequest = () => {
     const [fetchingRecs, setFetchingRecs] = useState(false);
     const [diagnosis, setDiagnosis] = useState(null);
     const [diagnosing, setDiagnosing] = useState(false);
+    const [analysisPreview, setAnalysisPreview] = useState(null);
+    const analysisAbort = useRef(null);
 
     // Image AI States
     const [scanning, setScanning] = useState(false);
@@ -87,7 +89,7 @@ const CreateRequest = () => {
                 setDiagnosis({ summary: analysis.summary });
                 setStep(2); // Jump to verification
                 success("Vision Analysis Complete: Protocol Secured.");
-            }, 800);
+            }, 800 + (res.data.simulated_latency_ms || 0)); // simulated results are paced client-side
 
         } catch (err) {
             clearInterval(interval);
@@ -149,12 +151,44 @@ const CreateRequest = () => {
         }
     };
 
+    // Stream the request analysis while recommendations load; the backend
+    // reuses the final result when the request is submitted
+    const streamAnalysis = async () => {
+        analysisAbort.current?.abort();
+        const controller = new AbortController();
+        analysisAbort.current = controller;
+        setAnalysisPreview({ fields: {}, done: false });
+        try {
+            await streamEvents('requests/ai-analyze-stream/', {
+                title: formData.title,
+                description: formData.description,
+                category_id: formData.category
+            }, (event, data) => {
+                if (event === 'field') {
+                    setAnalysisPreview(prev => ({ ...prev, fields: { ...prev.fields, ...data } }));
+                } else if (event === 'result') {
+                    setAnalysisPreview({ fields: data, done: true });
+                } else if (event === 'error') {
+                    setAnalysisPreview(prev => ({ ...prev, done: true }));
+                }
+            }, controller.signal);
+        } catch (err) {
+            if (err.name !== 'AbortError') {
+                console.error('Analysis stream failed:', err);
+                setAnalysisPreview(null);
+            }
+        }
+    };
+
+    useEffect(() => () => analysisAbort.current?.abort(), []);
+
     // Trigger recommendations when entering Step 4
     const nextStep = () => {
         if (step < 4) {
             setStep(step + 1);
             if (step === 3) { // Moving to review step
                 fetchRecommendations();
+                streamAnalysis();
             }
         }
     };
@@ -449,6 +483,32 @@ const CreateRequest = () => {
                                 <p className="text-slate-400">Optimized provider matches based on protocol analysis.</p>
                             </div>
 
+                            {analysisPreview && (
+                                <div className="p-5 bg-slate-900/60 border border-blue-500/20 rounded-2xl">
+                                    <div className="flex items-center gap-2 mb-2 text-xs font-bold uppercase tracking-wider text-blue-400">
+                                        <Wand2 className={`w-4 h-4 ${analysisPreview.done ? '' : 'animate-pulse'}`} />
+                                        Protocol Analysis
+                                    </div>
+                                    <p className="text-slate-300">
+                                        {analysisPreview.fields.summary || 'Analyzing your request...'}
+                                    </p>
+                                    {(analysisPreview.fields.urgency || analysisPreview.fields.estimated_duration) && (
+                                        <div className="mt-3 flex gap-2 text-[10px] font-bold uppercase tracking-wider">
+                                            {analysisPreview.fields.urgency && (
+                                                <span className="px-2 py-1 bg-purple-500/10 text-purple-300 rounded-md border border-purple-500/20">
+                                                    {analysisPreview.fields.urgency} urgency
+                                                </span>
+                                            )}
+                                            {analysisPreview.fields.estimated_duration && (
+                                                <span className="px-2 py-1 bg-blue-500/10 text-blue-300 rounded-md border border-blue-500/20">
+                                                    ~{analysisPreview.fields.estimated_duration}
+                                                </span>
+                                            )}
+                                        </div>
+                                    )}
+                                </div>
+                            )}
+
                             {fetchingRecs ? (
                                 <div className="flex flex-col items-center justify-center py-12 space-y-4">
                                     <div className="w-16 h-16 border-4 border-blue-500 border-t-transparent rounded-full animate-spin"></div>
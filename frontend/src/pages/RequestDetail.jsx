@@ -255,11 +255,29 @@ const RequestDetail = () => {
                                 <h3 className="font-semibold text-blue-900 dark:text-blue-100 mb-2 flex items-center gap-2">
                                     <AlertCircle className="w-4 h-4" /> AI Analysis
                                 </h3>
-                                <p className="text-sm text-blue-800 dark:text-blue-200">
-                                    {typeof request.ai_summary === 'string'
-                                        ? request.ai_summary
-                                        : JSON.stringify(request.ai_summary)}
-                                </p>
+                                {typeof request.ai_summary === 'string' ? (
+                                    <p className="text-sm text-blue-800 dark:text-blue-200">{request.ai_summary}</p>
+                                ) : (
+                                    <div className="text-sm text-blue-800 dark:text-blue-200 space-y-2">
+                                        {request.ai_summary.summary && <p>{request.ai_summary.summary}</p>}
+                                        <div className="flex flex-wrap gap-2 text-xs font-medium">
+                                            {request.ai_summary.urgency && (
+                                                <span className="px-2 py-0.5 rounded bg-blue-100 dark:bg-blue-900/40 capitalize">Urgency: {request.ai_summary.urgency}</span>
+                                            )}
+                                            {request.ai_summary.complexity && (
+                                                <span className="px-2 py-0.5 rounded bg-blue-100 dark:bg-blue-900/40 capitalize">Complexity: {request.ai_summary.complexity}</span>
+                                            )}
+                                            {request.ai_summary.estimated_duration && (
+                                                <span className="px-2 py-0.5 rounded bg-blue-100 dark:bg-blue-900/40">Est. {request.ai_summary.estimated_duration}</span>
+                                            )}
+                                        </div>
+                                        {request.ai_summary.key_points?.length > 0 && (
+                                            <ul className="list-disc list-inside">
+                                                {request.ai_summary.key_points.map((point, i) => <li key={i}>{point}</li>)}
+                                            </ul>
+                                        )}
+                                    </div>
+                                )}
                             </div>
                         )}
                     </div>
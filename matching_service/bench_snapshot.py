@@ -0,0 +1,110 @@
+"""
+Startup time and memory of the provider snapshot at large provider counts.
+
+For each size: build the columns from provider records (what rebuilding the
+state from a backend sync costs), write the snapshot, then start --workers
+fresh processes that each map it, touch every column and run a query, the
+way uvicorn workers would. Reports per-worker load time, RSS and PSS
+(proportional set size, shared pages split between the processes that map
+them), next to the same workers holding private in-memory copies.
+
+    python bench_snapshot.py --providers 100000,1000000 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+import numpy as np
+from store import Snapshot, build_columns, write_snapshot
+
+
+def synthetic_providers(count, categories, seed):
+    rng = np.random.default_rng(seed)
+    known = rng.random(count) > 0.05
+    lat = np.where(known, rng.normal(40.7, 2.0, count), np.nan)
+    lon = np.where(known, rng.normal(-74.0, 2.0, count), np.nan)
+    rating = np.round(rng.uniform(0, 5, count), 2)
+    jobs = rng.exponential(15, count).astype(int)
+    statuses = rng.choice(["available", "busy", "offline"], count)
+    first = rng.integers(0, categories, count)
+    second = rng.integers(0, categories, count)
+    return [
+        {"provider_id": i + 1, "latitude": None if np.isnan(lat[i]) else float(lat[i]),
+         "longitude": None if np.isnan(lon[i]) else float(lon[i]), "rating": float(rating[i]),
+         "completed_jobs": int(jobs[i]), "availability_status": str(statuses[i]),
+         "categories": [str(first[i]), str(second[i])]}
+        for i in range(count)
+    ]
+
+
+def memory_kb():
+    stats = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                stats[parts[0][:-1].lower()] = int(parts[1])
+    return stats
+
+
+def worker(path, private, barrier, results):
+    start = time.perf_counter()
+    snapshot = Snapshot(path)
+    if private:
+        # What a worker holding its own copy pays: every column in anonymous memory
+        snapshot.columns = {name: np.array(column) for name, column in snapshot.columns.items()}
+    load_ms = (time.perf_counter() - start) * 1000
+    for column in snapshot.columns.values():
+        column.sum()  # Touch every page, as a busy worker eventually would
+    start = time.perf_counter()
+    snapshot.match("1", 40.7, -74.0, None, 10)
+    query_ms = (time.perf_counter() - start) * 1000
+    barrier.wait()  # Measure while every worker has the snapshot mapped
+    results.put({"load_ms": load_ms, "query_ms": query_ms, **memory_kb()})
+    barrier.wait()
+
+
+def run_workers(path, count, private):
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(count), context.Queue()
+    processes = [context.Process(target=worker, args=(path, private, barrier, results)) for _ in range(count)]
+    for process in processes:
+        process.start()
+    stats = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--providers", default="100000,1000000")
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dir", default=tempfile.gettempdir())
+    args = parser.parse_args()
+
+    for count in (int(n) for n in args.providers.split(",")):
+        path = os.path.join(args.dir, f"bench_snapshot_{count}.bin")
+        providers = synthetic_providers(count, args.categories, seed=count)
+        start = time.perf_counter()
+        columns, header = build_columns(providers)
+        build_s = time.perf_counter() - start
+        start = time.perf_counter()
+        write_snapshot(path, columns, header)
+        write_s = time.perf_counter() - start
+        size_mb = os.path.getsize(path) / 2 ** 20
+        print(f"{count:>9} providers: rebuild {build_s:.2f}s, write {write_s:.2f}s, snapshot {size_mb:.1f} MB")
+
+        for label, private in (("mapped", False), ("private", True)):
+            stats = run_workers(path, args.workers, private)
+            print(f"  {label:>7} x{args.workers}: load {max(s['load_ms'] for s in stats):7.1f} ms  "
+                  f"first query {max(s['query_ms'] for s in stats):6.1f} ms  "
+                  f"RSS/worker {max(s['rss'] for s in stats) / 1024:6.1f} MB  "
+                  f"PSS total {sum(s['pss'] for s in stats) / 1024:7.1f} MB")
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
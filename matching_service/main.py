@@ -2,7 +2,9 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
+import heapq
 import math
+from store import NoSnapshot, store
 
 app = FastAPI(title="Provider Matching Service")
 
@@ -17,31 +19,52 @@ app.add_middleware(
 
 class Provider(BaseModel):
     provider_id: int
-    latitude: float
-    longitude: float
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
     rating: float
     completed_jobs: int
     availability_status: str
     categories: List[str]
 
 class MatchRequest(BaseModel):
-    request_id: int
+    request_id: Optional[int] = None
     category: str
-    latitude: float
-    longitude: float
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
     urgency: str = "medium"
     providers: List[Provider]
+    limit: int = 10
 
 class MatchResult(BaseModel):
     provider_id: int
     match_score: float
-    distance: float
+    distance: Optional[float] = None
     rating: float
     availability: str
     reason: str
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+class ProviderSync(BaseModel):
+    providers: List[Provider] = []
+    removed: List[int] = []
+    replace: bool = False  # True: the payload is the complete provider set
+
+class NearbyRequest(BaseModel):
+    category: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    availability: Optional[str] = None
+    limit: int = 10
+
+class NearbyResponse(BaseModel):
+    total: int
+    snapshot_version: int
+    matches: List[MatchResult]
+
+def calculate_distance(lat1, lon1, lat2, lon2) -> Optional[float]:
     """Calculate distance between two coordinates in kilometers using Haversine formula"""
+    if not all([lat1, lon1, lat2, lon2]):
+        return None
+
     R = 6371  # Earth's radius in kilometers
     
     dlat = math.radians(lat2 - lat1)
@@ -56,33 +79,62 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     
     return round(distance, 2)
 
-def calculate_match_score(provider: Provider, request: MatchRequest, distance: float) -> float:
+def calculate_match_score(provider: Provider, distance: Optional[float]) -> float:
     """
-    Calculate match score based on:
-    - Distance (40%)
-    - Rating (30%)
-    - Experience (20%)
-    - Availability (10%)
+    Score (0-100) of a provider in the requested category. Same table as the
+    backend's api.utils.match_points; keep the two in sync.
+    - Distance: 0-40 (<=2km 40, <=5km 35, <=10km 25, <=20km 15, <=50km 5)
+    - Rating: 0-35 (rating / 5 * 35)
+    - Availability: 0-15 (available 15, busy 5)
+    - Experience: 0-10 (>=50 jobs 10, >=20 7, >=10 5, >=5 3)
     """
-    # Distance score (closer is better, max 50km)
-    distance_score = max(0, 1 - (distance / 50)) * 0.4
-    
-    # Rating score (0-5 scale)
-    rating_score = (provider.rating / 5) * 0.3
-    
-    # Experience score
-    experience_score = min(1, provider.completed_jobs / 100) * 0.2
-    
-    # Availability score
-    availability_score = 0.1 if provider.availability_status == "available" else 0
-    
-    # Urgency bonus
-    urgency_bonus = 0.1 if request.urgency == "high" and distance < 10 else 0
-    
-    total_score = (distance_score + rating_score + experience_score + 
-                   availability_score + urgency_bonus)
-    
-    return round(min(1.0, total_score), 3)
+    score = 0
+
+    if distance is not None:
+        if distance <= 2:
+            score += 40
+        elif distance <= 5:
+            score += 35
+        elif distance <= 10:
+            score += 25
+        elif distance <= 20:
+            score += 15
+        elif distance <= 50:
+            score += 5
+
+    if provider.rating:
+        score += (provider.rating / 5.0) * 35
+
+    if provider.availability_status == "available":
+        score += 15
+    elif provider.availability_status == "busy":
+        score += 5
+
+    if provider.completed_jobs >= 50:
+        score += 10
+    elif provider.completed_jobs >= 20:
+        score += 7
+    elif provider.completed_jobs >= 10:
+        score += 5
+    elif provider.completed_jobs >= 5:
+        score += 3
+
+    return round(score, 2)
+
+def match_reason(score: float) -> str:
+    if score > 80:
+        return "Excellent match: High rating, nearby, available"
+    if score > 60:
+        return "Good match: Experienced provider in your area"
+    if score > 40:
+        return "Acceptable match: Available for your service"
+    return "Available provider"
+
+@app.on_event("startup")
+def load_snapshot():
+    # Maps the snapshot read-only; nothing is parsed or copied, so this is fast at any size
+    snapshot = store.current()
+    print(f"Provider snapshot: {snapshot.header['count'] if snapshot else 0} providers from {store.path}")
 
 @app.get("/")
 async def root():
@@ -92,55 +144,86 @@ async def root():
 async def match_providers(request: MatchRequest):
     """
     Match providers to a service request
-    Returns ranked list of providers with match scores
+    Returns the top `limit` providers in the category, best first
     """
     if not request.providers:
         raise HTTPException(status_code=400, detail="No providers available")
     
-    matches = []
+    scored = []
     
     for provider in request.providers:
         # Check category match
         if request.category not in provider.categories:
             continue
         
-        # Calculate distance
         distance = calculate_distance(
             request.latitude, request.longitude,
             provider.latitude, provider.longitude
         )
-        
-        # Skip if too far (> 100km)
-        if distance > 100:
-            continue
-        
-        # Calculate match score
-        score = calculate_match_score(provider, request, distance)
-        
-        # Determine reason
-        if score > 0.8:
-            reason = "Excellent match: High rating, nearby, available"
-        elif score > 0.6:
-            reason = "Good match: Experienced provider in your area"
-        elif score > 0.4:
-            reason = "Acceptable match: Available for your service"
-        else:
-            reason = "Available provider"
-        
-        matches.append(MatchResult(
+        scored.append((calculate_match_score(provider, distance), provider, distance))
+    
+    # Best score first, ties by provider id (same order as the backend's local scorer)
+    top = heapq.nsmallest(request.limit, scored, key=lambda s: (-s[0], s[1].provider_id))
+    
+    return [
+        MatchResult(
             provider_id=provider.provider_id,
             match_score=score,
             distance=distance,
             rating=provider.rating,
             availability=provider.availability_status,
-            reason=reason
-        ))
-    
-    # Sort by match score (descending)
-    matches.sort(key=lambda x: x.match_score, reverse=True)
-    
-    # Return top 10 matches
-    return matches[:10]
+            reason=match_reason(score)
+        )
+        for score, provider, distance in top
+    ]
+
+@app.post("/providers/sync")
+def sync_providers(payload: ProviderSync):
+    """
+    Update the stored provider set (persisted as a memory-mapped snapshot, see
+    store.py). Upserts by default; replace=True swaps in the payload as the
+    complete set. Upserts before the first replace are rejected with 409.
+    """
+    providers = [p.model_dump() for p in payload.providers]
+    if payload.replace:
+        snapshot = store.replace(providers)
+    else:
+        try:
+            snapshot = store.upsert(providers, payload.removed)
+        except NoSnapshot as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    return {"count": snapshot.header["count"], "categories": len(snapshot.header["categories"]),
+            "snapshot_version": snapshot.version}
+
+@app.post("/match/nearby", response_model=NearbyResponse)
+def match_nearby(request: NearbyRequest):
+    """
+    Rank stored providers in a category for a location, same scores as
+    /match/providers without sending the providers along
+    """
+    snapshot = store.current()
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="No provider snapshot yet, sync providers first")
+    total, top = snapshot.match(request.category, request.latitude, request.longitude,
+                                request.availability, request.limit)
+    return NearbyResponse(
+        total=total,
+        snapshot_version=snapshot.version,
+        matches=[
+            MatchResult(provider_id=provider_id, match_score=score, distance=distance,
+                        rating=rating, availability=availability, reason=match_reason(score))
+            for provider_id, score, distance, rating, availability in top
+        ],
+    )
+
+@app.get("/providers/snapshot")
+def snapshot_info():
+    snapshot = store.current()
+    if snapshot is None:
+        return {"loaded": False, "path": store.path}
+    return {"loaded": True, "path": store.path, "snapshot_version": snapshot.version,
+            "bytes": snapshot.stat.st_size, "count": snapshot.header["count"],
+            "categories": len(snapshot.header["categories"]), "grid_degrees": snapshot.header["grid_degrees"]}
 
 @app.get("/health")
 async def health_check():
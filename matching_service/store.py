@@ -0,0 +1,370 @@
+"""
+Provider state for matching, kept as columnar arrays in one snapshot file.
+
+Layout: an 8-byte magic, the header length, a JSON header (category keys,
+status names, column dtypes/offsets) and then every column as a raw,
+64-byte aligned array. Loading maps the file read-only and wraps each column
+with np.frombuffer, so startup does no parsing and no copying, and every
+uvicorn worker on the host shares the same page-cache pages instead of each
+holding a private copy. Writes go to a temp file that is fsynced and renamed
+over the old snapshot; workers notice the new inode on their next request
+and remap, while requests already running keep the old mapping.
+
+Columns (providers sorted by id):
+  provider_id, latitude, longitude (NaN when unknown), rating,
+  completed_jobs, status (index into the header's status names), base_points
+  (rating + availability + experience points, precomputed).
+Spatial index (one entry per provider/category pair, sorted by category,
+then grid cell, then provider):
+  member_row, member_cell, plus category_offsets delimiting each category.
+Cells in a category are contiguous and sorted, so the providers near a point
+are a few searchsorted slices; only they need a distance computed, because
+beyond NEAR_KM distance earns no points.
+"""
+import fcntl
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import numpy as np
+
+MATCHING_SNAPSHOT_PATH = os.getenv("MATCHING_SNAPSHOT_PATH", "provider_snapshot.bin")
+MATCHING_GRID_DEGREES = float(os.getenv("MATCHING_GRID_DEGREES", "0.5"))
+
+MAGIC = b"SFMATCH1"
+ALIGN = 64
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.19
+NEAR_KM = 50
+
+# Score table shared with calculate_match_score in main.py
+DISTANCE_BUCKETS = [(2, 40), (5, 35), (10, 25), (20, 15), (50, 5)]
+AVAILABILITY_POINTS = {"available": 15, "busy": 5}
+EXPERIENCE_BUCKETS = [(50, 10), (20, 7), (10, 5), (5, 3)]
+
+PROVIDER_COLUMNS = {
+    "provider_id": np.int64,
+    "latitude": np.float64,
+    "longitude": np.float64,
+    "rating": np.float64,
+    "completed_jobs": np.int32,
+    "status": np.int16,
+    "base_points": np.float64,
+}
+INDEX_COLUMNS = {
+    "member_row": np.int32,
+    "member_cell": np.int64,
+    "category_offsets": np.int64,
+}
+
+
+def cell_keys(latitude, longitude, grid_degrees):
+    """Grid cell key per point (row-major); -1 for unknown coordinates"""
+    cols = math.ceil(360 / grid_degrees)
+    known = ~(np.isnan(latitude) | np.isnan(longitude))
+    rows = np.floor((np.where(known, latitude, 0) + 90) / grid_degrees).astype(np.int64)
+    columns = np.floor((np.where(known, longitude, 0) + 180) / grid_degrees).astype(np.int64) % cols
+    return np.where(known, rows * cols + columns, -1)
+
+
+def base_points(rating, completed_jobs, status, status_names):
+    """Every score component except distance"""
+    status_points = np.array([AVAILABILITY_POINTS.get(name, 0) for name in status_names] or [0], dtype=np.float64)
+    points = np.where(rating > 0, rating / 5.0 * 35, 0.0) + status_points[status]
+    experience = np.select([completed_jobs >= threshold for threshold, _ in EXPERIENCE_BUCKETS],
+                           [points_ for _, points_ in EXPERIENCE_BUCKETS], 0)
+    return points + experience
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return np.round(EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a)), 2)
+
+
+def distance_points(distance):
+    return np.select([distance <= limit for limit, _ in DISTANCE_BUCKETS],
+                     [points for _, points in DISTANCE_BUCKETS], 0)
+
+
+def provider_columns(providers):
+    """
+    Columnar form of provider dicts (provider_id, latitude, longitude,
+    rating, completed_jobs, availability_status, categories):
+    (columns, member_rows, member_cats, categories, status_names)
+    """
+    status_names = sorted({p["availability_status"] for p in providers})
+    status_index = {name: i for i, name in enumerate(status_names)}
+    categories = sorted({str(c) for p in providers for c in p["categories"]})
+    category_index = {key: i for i, key in enumerate(categories)}
+
+    def nan_if_none(value):
+        return np.nan if value is None else value
+
+    columns = {
+        "provider_id": np.array([p["provider_id"] for p in providers], dtype=np.int64),
+        "latitude": np.array([nan_if_none(p["latitude"]) for p in providers], dtype=np.float64),
+        "longitude": np.array([nan_if_none(p["longitude"]) for p in providers], dtype=np.float64),
+        "rating": np.array([p["rating"] or 0 for p in providers], dtype=np.float64),
+        "completed_jobs": np.array([p["completed_jobs"] or 0 for p in providers], dtype=np.int32),
+        "status": np.array([status_index[p["availability_status"]] for p in providers], dtype=np.int16),
+    }
+    member_rows, member_cats = [], []
+    for row, p in enumerate(providers):
+        for key in {str(c) for c in p["categories"]}:
+            member_rows.append(row)
+            member_cats.append(category_index[key])
+    return (columns, np.array(member_rows, dtype=np.int64), np.array(member_cats, dtype=np.int64),
+            categories, status_names)
+
+
+def build_columns(providers, grid_degrees=MATCHING_GRID_DEGREES):
+    """Snapshot columns and header for a list of provider dicts (later duplicates win)"""
+    providers = list({p["provider_id"]: p for p in providers}.values())
+    return finish_columns(*provider_columns(providers), grid_degrees)
+
+
+def merge_columns(snapshot, providers, removed_ids=(), grid_degrees=MATCHING_GRID_DEGREES):
+    """
+    Snapshot columns and header for `snapshot` with `providers` added or
+    replaced and `removed_ids` dropped, without unpacking unchanged rows.
+    """
+    providers = list({p["provider_id"]: p for p in providers}.values())
+    new, new_rows, new_cats, new_categories, new_statuses = provider_columns(providers)
+    drop = np.array(sorted(set(removed_ids) | {p["provider_id"] for p in providers}), dtype=np.int64)
+    keep = ~np.isin(snapshot.provider_id, drop)
+    row_map = np.cumsum(keep) - 1
+
+    old_cats = np.repeat(np.arange(len(snapshot.header["categories"])), np.diff(snapshot.category_offsets))
+    kept_members = keep[snapshot.member_row]
+    categories = sorted(set(snapshot.header["categories"]) | set(new_categories))
+    statuses = sorted(set(snapshot.header["statuses"]) | set(new_statuses))
+
+    def recode(old_names, names):
+        index = {name: i for i, name in enumerate(names)}
+        return np.array([index[name] for name in old_names] or [0], dtype=np.int64)
+
+    columns = {name: np.concatenate([getattr(snapshot, name)[keep], new[name]])
+               for name in ("provider_id", "latitude", "longitude", "rating", "completed_jobs")}
+    columns["status"] = np.concatenate([
+        recode(snapshot.header["statuses"], statuses)[snapshot.status[keep]],
+        recode(new_statuses, statuses)[new["status"]],
+    ]).astype(np.int16)
+    member_rows = np.concatenate([row_map[snapshot.member_row[kept_members]], new_rows + int(keep.sum())])
+    member_cats = np.concatenate([
+        recode(snapshot.header["categories"], categories)[old_cats[kept_members]],
+        recode(new_categories, categories)[new_cats],
+    ])
+    return finish_columns(columns, member_rows, member_cats, categories, statuses, grid_degrees)
+
+
+def finish_columns(columns, member_rows, member_cats, categories, status_names, grid_degrees):
+    """Sort providers by id, add derived columns and the sorted spatial index"""
+    order = np.argsort(columns["provider_id"], kind="stable")
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    columns = {name: array[order] for name, array in columns.items()}
+    member_rows = position[member_rows]
+
+    columns["base_points"] = base_points(columns["rating"], columns["completed_jobs"], columns["status"], status_names)
+    cells = cell_keys(columns["latitude"], columns["longitude"], grid_degrees)[member_rows]
+    order = np.lexsort((member_rows, cells, member_cats))
+    columns["member_row"] = member_rows[order].astype(np.int32)
+    columns["member_cell"] = cells[order].astype(np.int64)
+    columns["category_offsets"] = np.searchsorted(member_cats[order], np.arange(len(categories) + 1)).astype(np.int64)
+    header = {"categories": categories, "statuses": status_names, "grid_degrees": grid_degrees,
+              "count": int(len(columns["provider_id"]))}
+    return columns, header
+
+
+def write_snapshot(path, columns, header):
+    """Write columns atomically (temp file + fsync + rename)"""
+    layout, offset = {}, 0
+    for name, dtype in {**PROVIDER_COLUMNS, **INDEX_COLUMNS}.items():
+        array = np.ascontiguousarray(columns[name], dtype=dtype)
+        columns[name] = array
+        layout[name] = [np.dtype(dtype).str, offset, int(array.size)]
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header_bytes = json.dumps({**header, "columns": layout}).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGN) * ALIGN
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+        for name, (_, column_offset, _) in layout.items():
+            f.seek(data_start + column_offset)
+            f.write(columns[name].tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """A read-only mapped snapshot; columns are zero-copy views of the file"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a provider snapshot")
+        (header_length,) = struct.unpack_from("<Q", self.buffer, len(MAGIC))
+        header_end = len(MAGIC) + 8 + header_length
+        self.header = json.loads(self.buffer[len(MAGIC) + 8:header_end])
+        data_start = -(-header_end // ALIGN) * ALIGN
+        self.columns = {
+            name: np.frombuffer(self.buffer, dtype=np.dtype(dtype), count=size, offset=data_start + offset)
+            for name, (dtype, offset, size) in self.header["columns"].items()
+        }
+        self.category_index = {key: i for i, key in enumerate(self.header["categories"])}
+        self.status_index = {name: i for i, name in enumerate(self.header["statuses"])}
+        self.cols = math.ceil(360 / self.header["grid_degrees"])
+
+    @property
+    def version(self):
+        return self.stat.st_mtime_ns
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["columns"][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def near_positions(self, lo, hi, latitude, longitude):
+        """Positions in member slice [lo, hi) whose cell may lie within NEAR_KM of the point"""
+        grid = self.header["grid_degrees"]
+        cells = self.member_cell[lo:hi]
+        lat_span = NEAR_KM / KM_PER_DEGREE
+        row_min = max(0, math.floor((latitude - lat_span + 90) / grid))
+        row_max = min(math.ceil(180 / grid) - 1, math.floor((latitude + lat_span + 90) / grid))
+        widest = math.cos(math.radians(min(89.0, abs(latitude) + lat_span)))
+        col_span = math.ceil(NEAR_KM / (KM_PER_DEGREE * widest) / grid) + 1
+        center = math.floor((longitude + 180) / grid)
+        if 2 * col_span + 1 >= self.cols:
+            segments = [(0, self.cols - 1)]
+        else:
+            first, last = (center - col_span) % self.cols, (center + col_span) % self.cols
+            segments = [(first, last)] if first <= last else [(first, self.cols - 1), (0, last)]
+
+        slices = []
+        for row in range(row_min, row_max + 1):
+            for first, last in segments:
+                start = np.searchsorted(cells, row * self.cols + first, side="left")
+                stop = np.searchsorted(cells, row * self.cols + last, side="right")
+                if stop > start:
+                    slices.append(np.arange(start, stop))
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+    def match(self, category, latitude=None, longitude=None, availability=None, limit=10):
+        """
+        (number of candidates, [(provider_id, score, distance_km or None, rating, status)])
+        best first, ties by provider id. Same scores as calculate_match_score.
+        """
+        c = self.category_index.get(str(category))
+        if c is None:
+            return 0, []
+        lo, hi = int(self.category_offsets[c]), int(self.category_offsets[c + 1])
+        rows = self.member_row[lo:hi]
+        scores = self.base_points[rows].copy()
+
+        known = bool(latitude and longitude)
+        near, near_distance = np.empty(0, dtype=np.int64), None
+        if known:
+            near = self.near_positions(lo, hi, latitude, longitude)
+            near_rows = rows[near]
+            near_distance = haversine_km(latitude, longitude, self.latitude[near_rows], self.longitude[near_rows])
+            scores[near] += distance_points(near_distance)
+        scores = np.round(scores, 2)
+
+        if availability is not None:
+            code = self.status_index.get(availability)
+            eligible = self.status[rows] == code if code is not None else np.zeros(len(rows), dtype=bool)
+            scores[~eligible] = -np.inf
+            total = int(eligible.sum())
+        else:
+            total = len(rows)
+        if not total:
+            return 0, []
+
+        k = min(limit, total)
+        if k < len(scores):
+            cutoff = np.partition(scores, len(scores) - k)[len(scores) - k]
+            picked = np.flatnonzero(scores >= cutoff)  # Includes everyone tied at the cutoff
+        else:
+            picked = np.flatnonzero(scores > -np.inf)
+        picked = picked[np.lexsort((self.provider_id[rows[picked]], -scores[picked]))][:k]
+
+        results = []
+        for position in picked.tolist():
+            row = int(rows[position])
+            distance = None
+            if known and not np.isnan(self.latitude[row]) and not np.isnan(self.longitude[row]):
+                distance = float(haversine_km(latitude, longitude, self.latitude[row], self.longitude[row]))
+            results.append((int(self.provider_id[row]), float(scores[position]), distance,
+                            float(self.rating[row]), self.header["statuses"][int(self.status[row])]))
+        return total, results
+
+
+class NoSnapshot(Exception):
+    """An upsert arrived before any full provider set was stored"""
+
+
+class ProviderStore:
+    """
+    The current snapshot for this worker. Another worker may have written a
+    newer one; current() remaps when the file on disk changed.
+    """
+
+    def __init__(self, path=MATCHING_SNAPSHOT_PATH):
+        self.path = path
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.snapshot
+        snapshot = self.snapshot
+        if snapshot is None or (stat.st_ino, stat.st_mtime_ns) != (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns):
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot is None or (stat.st_ino, stat.st_mtime_ns) != (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns):
+                    snapshot = self.snapshot = Snapshot(self.path)
+        return snapshot
+
+    def write(self, build):
+        """
+        Build a snapshot from the current one and persist it. The file lock
+        makes writers in different workers take turns, and the current
+        snapshot is re-read under it so no worker's update is lost.
+        """
+        with self.lock, open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            current = Snapshot(self.path) if os.path.exists(self.path) else None
+            columns, header = build(current)
+            write_snapshot(self.path, columns, header)
+            self.snapshot = Snapshot(self.path)
+        return self.snapshot
+
+    def replace(self, providers):
+        """Persist `providers` as the whole provider set"""
+        return self.write(lambda current: build_columns(providers))
+
+    def upsert(self, providers, removed_ids=()):
+        """
+        Persist the current set with `providers` added/updated and `removed_ids`
+        dropped. Only replace() creates the first snapshot: a set built from a
+        few upserted providers would look complete to /match/nearby.
+        """
+        def build(current):
+            if current is None:
+                raise NoSnapshot("No provider snapshot yet, sync providers first")
+            return merge_columns(current, providers, removed_ids)
+        return self.write(build)
+
+
+store = ProviderStore()